@@ -0,0 +1,83 @@
+"""
+Бенчмарк: асинхронное обновление курсов против локального asyncio-стаба.
+
+Запуск из корня проекта:
+    poetry run python -m benchmarks.async_update --coins 200 --delay-ms 50
+
+CoinGecko получает --coins монет, разбитых на запросы по --chunk; для
+каждого значения семафора провайдера выполняется --ticks обновлений
+через RatesUpdater.run_update_async с общим http-клиентом. Данные
+пишутся во временный каталог.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from valutatrade_hub.parser_service.async_http import AsyncHttpClient
+from valutatrade_hub.parser_service.updater import RatesUpdater
+
+from .stub_server import start_async_stub_server, stub_urls
+
+
+async def run(args: argparse.Namespace) -> None:
+    server, base_url = await start_async_stub_server(args.delay_ms / 1000)
+    updater = RatesUpdater()
+    for name, value in stub_urls(base_url).items():
+        setattr(updater.config, name, value)
+    updater.config.CRYPTO_ID_MAP = {f"C{i}": f"coin-{i}" for i in range(args.coins)}
+    updater.config.COINGECKO_IDS_PER_REQUEST = args.chunk
+
+    http = AsyncHttpClient(pool_size=max(args.concurrency))
+    try:
+        for concurrency in args.concurrency:
+            updater.config.ASYNC_PROVIDER_CONCURRENCY = concurrency
+            server.requests = 0
+            durations = []
+            for _ in range(args.ticks):
+                started = time.perf_counter()
+                rates = await updater.run_update_async(http=http)
+                durations.append((time.perf_counter() - started) * 1000)
+                if updater.last_tick["missing"]:
+                    raise RuntimeError(f"пропущены: {updater.last_tick['missing']}")
+            print(
+                f"concurrency {concurrency:3}  "
+                f"mean {statistics.mean(durations):8.2f} ms  "
+                f"min {min(durations):8.2f} ms  "
+                f"requests/tick {server.requests // args.ticks}  "
+                f"rates {len(rates)}"
+            )
+    finally:
+        await http.close()
+        server.close()
+        await server.wait_closed()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--coins", type=int, default=200)
+    parser.add_argument("--chunk", type=int, default=20)
+    parser.add_argument("--delay-ms", type=float, default=50.0)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 4, 10], metavar="N"
+    )
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, "data"))
+        previous = os.getcwd()
+        os.chdir(workdir)
+        try:
+            asyncio.run(run(args))
+        finally:
+            os.chdir(previous)
+
+
+if __name__ == "__main__":
+    main()
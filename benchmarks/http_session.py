@@ -0,0 +1,79 @@
+"""
+Бенчмарк: задержка обновления курсов с пулом соединений и без него.
+
+Запуск из корня проекта:
+    poetry run python -m benchmarks.http_session --ticks 50 --connect-delay-ms 20
+
+Без пула сессия закрывается после каждого обновления, как при прежних
+вызовах requests.get, и каждое обновление открывает новые соединения.
+"""
+
+import argparse
+import statistics
+import time
+from typing import Dict, List
+
+from valutatrade_hub.parser_service.api_clients import (
+    CoinGeckoClient,
+    ExchangeRateApiClient,
+)
+from valutatrade_hub.parser_service.config import ParserConfig
+
+from .stub_server import start_stub_server, stub_urls
+
+
+def run_ticks(config: ParserConfig, ticks: int, pooled: bool) -> List[float]:
+    """Выполняет ticks обновлений, возвращает длительность каждого в мс"""
+    clients = [CoinGeckoClient(config), ExchangeRateApiClient(config)]
+    durations = []
+    for _ in range(ticks):
+        started = time.perf_counter()
+        for client in clients:
+            if not client.fetch_rates():
+                raise RuntimeError(f"{type(client).__name__}: пустой ответ стаба")
+            if not pooled:
+                client.close()
+        durations.append((time.perf_counter() - started) * 1000)
+    for client in clients:
+        client.close()
+    return durations
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    ordered = sorted(durations)
+    return {
+        "mean_ms": round(statistics.mean(ordered), 3),
+        "p50_ms": round(ordered[len(ordered) // 2], 3),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95) - 1], 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument(
+        "--connect-delay-ms",
+        type=float,
+        default=20.0,
+        help="имитация TCP/TLS рукопожатия на каждое новое соединение",
+    )
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.connect_delay_ms / 1000)
+    config = ParserConfig(**stub_urls(base_url))
+    try:
+        for pooled in (False, True):
+            server.connections = 0
+            stats = summarize(run_ticks(config, args.ticks, pooled))
+            label = "pooled" if pooled else "no pool"
+            print(
+                f"{label:8} mean {stats['mean_ms']:8.2f} ms  "
+                f"p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+                f"connections {server.connections}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Локальный HTTP-стаб провайдеров курсов для бенчмарков
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+COINGECKO_PATH = "/api/v3/simple/price"
+EXCHANGERATE_PATH = "/v6/test/latest/USD"
+
+COINGECKO_BODY = {
+    "bitcoin": {"usd": 59337.21},
+    "ethereum": {"usd": 3720.0},
+    "solana": {"usd": 145.12},
+}
+EXCHANGERATE_BODY = {
+    "result": "success",
+    "base_code": "USD",
+    "time_last_update_utc": "Fri, 17 Oct 2025 00:00:01 +0000",
+    "time_next_update_utc": "Sat, 18 Oct 2025 00:00:01 +0000",
+    "conversion_rates": {
+        "USD": 1.0,
+        "EUR": 0.927,
+        "GBP": 0.787,
+        "RUB": 98.45,
+        "CNY": 7.23,
+        "JPY": 151.4,
+    },
+}
+
+
+def _etag(payload: bytes) -> str:
+    return '"' + hashlib.sha1(payload).hexdigest()[:16] + '"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Отдает фиксированные ответы CoinGecko и ExchangeRate-API"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        # Новое соединение: имитируем задержку TCP/TLS рукопожатия
+        super().setup()
+        self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def do_GET(self) -> None:
+        path = self.path.split("?", 1)[0]
+        if path == COINGECKO_PATH:
+            body = COINGECKO_BODY
+        elif path == EXCHANGERATE_PATH:
+            body = EXCHANGERATE_BODY
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode("utf-8")
+        etag = _etag(payload)
+        self.server.requests += 1
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start_stub_server(connect_delay: float = 0.0) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Запускает стаб в фоновом потоке.
+
+    Args:
+        connect_delay: Задержка на каждое новое соединение, секунды
+
+    Returns:
+        Сервер (server.connections и server.requests - число принятых
+        соединений и запросов) и базовый URL
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.connect_delay = connect_delay
+    server.connections = 0
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}"
+
+
+def stub_urls(base_url: str) -> Dict[str, str]:
+    """Значения COINGECKO_URL и EXCHANGERATE_API_URL для ParserConfig"""
+    return {
+        "COINGECKO_URL": f"{base_url}{COINGECKO_PATH}",
+        "EXCHANGERATE_API_URL": f"{base_url}{EXCHANGERATE_PATH}",
+    }
+
+
+def _coingecko_body(query: Dict[str, list]) -> Dict:
+    ids = query.get("ids", [""])[0].split(",")
+    known = {**COINGECKO_BODY}
+    return {
+        coin: known.get(coin, {"usd": float(sum(map(ord, coin)) % 997 + 1)})
+        for coin in ids
+        if coin
+    }
+
+
+async def start_async_stub_server(
+    response_delay: float = 0.0,
+) -> Tuple[asyncio.AbstractServer, str]:
+    """
+    Запускает стаб на asyncio в текущем цикле событий.
+
+    В отличие от потокового стаба, CoinGecko отвечает на любые ids (для
+    проверки разбиения запросов на части), а каждый ответ задерживается
+    на response_delay секунд. server.requests - число обработанных запросов.
+
+    Returns:
+        Сервер и базовый URL
+    """
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                _, target, _ = request_line.decode("latin-1").split(" ", 2)
+                parts = urlsplit(target)
+                server.requests += 1
+                await asyncio.sleep(response_delay)
+
+                if parts.path == COINGECKO_PATH:
+                    status, body = 200, _coingecko_body(parse_qs(parts.query))
+                elif parts.path == EXCHANGERATE_PATH:
+                    status, body = 200, EXCHANGERATE_BODY
+                else:
+                    status, body = 404, {"error": "not found"}
+                payload = gzip.compress(json.dumps(body).encode("utf-8"))
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    "Content-Type: application/json\r\n"
+                    "Content-Encoding: gzip\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            # Клиент закрыл соединение или стаб останавливается
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    server.requests = 0
+    host, port = server.sockets[0].getsockname()[:2]
+    return server, f"http://{host}:{port}"
@@ -0,0 +1,409 @@
+"""
+Набор микробенчмарков горячих путей с проверкой регрессий.
+
+Запуск из корня проекта:
+    make bench
+    poetry run python -m benchmarks.suite --users 1k 10k --history 10k
+    poetry run python -m benchmarks.suite --update-baseline
+
+Каждый сценарий идет в отдельном процессе со своим временным каталогом
+data/ (менеджеры - синглтоны с относительными путями):
+
+- users-<N>: N синтетических пользователей в users.json; измеряются
+  UserManager.login и register_user, PortfolioManager.buy_currency,
+  sell_currency и _get_rate_with_fallback;
+- history-<N>: N записей истории курсов; измеряются
+  RatesStorage.save_historical_record, load_history и потоковое
+  iter_history_filtered по одной паре;
+- updater: RatesUpdater.run_update против локального HTTP-стаба
+  провайдеров (stub_server.py).
+
+Результаты пишутся в JSON (--output) и сравниваются с сохраненной базой
+(--baseline) по медиане: операция медленнее базы больше чем на
+--threshold отмечается как регрессия, и команда завершается с кодом 1.
+Если базы нет, команда завершается с кодом 2: база зависит от машины и
+в репозиторий не входит, ее создает --update-baseline.
+Бэкенды хранения выбираются как обычно, переменными окружения
+VALUTATRADE_STORAGE_BACKEND и VALUTATRADE_HISTORY_BACKEND.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .http_session import summarize
+from .stub_server import start_stub_server, stub_urls
+
+DEFAULT_USERS = ["1k", "10k", "100k"]
+DEFAULT_HISTORY = ["10k", "1m"]
+DEFAULT_OUTPUT = os.path.join("benchmarks", "results", "latest.json")
+DEFAULT_BASELINE = os.path.join("benchmarks", "baseline.json")
+
+BENCH_PASSWORD = "bench-password"
+# Пары для _get_rate_with_fallback: прямые, обратные, кросс-курс и демо
+RATE_PAIRS = [("BTC", "USD"), ("USD", "EUR"), ("ETH", "EUR"), ("RUB", "CNY")]
+HISTORY_PAIRS = [
+    ("BTC", "USD", "CoinGecko"),
+    ("ETH", "USD", "CoinGecko"),
+    ("EUR", "USD", "ExchangeRate-API"),
+    ("RUB", "USD", "ExchangeRate-API"),
+]
+# Записей истории на одну операцию записи при заполнении
+_SEED_BATCH = 1000
+
+
+def parse_size(value: str) -> int:
+    """Размер набора данных: 1000, 10k, 1m"""
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = value[-1:].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+def _measure(call: Callable[[int], object], iterations: int) -> Dict[str, float]:
+    """Вызывает call(i) iterations раз, возвращает сводку по длительностям"""
+    durations = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        call(i)
+        durations.append((time.perf_counter() - started) * 1000)
+    stats = summarize(durations)
+    stats["iterations"] = iterations
+    stats["ops_per_sec"] = round(1000 / stats["mean_ms"], 1) if stats["mean_ms"] else 0
+    return stats
+
+
+def _in_workdir(scenario: Callable[..., Dict], *args) -> Dict:
+    """Выполняет сценарий во временном каталоге с пустым data/"""
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory(prefix="valutatrade-bench-") as workdir:
+        os.makedirs(os.path.join(workdir, "data"))
+        previous = os.getcwd()
+        os.chdir(workdir)
+        try:
+            # Сообщения приложения (print в клиентах API) не смешиваем с отчетом
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                return scenario(*args)
+        finally:
+            os.chdir(previous)
+
+
+def _stub_updater():
+    """RatesUpdater, опрашивающий локальный стаб вместо настоящих API"""
+    from valutatrade_hub.parser_service.updater import RatesUpdater
+
+    server, base_url = start_stub_server()
+    updater = RatesUpdater()
+    for name, value in stub_urls(base_url).items():
+        setattr(updater.config, name, value)
+    return server, updater
+
+
+# Сценарии (выполняются в дочернем процессе)
+
+
+def _seed_users(count: int) -> None:
+    """Пишет count пользователей напрямую в users.json"""
+    from valutatrade_hub.core.usecases import UserManager
+
+    registered = datetime.now().isoformat()
+    users = []
+    for user_id in range(1, count + 1):
+        salt = f"{user_id:016x}"
+        users.append(
+            {
+                "user_id": user_id,
+                "username": f"user{user_id}",
+                "hashed_password": UserManager._hash_password(BENCH_PASSWORD, salt),
+                "salt": salt,
+                "registration_date": registered,
+            }
+        )
+    with open(os.path.join("data", "users.json"), "w", encoding="utf-8") as f:
+        json.dump(users, f)
+
+
+def _bench_users(count: int, iterations: int) -> Dict:
+    from valutatrade_hub.core.usecases import PortfolioManager, UserManager
+
+    _seed_users(count)
+    server, updater = _stub_updater()
+    try:
+        # rates.json с курсами стаба для покупок и конвертации
+        updater.run_update()
+    finally:
+        updater.close()
+        server.shutdown()
+
+    users = UserManager()
+    portfolios = PortfolioManager()
+    rng = random.Random(count)
+    sample = [rng.randint(1, count) for _ in range(iterations)]
+    # Первое обращение строит индекс users.json - это не часть замера
+    users.login(f"user{sample[0]}", BENCH_PASSWORD)
+
+    results = {
+        "login": _measure(
+            lambda i: users.login(f"user{sample[i]}", BENCH_PASSWORD), iterations
+        ),
+        "register_user": _measure(
+            lambda i: users.register_user(f"new{i}", BENCH_PASSWORD), iterations
+        ),
+        "buy_currency": _measure(
+            lambda i: portfolios.buy_currency(sample[i], "BTC", 0.01), iterations
+        ),
+        "sell_currency": _measure(
+            lambda i: portfolios.sell_currency(sample[i], "BTC", 0.01), iterations
+        ),
+        "get_rate_with_fallback": _measure(
+            lambda i: portfolios._get_rate_with_fallback(
+                *RATE_PAIRS[i % len(RATE_PAIRS)]
+            ),
+            iterations,
+        ),
+    }
+    return results
+
+
+def _seed_history(storage, count: int) -> None:
+    """
+    Заполняет историю count записями: тик в секунду по всем парам.
+
+    Тики разные, а save_historical_records ставит одну метку на пачку,
+    поэтому пачки из нескольких тиков пишутся через RatesStorage._append.
+    """
+    from valutatrade_hub.parser_service.timestamps import from_epoch
+
+    ticks = max(1, count // len(HISTORY_PAIRS))
+    start = int(time.time()) - ticks
+    rng = random.Random(count)
+    batch: List[Dict] = []
+    for tick in range(ticks):
+        timestamp = from_epoch(start + tick)
+        for from_currency, to_currency, source in HISTORY_PAIRS:
+            batch.append(
+                storage._build_record(
+                    from_currency,
+                    to_currency,
+                    round(rng.uniform(0.5, 60000), 6),
+                    source,
+                    None,
+                    timestamp,
+                )
+            )
+        if len(batch) >= _SEED_BATCH:
+            storage._append(batch)
+            batch = []
+    if batch:
+        storage._append(batch)
+
+
+def _bench_history(count: int, iterations: int) -> Dict:
+    from valutatrade_hub.parser_service.config import ParserConfig
+    from valutatrade_hub.parser_service.storage import RatesStorage
+
+    storage = RatesStorage(ParserConfig())
+    _seed_history(storage, count)
+
+    # Полная загрузка больших историй идет секунды: повторов немного
+    load_iterations = max(3, min(iterations, 100_000 // max(count, 1)))
+    results = {
+        "save_historical_record": _measure(
+            lambda i: storage.save_historical_record(
+                "BTC", "USD", 60000.0 + i, "CoinGecko"
+            ),
+            iterations,
+        ),
+        "load_history": _measure(lambda i: storage.load_history(), load_iterations),
+        "iter_history_filtered": _measure(
+            lambda i: sum(1 for _ in storage.iter_history_filtered(pairs=["BTC_USD"])),
+            load_iterations,
+        ),
+    }
+    return results
+
+
+def _bench_updater(iterations: int) -> Dict:
+    server, updater = _stub_updater()
+    try:
+        updater.run_update()
+        return {"run_update": _measure(lambda i: updater.run_update(), iterations)}
+    finally:
+        updater.close()
+        server.shutdown()
+
+
+def run_users(count: int, iterations: int) -> Dict:
+    return _in_workdir(_bench_users, count, iterations)
+
+
+def run_history(count: int, iterations: int) -> Dict:
+    return _in_workdir(_bench_history, count, iterations)
+
+
+def run_updater(iterations: int) -> Dict:
+    return _in_workdir(_bench_updater, iterations)
+
+
+# Сравнение с базой
+
+
+def compare(
+    results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float
+) -> List[Tuple[str, str, float, float, float]]:
+    """
+    Сравнивает медианы операций с базой.
+
+    Returns:
+        Регрессии: (сценарий, операция, p50 базы, p50 сейчас, отношение)
+    """
+    regressions = []
+    for scenario, operations in results.items():
+        for operation, stats in operations.items():
+            base = baseline.get(scenario, {}).get(operation)
+            if not base or not base.get("p50_ms"):
+                continue
+            ratio = stats["p50_ms"] / base["p50_ms"]
+            if ratio > 1 + threshold:
+                regressions.append(
+                    (scenario, operation, base["p50_ms"], stats["p50_ms"], ratio)
+                )
+    return regressions
+
+
+def _load_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _write_json(path: str, payload: Dict) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def _print_scenario(
+    scenario: str, operations: Dict[str, Dict], baseline: Dict[str, Dict]
+) -> None:
+    print(f"\n{scenario}")
+    for operation, stats in operations.items():
+        base = baseline.get(scenario, {}).get(operation)
+        delta = ""
+        if base and base.get("p50_ms"):
+            delta = f"  ({(stats['p50_ms'] / base['p50_ms'] - 1) * 100:+6.1f}% p50)"
+        print(
+            f"  {operation:24} mean {stats['mean_ms']:10.3f} ms  "
+            f"p50 {stats['p50_ms']:10.3f} ms  p95 {stats['p95_ms']:10.3f} ms"
+            f"{delta}"
+        )
+
+
+def _scenarios(
+    args: argparse.Namespace,
+) -> Iterable[Tuple[str, Callable[..., Dict], tuple]]:
+    for size in args.users:
+        yield f"users-{size}", run_users, (parse_size(size), args.iterations)
+    for size in args.history:
+        yield f"history-{size}", run_history, (parse_size(size), args.iterations)
+    if not args.skip_updater:
+        yield "updater", run_updater, (args.iterations,)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", nargs="*", default=DEFAULT_USERS, metavar="N")
+    parser.add_argument("--history", nargs="*", default=DEFAULT_HISTORY, metavar="N")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--skip-updater", action="store_true")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="допустимое замедление медианы относительно базы (0.25 = 25%%)",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="сохранить результаты как новую базу",
+    )
+    args = parser.parse_args()
+
+    saved = _load_json(args.baseline)
+    baseline = (saved or {}).get("results", {})
+    results: Dict[str, Dict] = {}
+    spawn = multiprocessing.get_context("spawn")
+    for scenario, run, run_args in _scenarios(args):
+        started = time.perf_counter()
+        # Отдельный процесс: свежие синглтоны и кэши для каждого набора данных
+        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+            results[scenario] = pool.submit(run, *run_args).result()
+        _print_scenario(scenario, results[scenario], baseline)
+        print(f"  ({time.perf_counter() - started:.1f} s)")
+
+    payload = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "env": {
+            name: os.environ[name]
+            for name in (
+                "VALUTATRADE_STORAGE_BACKEND",
+                "VALUTATRADE_HISTORY_BACKEND",
+                "VALUTATRADE_PORTFOLIO_STORAGE",
+            )
+            if name in os.environ
+        },
+        "iterations": args.iterations,
+        "results": results,
+    }
+    _write_json(args.output, payload)
+    print(f"\nРезультаты: {args.output}")
+
+    if args.update_baseline:
+        _write_json(args.baseline, payload)
+        print(f"База обновлена: {args.baseline}")
+        return
+    if saved is None:
+        # Без базы проверка регрессий невозможна - это ошибка, а не успех
+        print(
+            f"\nОШИБКА: база {args.baseline} не найдена, сравнение невозможно.\n"
+            "Создайте ее на этой машине: make bench-baseline",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    regressions = compare(results, baseline, args.threshold)
+    if not regressions:
+        print(f"Регрессий нет (порог {args.threshold:.0%})")
+        return
+    print(f"\nРЕГРЕССИИ (медленнее базы больше чем на {args.threshold:.0%}):")
+    for scenario, operation, base_p50, p50, ratio in regressions:
+        print(
+            f"  {scenario}/{operation}: p50 {base_p50:.3f} -> {p50:.3f} ms "
+            f"(x{ratio:.2f})"
+        )
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
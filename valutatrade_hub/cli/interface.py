@@ -4,6 +4,7 @@
 """
 
 import shlex
+import sys
 from datetime import datetime
 from typing import Optional
 
@@ -11,15 +12,25 @@ from prettytable import PrettyTable
 from valutatrade_hub.core.currencies import get_all_currencies
 from valutatrade_hub.core.exceptions import (
     ApiRequestError,
+    ConcurrentUpdateError,
     CurrencyNotFoundError,
     InsufficientFundsError,
 )
 from valutatrade_hub.core.models import User
 from valutatrade_hub.core.usecases import PortfolioManager, UserManager
+from valutatrade_hub.core.valuation import PortfolioValuator
+from valutatrade_hub.infra.rates_cache import RatesCache
 
 from valutatrade_hub.parser_service.updater import RatesUpdater
 from valutatrade_hub.parser_service.storage import RatesStorage
 from valutatrade_hub.parser_service.config import ParserConfig
+from valutatrade_hub.parser_service.candles import INTERVALS, CandleAggregator
+from valutatrade_hub.parser_service.history_export import (
+    EXPORT_FORMATS,
+    export_history,
+)
+from valutatrade_hub.parser_service.retention import HistoryCompactor
+from valutatrade_hub.parser_service.timestamps import to_epoch
 # from valutatrade_hub.parser_service.scheduler import RatesScheduler
 
 
@@ -33,6 +44,8 @@ class CLIInterface:
         # Инициализация парсера
         self.rates_updater = RatesUpdater()
         self.rates_storage = RatesStorage(ParserConfig())
+        self.rates_cache = RatesCache()
+        self.candle_aggregator = CandleAggregator(self.rates_storage)
 
     def register(self, username: str, password: str) -> None:
         """Регистрация нового пользователя."""
@@ -148,7 +161,7 @@ class CLIInterface:
                 f" стало {result['new_balance']:.4f}"
             )
 
-        except (CurrencyNotFoundError, ValueError) as e:
+        except (CurrencyNotFoundError, ConcurrentUpdateError, ValueError) as e:
             print(f"Ошибка: {e}")
             if isinstance(e, CurrencyNotFoundError):
                 print("Используйте 'list-currencies' для списка доступных валют")
@@ -183,7 +196,12 @@ class CLIInterface:
                 f" - стало {result['new_balance']:.4f}"
             )
 
-        except (CurrencyNotFoundError, InsufficientFundsError, ValueError) as e:
+        except (
+            CurrencyNotFoundError,
+            ConcurrentUpdateError,
+            InsufficientFundsError,
+            ValueError,
+        ) as e:
             print(f"Ошибка: {e}")
             if isinstance(e, CurrencyNotFoundError):
                 print("Используйте 'list-currencies' для списка доступных валют")
@@ -272,9 +290,8 @@ class CLIInterface:
         base: str = "USD",
     ) -> None:
         """Показывает курсы из кэша"""
-        # Используем storage
-        # data = load_current_rates()
-        data = self.rates_storage.load_current_rates()
+        # Таблица курсов из общего кэша (перечитывается при изменении файла)
+        data = self.rates_cache.get_rates()
 
         if not data.get("pairs"):
             print("Кэш курсов пуст. Запустите 'update-rates'")
@@ -307,6 +324,192 @@ class CLIInterface:
 
         print(f"Всего: {len(sorted_pairs)} курсов")
 
+    def show_candles(
+        self,
+        pair: str,
+        interval: str = "1h",
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+    ) -> None:
+        """Показывает OHLC-свечи пары по истории курсов"""
+        try:
+            start = to_epoch(date_from) if date_from else None
+            end = to_epoch(date_to) if date_to else None
+        except ValueError:
+            print("Ошибка: даты --from/--to в формате YYYY-MM-DD[THH:MM:SSZ]")
+            return
+
+        try:
+            candles = self.candle_aggregator.get_candles(pair, interval, start, end)
+        except ValueError as e:
+            print(f"Ошибка: {e}")
+            return
+
+        if not candles:
+            print(f"Нет истории для пары {pair.upper()} за выбранный период")
+            return
+
+        table = PrettyTable()
+        table.field_names = ["Время", "Open", "High", "Low", "Close", "Тиков"]
+        for field in table.field_names[1:]:
+            table.align[field] = "r"
+        for candle in candles:
+            table.add_row(
+                [
+                    candle["time"],
+                    f"{candle['open']:.4f}",
+                    f"{candle['high']:.4f}",
+                    f"{candle['low']:.4f}",
+                    f"{candle['close']:.4f}",
+                    candle["ticks"],
+                ]
+            )
+        print(f"Свечи {pair.upper()} ({interval}):")
+        print(table)
+        print(f"Всего: {len(candles)} свечей")
+
+    def value_portfolios(self, base_currency: str = "USD", top: int = 10) -> None:
+        """Пакетная оценка всех портфелей: итоги пользователей и AUM по валютам"""
+        report = PortfolioValuator(self.portfolio_manager.converter).value_all(
+            base_currency
+        )
+        base = report["base_currency"]
+        totals = report["totals"]
+        if not totals:
+            print("Портфелей нет")
+            return
+
+        aum_table = PrettyTable()
+        aum_table.field_names = ["Валюта", f"AUM в {base}"]
+        aum_table.align["Валюта"] = "l"
+        aum_table.align[f"AUM в {base}"] = "r"
+        for code, value in sorted(report["aum"].items(), key=lambda item: -item[1]):
+            aum_table.add_row([code, f"{value:,.2f}"])
+        print(f"Активы под управлением (база: {base}):")
+        print(aum_table)
+
+        users_table = PrettyTable()
+        users_table.field_names = ["ID пользователя", f"Стоимость в {base}"]
+        users_table.align[f"Стоимость в {base}"] = "r"
+        ranked = sorted(totals.items(), key=lambda item: -item[1])
+        for user_id, value in ranked[:top]:
+            users_table.add_row([user_id, f"{value:,.2f}"])
+        print(f"Крупнейшие портфели ({min(top, len(ranked))} из {len(ranked)}):")
+        print(users_table)
+        print(f"\nИТОГО: {sum(totals.values()):,.2f} {base}")
+        if report["unpriced"]:
+            print(f"Нет курса к {base}: {', '.join(report['unpriced'])}")
+
+    def compact_history(self) -> None:
+        """Сворачивает старую историю курсов в ярусы свечей 1m/1h"""
+        compactor = HistoryCompactor(self.rates_storage)
+        print(
+            f"Компакция истории (тики {compactor.raw_days} дн., "
+            f"свечи 1m {compactor.minute_weeks} нед., 1h - всегда)..."
+        )
+        report = compactor.compact()
+        print(f"  Сырые тики хранятся с {report['raw_from']}")
+        print(f"  Свечи 1m хранятся с {report['minute_from']}")
+        print(
+            f"  Новых свечей: 1m - {report['candles_1m']}, 1h - {report['candles_1h']}"
+        )
+        print(
+            f"  Удалено: тиков - {report['raw_dropped']}, "
+            f"свечей 1m - {report['minute_dropped']}"
+        )
+        print(f"  Запечатано сегментов: {report['segments_sealed']}")
+        print(f"Готово за {report['elapsed']} с")
+
+    def export_history(
+        self,
+        fmt: str = "csv",
+        output: Optional[str] = None,
+        pairs: Optional[str] = None,
+        sources: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        chunk: Optional[int] = None,
+    ) -> None:
+        """Потоково выгружает историю курсов в CSV/NDJSON (stdout или файл)"""
+        if fmt not in EXPORT_FORMATS:
+            print(f"Ошибка: --format {'|'.join(EXPORT_FORMATS)}")
+            return
+        try:
+            start = to_epoch(date_from) if date_from else None
+            end = to_epoch(date_to) if date_to else None
+        except ValueError:
+            print("Ошибка: даты --from/--to в формате YYYY-MM-DD[THH:MM:SSZ]")
+            return
+        chunk = chunk or self.rates_storage.config.EXPORT_CHUNK_RECORDS
+        if chunk <= 0:
+            print("Ошибка: --chunk должен быть положительным")
+            return
+
+        records = self.rates_storage.iter_history_filtered(
+            pairs=pairs.split(",") if pairs else None,
+            sources=sources.split(",") if sources else None,
+            start=start,
+            end=end,
+        )
+        # При выгрузке в stdout прогресс идет в stderr, чтобы не портить данные
+        log = sys.stderr if output is None else sys.stdout
+
+        def progress(count: int) -> None:
+            print(f"\rВыгружено записей: {count}", end="", file=log, flush=True)
+
+        try:
+            if output is None:
+                total = export_history(records, sys.stdout, fmt, chunk, progress)
+            else:
+                with open(output, "w", encoding="utf-8", newline="") as f:
+                    total = export_history(records, f, fmt, chunk, progress)
+        except OSError as e:
+            print(f"\nОшибка записи: {e}", file=log)
+            return
+        if total:
+            print(file=log)
+        target = output or "stdout"
+        print(f"Выгружено {total} записей в {target} ({fmt})", file=log)
+
+    def show_provider_status(self) -> None:
+        """Состояние выключателей провайдеров курсов"""
+        # Файл состояния пишет любой процесс, выполняющий обновления
+        saved = self.rates_updater.breakers.load_snapshot()
+
+        table = PrettyTable()
+        table.field_names = [
+            "Провайдер",
+            "Состояние",
+            "Ошибок подряд",
+            "Всего ошибок",
+            "Успехов",
+            "Размыканий",
+            "Повтор после",
+            "Последняя ошибка",
+        ]
+        table.align["Провайдер"] = "l"
+        table.align["Последняя ошибка"] = "l"
+        for name in self.rates_updater.providers:
+            state = saved.get(name, {})
+            retry_at = state.get("retry_at")
+            table.add_row(
+                [
+                    name,
+                    state.get("state", "closed"),
+                    state.get("consecutive_failures", 0),
+                    state.get("total_failures", 0),
+                    state.get("total_successes", 0),
+                    state.get("trips", 0),
+                    (
+                        datetime.fromtimestamp(retry_at).strftime("%Y-%m-%d %H:%M:%S")
+                        if retry_at
+                        else "-"
+                    ),
+                    (state.get("last_error") or "-")[:40],
+                ]
+            )
+        print(table)
+
     def _print_help(self) -> None:
         """Выводит справку по командам"""
         print("\nДоступные команды:")
@@ -318,6 +521,18 @@ class CLIInterface:
         print("  get-rate --from <валюта> --to <валюта>")
         print("  update-rates [--source <coingecko|exchangerate>]")
         print("  show-rates [--currency <код>] [--top <N>] [--base <валюта>]")
+        print(
+            f"  candles --pair <FROM_TO> [--interval <{'|'.join(INTERVALS)}>]"
+            " [--from <дата>] [--to <дата>]"
+        )
+        print("  provider-status")
+        print("  value-portfolios [--base <валюта>] [--top <N>]")
+        print("  compact-history")
+        print(
+            f"  export-history [--format <{'|'.join(EXPORT_FORMATS)}>]"
+            " [--output <файл>] [--pair <FROM_TO[,...]>] [--source <имя[,...]>]"
+            " [--from <дата>] [--to <дата>] [--chunk <N>]"
+        )
         print("  list-currencies")
         print("  help")
         print("  exit")
@@ -330,6 +545,8 @@ class CLIInterface:
         print("  sell --currency RUS --amount 1000")
         print("  update-rates --source coingecko")
         print("  show-rates --top 5")
+        print("  candles --pair BTC_USD --interval 1h --from 2025-10-01")
+        print("  export-history --pair BTC_USD --from 2025-10-01 --output btc.csv")
         print("  show-portfolio")
         print("  show-portfolio --base USD")
 
@@ -460,6 +677,47 @@ class CLIInterface:
                     base = args.get("base", "USD")
                     self.show_rates(currency, top, base)
 
+                elif command == "provider-status":
+                    self.show_provider_status()
+
+                elif command == "value-portfolios":
+                    try:
+                        top = int(args["top"]) if "top" in args else 10
+                    except ValueError:
+                        print("Ошибка: top должен быть целым числом")
+                        continue
+                    self.value_portfolios(args.get("base", "USD"), top)
+
+                elif command == "compact-history":
+                    self.compact_history()
+
+                elif command == "export-history":
+                    try:
+                        chunk = int(args["chunk"]) if "chunk" in args else None
+                    except ValueError:
+                        print("Ошибка: chunk должен быть целым числом")
+                        continue
+                    self.export_history(
+                        args.get("format", "csv"),
+                        args.get("output"),
+                        args.get("pair"),
+                        args.get("source"),
+                        args.get("from"),
+                        args.get("to"),
+                        chunk,
+                    )
+
+                elif command == "candles":
+                    if "pair" in args:
+                        self.show_candles(
+                            args["pair"],
+                            args.get("interval", "1h"),
+                            args.get("from"),
+                            args.get("to"),
+                        )
+                    else:
+                        print("Ошибка: укажите --pair")
+
                 else:
                     print(f"Неизвестная команда: {command}")
                     print("Введите 'help' для списка команд")
@@ -470,6 +728,9 @@ class CLIInterface:
             except Exception as e:
                 print(f"Неожиданная ошибка: {e}")
 
+        # Закрываем соединения клиентов API
+        self.rates_updater.close()
+
 
 #    def _get_logger(self):
 #        """Возвращает логгер."""
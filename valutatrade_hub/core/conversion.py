@@ -0,0 +1,103 @@
+"""
+Кросс-курсы: матрица конвертации валют по известным парам
+"""
+
+from collections import deque
+from threading import Lock
+from typing import Dict, List, Optional
+
+from ..infra.rates_cache import RatesCache
+
+
+class ConversionMatrix:
+    """
+    Плотная матрица курсов валюта x валюта.
+
+    Строится по парам вида {"BTC_USD": {"rate": ...}}: каждая пара дает
+    ребро в обе стороны, а курс между любыми двумя валютами считается по
+    кратчайшему (по числу шагов) пути, например EUR -> USD -> BTC.
+    Поиск курса после построения - O(1).
+    """
+
+    def __init__(self, pairs: Dict[str, Dict]):
+        graph: Dict[str, Dict[str, float]] = {}
+        for pair, info in pairs.items():
+            try:
+                from_code, to_code = pair.upper().split("_")
+                rate = float(info["rate"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            if rate <= 0:
+                continue
+            graph.setdefault(from_code, {})[to_code] = rate
+            graph.setdefault(to_code, {}).setdefault(from_code, 1.0 / rate)
+
+        self.currencies: List[str] = sorted(graph)
+        self._index = {code: i for i, code in enumerate(self.currencies)}
+        self._matrix: List[List[Optional[float]]] = [
+            self._rates_from(code, graph) for code in self.currencies
+        ]
+
+    def _rates_from(
+        self, source: str, graph: Dict[str, Dict[str, float]]
+    ) -> List[Optional[float]]:
+        """Строка матрицы: обход в ширину от валюты source"""
+        row: List[Optional[float]] = [None] * len(self.currencies)
+        row[self._index[source]] = 1.0
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            current_rate = row[self._index[current]]
+            for neighbour, rate in graph[current].items():
+                position = self._index[neighbour]
+                if row[position] is None:
+                    row[position] = current_rate * rate
+                    queue.append(neighbour)
+        return row
+
+    def get_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Курс from -> to или None, если валюты не связаны"""
+        i = self._index.get(from_currency.upper())
+        j = self._index.get(to_currency.upper())
+        if i is None or j is None:
+            return None
+        return self._matrix[i][j]
+
+    def __contains__(self, currency_code: str) -> bool:
+        return currency_code.upper() in self._index
+
+
+class CurrencyConverter:
+    """Матрица кросс-курсов по rates.json, перестраиваемая при смене курсов"""
+
+    def __init__(self, rates_cache: Optional[RatesCache] = None):
+        self.rates_cache = rates_cache or RatesCache()
+        self._matrix = ConversionMatrix({})
+        self._version: Optional[int] = None
+        self._lock = Lock()
+
+    def get_matrix(self) -> ConversionMatrix:
+        """Актуальная матрица; перестраивается только при новой версии курсов"""
+        with self._lock:
+            pairs, version = self.rates_cache.get_pairs_versioned()
+            if version != self._version:
+                self._matrix = ConversionMatrix(pairs)
+                self._version = version
+            return self._matrix
+
+    def get_rate(self, from_currency: str, to_currency: str) -> Optional[float]:
+        """Курс from -> to с учетом кросс-курсов"""
+        if from_currency.upper() == to_currency.upper():
+            return 1.0
+        return self.get_matrix().get_rate(from_currency, to_currency)
+
+
+# Демо-курсы на случай, если rates.json пуст или в нем нет нужных валют
+DEMO_MATRIX = ConversionMatrix(
+    {
+        "BTC_USD": {"rate": 59337.21},
+        "ETH_USD": {"rate": 3720.00},
+        "EUR_USD": {"rate": 1.0786},
+        "RUB_USD": {"rate": 0.01016},
+    }
+)
@@ -38,6 +38,18 @@ class ApiRequestError(ValutaTradeError):
         super().__init__(f"Ошибка при обращении к внешнему API: {reason}")
 
 
+class ConcurrentUpdateError(ValutaTradeError):
+    """Портфель изменен параллельно, сохранение не удалось после повторов"""
+
+    def __init__(self, user_id: int, attempts: int):
+        self.user_id = user_id
+        self.attempts = attempts
+        super().__init__(
+            f"Портфель пользователя {user_id} изменяется параллельно, "
+            f"операция не выполнена после {attempts} попыток"
+        )
+
+
 class ValidationError(ValutaTradeError):
     """Ошибка валидации данных"""
 
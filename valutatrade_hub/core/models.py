@@ -7,6 +7,8 @@ import secrets
 from datetime import datetime
 from typing import Dict, Optional
 
+from .conversion import DEMO_MATRIX, CurrencyConverter
+
 
 class User:
     """Класс пользователя системы"""
@@ -154,9 +156,16 @@ class Wallet:
 class Portfolio:
     """Портфель пользователя со всеми кошельками"""
 
-    def __init__(self, user_id: int, wallets: Optional[Dict[str, Wallet]] = None):
+    def __init__(
+        self,
+        user_id: int,
+        wallets: Optional[Dict[str, Wallet]] = None,
+        version: int = 0,
+    ):
         self._user_id = user_id
         self._wallets = wallets or {}
+        # Версия сохраненного состояния, для проверки при записи
+        self.version = version
 
     @property
     def user_id(self) -> int:
@@ -178,31 +187,26 @@ class Portfolio:
         currency_code = currency_code.upper()
         return self._wallets.get(currency_code)
 
-    def get_total_value(self, base_currency: str = "USD") -> float:
-        """Рассчитывает общую стоимость портфеля в базовой валюте."""
+    def get_total_value(
+        self,
+        base_currency: str = "USD",
+        converter: Optional[CurrencyConverter] = None,
+    ) -> float:
+        """
+        Рассчитывает общую стоимость портфеля в базовой валюте.
+
+        Курсы берутся из rates.json (с кросс-курсами), при их отсутствии -
+        из демо-матрицы. Валюты без курса в сумму не входят.
+        """
+        converter = converter or CurrencyConverter()
+        base_currency = base_currency.upper()
         total_value = 0.0
-
-        # Фиксированные курсы валют для демонстрации
-        demo_rates = {
-            "BTC_USD": 59337.21,
-            "EUR_USD": 1.0786,
-            "RUB_USD": 0.01016,
-            "ETH_USD": 3720.00,
-            "USD_USD": 1.0,
-        }
-
         for currency_code, wallet in self._wallets.items():
-            if currency_code == base_currency:
-                total_value += wallet.balance
-            else:
-                rate_key = f"{currency_code}_{base_currency}"
-                if rate_key in demo_rates:
-                    total_value += wallet.balance * demo_rates[rate_key]
-                elif f"{base_currency}_{currency_code}" in demo_rates:
-                    # Обратный курс
-                    reverse_key = f"{base_currency}_{currency_code}"
-                    total_value += wallet.balance / demo_rates[reverse_key]
-
+            rate = converter.get_rate(currency_code, base_currency)
+            if rate is None:
+                rate = DEMO_MATRIX.get_rate(currency_code, base_currency)
+            if rate is not None:
+                total_value += wallet.balance * rate
         return total_value
 
     def to_dict(self) -> dict:
@@ -212,6 +216,7 @@ class Portfolio:
             "wallets": {
                 currency: wallet.to_dict() for currency, wallet in self._wallets.items()
             },
+            "version": self.version,
         }
 
     @classmethod
@@ -220,4 +225,6 @@ class Portfolio:
         wallets = {}
         for currency, wallet_data in data.get("wallets", {}).items():
             wallets[currency] = Wallet.from_dict(wallet_data)
-        return cls(user_id=data["user_id"], wallets=wallets)
+        return cls(
+            user_id=data["user_id"], wallets=wallets, version=data.get("version", 0)
+        )
@@ -2,17 +2,35 @@
 Бизнес-логика приложения
 """
 
+import random
 import secrets
+import time
 from datetime import datetime
-from typing import Dict, Optional
+from threading import Lock
+from typing import Callable, Dict, Optional, TypeVar
+from weakref import WeakValueDictionary
 
 from ..decorators import log_action
 from ..infra.settings import SettingsLoader
 from ..infra.database import DatabaseManager
+from ..infra.rates_cache import RatesCache
+from .conversion import DEMO_MATRIX, CurrencyConverter
 from .currencies import get_currency
-from .exceptions import CurrencyNotFoundError, InsufficientFundsError
+from .exceptions import (
+    ConcurrentUpdateError,
+    CurrencyNotFoundError,
+    InsufficientFundsError,
+)
 from .models import Portfolio, User
 
+T = TypeVar("T")
+
+# Сколько раз перечитывать портфель при конфликте версий
+MAX_SAVE_ATTEMPTS = 5
+# Пауза между попытками: база, удваиваемая с каждой попыткой, плюс случайный
+# разброс, чтобы конкурирующие процессы не сталкивались снова синхронно
+SAVE_RETRY_BASE_DELAY = 0.01
+
 
 class UserManager:
     """Менеджер пользователей"""
@@ -30,25 +48,23 @@ class UserManager:
         if len(password) < 4:
             raise ValueError("Пароль должен быть не короче 4 символов")
 
-        users_data = self.db.load("users.json", [])
-
-        # Проверка уникальности имени
-        for user in users_data:
-            if user["username"] == username:
-                raise ValueError(f"Имя пользователя '{username}' уже занято")
-
         # Создание пользователя
-        user_id = self.db.get_next_user_id()
         salt = secrets.token_hex(8)
         hashed_password = self._hash_password(password, salt)
         registration_date = datetime.now()
 
+        # Хранилище проверяет уникальность имени и выдает ID атомарно
+        # с записью (ValueError, если имя уже занято)
+        user_id = self.db.add_user(
+            {
+                "username": username,
+                "hashed_password": hashed_password,
+                "salt": salt,
+                "registration_date": registration_date.isoformat(),
+            }
+        )
         user = User(user_id, username, hashed_password, salt, registration_date)
 
-        # Сохранение
-        users_data.append(user.to_dict())
-        self.db.save("users.json", users_data)
-
         # Создание пустого портфеля
         self._create_user_portfolio(user_id)
 
@@ -57,18 +73,16 @@ class UserManager:
     @log_action("LOGIN")
     def login(self, username: str, password: str) -> User:
         """Аутентификация пользователя"""
-        users_data = self.db.load("users.json", [])
+        user_data = self.db.find_user_by_username(username)
+        if user_data is None:
+            raise ValueError(f"Пользователь '{username}' не найден")
 
-        for user_data in users_data:
-            if user_data["username"] == username:
-                user = User.from_dict(user_data)
-                if user.verify_password(password):
-                    self.current_user = user
-                    return user
-                else:
-                    raise ValueError("Неверный пароль")
+        user = User.from_dict(user_data)
+        if not user.verify_password(password):
+            raise ValueError("Неверный пароль")
 
-        raise ValueError(f"Пользователь '{username}' не найден")
+        self.current_user = user
+        return user
 
     def logout(self) -> None:
         """Выход из системы."""
@@ -76,17 +90,13 @@ class UserManager:
 
     def _create_user_portfolio(self, user_id: int) -> None:
         """Создает пустой портфель для пользователя."""
-        portfolios_data = self.db.load("portfolios.json", [])
-
         # Проверяем, не существует ли уже портфель
-        for portfolio in portfolios_data:
-            if portfolio["user_id"] == user_id:
-                return
+        if self.db.load_portfolio(user_id) is not None:
+            return
 
         # Создаем новый портфель
         portfolio = Portfolio(user_id)
-        portfolios_data.append(portfolio.to_dict())
-        self.db.save("portfolios.json", portfolios_data)
+        self.db.save_portfolio(portfolio.to_dict())
 
     @staticmethod
     def _hash_password(password: str, salt: str) -> str:
@@ -97,25 +107,63 @@ class UserManager:
 
 
 class PortfolioManager:
-    """Менеджер портфелей"""
+    """
+    Менеджер портфелей.
+
+    Сделки одного пользователя в процессе идут по очереди (таблица
+    блокировок по user_id), сделки разных пользователей - параллельно.
+    Между процессами потерянные обновления исключает проверка версии
+    портфеля при сохранении: при конфликте сделка повторяется на свежих
+    данных.
+    """
+
+    # Блокировка живет, пока ее держит хотя бы одна сделка, поэтому
+    # словарь не растет с числом пользователей
+    _user_locks: "WeakValueDictionary[int, Lock]" = WeakValueDictionary()
+    _user_locks_guard = Lock()
 
     def __init__(self):
         self.db = DatabaseManager()
         self.settings = SettingsLoader()
+        self.rates_cache = RatesCache()
+        self.converter = CurrencyConverter(self.rates_cache)
 
     def get_user_portfolio(self, user_id: int) -> Portfolio:
         """Получает портфель пользователя."""
-        portfolios_data = self.db.load("portfolios.json", [])
-
-        for portfolio_data in portfolios_data:
-            if portfolio_data["user_id"] == user_id:
-                return Portfolio.from_dict(portfolio_data)
+        portfolio_data = self.db.load_portfolio(user_id)
+        if portfolio_data is not None:
+            return Portfolio.from_dict(portfolio_data)
 
         # Если портфель не найден, создаем новый
         portfolio = Portfolio(user_id)
-        self._save_portfolio(portfolio)
+        if not self._save_portfolio(portfolio):
+            # Портфель успел создать другой процесс
+            return Portfolio.from_dict(self.db.load_portfolio(user_id))
         return portfolio
 
+    @classmethod
+    def _user_lock(cls, user_id: int) -> Lock:
+        """Блокировка сделок пользователя внутри процесса"""
+        with cls._user_locks_guard:
+            return cls._user_locks.setdefault(user_id, Lock())
+
+    def _update_portfolio(self, user_id: int, change: Callable[[Portfolio], T]) -> T:
+        """
+        Читает портфель, применяет change и сохраняет с проверкой версии.
+
+        Если портфель успели изменить, change повторяется на свежих данных.
+        """
+        with self._user_lock(user_id):
+            for attempt in range(MAX_SAVE_ATTEMPTS):
+                if attempt:
+                    delay = SAVE_RETRY_BASE_DELAY * 2 ** (attempt - 1)
+                    time.sleep(delay * random.uniform(0.5, 1.5))
+                portfolio = self.get_user_portfolio(user_id)
+                result = change(portfolio)
+                if self._save_portfolio(portfolio):
+                    return result
+        raise ConcurrentUpdateError(user_id, MAX_SAVE_ATTEMPTS)
+
     @log_action("BUY", verbose=True)
     def buy_currency(self, user_id: int, currency_code: str, amount: float) -> Dict:
         """Покупка валюты."""
@@ -127,18 +175,19 @@ class PortfolioManager:
         except CurrencyNotFoundError as e:
             raise e
 
-        portfolio = self.get_user_portfolio(user_id)
         currency_code = currency_code.upper()
 
-        # Добавляем валюту, если её нет
-        if currency_code not in portfolio.wallets:
-            portfolio.add_currency(currency_code)
+        def deposit(portfolio: Portfolio):
+            # Добавляем валюту, если её нет
+            if currency_code not in portfolio.wallets:
+                portfolio.add_currency(currency_code)
 
-        wallet = portfolio.get_wallet(currency_code)
-        old_balance = wallet.balance
-        wallet.deposit(amount)
+            wallet = portfolio.get_wallet(currency_code)
+            old_balance = wallet.balance
+            wallet.deposit(amount)
+            return wallet, old_balance
 
-        self._save_portfolio(portfolio)
+        wallet, old_balance = self._update_portfolio(user_id, deposit)
 
         # Рассчитываем стоимость
         rate = self._get_rate_with_fallback(currency_code, "USD")
@@ -165,21 +214,22 @@ class PortfolioManager:
         except CurrencyNotFoundError as e:
             raise e
 
-        portfolio = self.get_user_portfolio(user_id)
         currency_code = currency_code.upper()
 
-        wallet = portfolio.get_wallet(currency_code)
-        if not wallet:
-            raise ValueError(f"У вас нет кошелька для валюты '{currency_code}'")
+        def withdraw(portfolio: Portfolio):
+            wallet = portfolio.get_wallet(currency_code)
+            if not wallet:
+                raise ValueError(f"У вас нет кошелька для валюты '{currency_code}'")
 
-        old_balance = wallet.balance
+            old_balance = wallet.balance
 
-        try:
-            wallet.withdraw(amount)
-        except InsufficientFundsError as e:
-            raise e
+            try:
+                wallet.withdraw(amount)
+            except InsufficientFundsError as e:
+                raise e
+            return wallet, old_balance
 
-        self._save_portfolio(portfolio)
+        wallet, old_balance = self._update_portfolio(user_id, withdraw)
 
         # Рассчитываем выручку
         rate = self._get_rate_with_fallback(currency_code, "USD")
@@ -195,63 +245,27 @@ class PortfolioManager:
             "new_balance": wallet.balance,
         }
 
-    def _save_portfolio(self, portfolio: Portfolio) -> None:
-        """Сохраняет портфель"""
-        portfolios_data = self.db.load("portfolios.json", [])
-
-        found = False
-        for i, portfolio_data in enumerate(portfolios_data):
-            if portfolio_data["user_id"] == portfolio.user_id:
-                portfolios_data[i] = portfolio.to_dict()
-                found = True
-                break
-
-        if not found:
-            portfolios_data.append(portfolio.to_dict())
-
-        self.db.save("portfolios.json", portfolios_data)
+    def _save_portfolio(self, portfolio: Portfolio) -> bool:
+        """Сохраняет портфель, если его версия не изменилась с момента чтения"""
+        if not self.db.save_portfolio(
+            portfolio.to_dict(), expected_version=portfolio.version
+        ):
+            return False
+        portfolio.version += 1
+        return True
 
     def _get_rate_with_fallback(
         self, from_currency: str, to_currency: str
     ) -> Optional[float]:
         """Получает курс с обработкой ошибок"""
         try:
-            # Пытаемся загрузить актуальные курсы из rates.json
-            import json
-
-            try:
-                with open("data/rates.json", "r", encoding="utf-8") as f:
-                    rates_data = json.load(f)
-
-                rate_key = f"{from_currency}_{to_currency}"
-                if rate_key in rates_data.get("pairs", {}):
-                    return rates_data["pairs"][rate_key]["rate"]
-
-                # Пробуем обратный курс
-                reverse_key = f"{to_currency}_{from_currency}"
-                if reverse_key in rates_data.get("pairs", {}):
-                    return 1.0 / rates_data["pairs"][reverse_key]["rate"]
-
-            except (FileNotFoundError, json.JSONDecodeError):
-                pass  # Файла нет, используем демо-данные ниже
+            # Актуальные курсы из rates.json, включая кросс-курсы через базу
+            rate = self.converter.get_rate(from_currency, to_currency)
+            if rate is not None:
+                return rate
 
             # Демо-данные как fallback
-            demo_rates = {
-                "BTC_USD": 59337.21,
-                "ETH_USD": 3720.00,
-                "EUR_USD": 1.0786,
-                "RUB_USD": 0.01016,
-                "USD_USD": 1.0,
-            }
-
-            if rate_key in demo_rates:
-                return demo_rates[rate_key]
-
-            reverse_key = f"{to_currency}_{from_currency}"
-            if reverse_key in demo_rates:
-                return 1.0 / demo_rates[reverse_key]
-
-            return None
+            return DEMO_MATRIX.get_rate(from_currency, to_currency)
 
         except Exception as e:
             print(f"Ошибка получения курса: {e}")
@@ -7,6 +7,8 @@ import os
 from datetime import datetime, timedelta
 from typing import Any, Dict
 
+from ..infra.rates_cache import RatesCache
+from .conversion import DEMO_MATRIX, CurrencyConverter
 from .exceptions import CurrencyNotFoundError
 
 
@@ -57,10 +59,12 @@ class ExchangeRateService:
 
     def __init__(self, data_manager: DataManager):
         self.data_manager = data_manager
+        self.rates_cache = RatesCache()
+        self.converter = CurrencyConverter(self.rates_cache)
 
     def get_rates(self) -> Dict:
-        """Загружает котировки из rates.json"""
-        rates = self.data_manager.load_json("rates.json", {})
+        """Загружает котировки из rates.json (через общий кэш)"""
+        rates = self.rates_cache.get_rates()
         if not rates:
             return {"pairs": {}, "last_refresh": None}
         return rates
@@ -73,30 +77,15 @@ class ExchangeRateService:
         if from_currency == to_currency:
             return 1.0
 
-        rates = self.get_rates()
-
-        # Прямой курс
-        rate_key = f"{from_currency}_{to_currency}"
-        if rate_key in rates.get("pairs", {}):
-            return rates["pairs"][rate_key]["rate"]
-
-        # Обратный курс
-        reverse_key = f"{to_currency}_{from_currency}"
-        if reverse_key in rates.get("pairs", {}):
-            return 1.0 / rates["pairs"][reverse_key]["rate"]
+        # Прямой, обратный или кросс-курс по актуальным данным
+        rate = self.converter.get_rate(from_currency, to_currency)
+        if rate is not None:
+            return rate
 
         # Если курс не найден, используем демо-курсы
-        demo_rates = {
-            "BTC_USD": 59337.21,
-            "EUR_USD": 1.0786,
-            "RUB_USD": 0.01016,
-            "ETH_USD": 3720.00,
-        }
-
-        if rate_key in demo_rates:
-            return demo_rates[rate_key]
-        elif reverse_key in demo_rates:
-            return 1.0 / demo_rates[reverse_key]
+        rate = DEMO_MATRIX.get_rate(from_currency, to_currency)
+        if rate is not None:
+            return rate
 
         raise CurrencyNotFoundError(f"{from_currency} или {to_currency}")
 
@@ -114,10 +103,11 @@ class ExchangeRateService:
 
     def update_rates(self, new_rates: Dict):
         """Обновляет курсы валют"""
-        current_rates = self.get_rates()
+        current_rates = dict(self.get_rates())
         current_rates.update(new_rates)
         current_rates["last_refresh"] = datetime.now().isoformat()
         self.data_manager.save_json("rates.json", current_rates)
+        self.rates_cache.invalidate()
 
 
 # def validate_currency_code(currency_code: str) -> bool:
@@ -0,0 +1,107 @@
+"""
+Пакетная оценка всех портфелей платформы
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+from ..infra.database import DatabaseManager
+from .conversion import DEMO_MATRIX, CurrencyConverter
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: есть реализация на чистом Python
+    np = None
+
+
+class PortfolioValuator:
+    """
+    Оценка портфелей всех пользователей в одной базовой валюте.
+
+    Балансы собираются в матрицу пользователи x валюты, курсы - в вектор
+    "валюта -> база"; итоги по пользователям - это произведение матрицы на
+    вектор, активы под управлением (AUM) по валютам - сумма столбцов,
+    умноженная на курс. С NumPy расчет векторизован.
+    """
+
+    def __init__(self, converter: Optional[CurrencyConverter] = None):
+        self.db = DatabaseManager()
+        self.converter = converter or CurrencyConverter()
+
+    def _rate_to_base(self, currency_code: str, base_currency: str) -> Optional[float]:
+        rate = self.converter.get_rate(currency_code, base_currency)
+        if rate is None:
+            rate = DEMO_MATRIX.get_rate(currency_code, base_currency)
+        return rate
+
+    def value_all(self, base_currency: str = "USD") -> Dict:
+        """Оценивает все портфели из хранилища"""
+        return self.value_portfolios(self.db.iter_portfolios(), base_currency)
+
+    def value_portfolios(
+        self, portfolios: Iterable[Dict], base_currency: str = "USD"
+    ) -> Dict:
+        """
+        Оценивает набор портфелей (в формате Portfolio.to_dict).
+
+        Returns:
+            Словарь с ключами base_currency, totals (user_id -> стоимость),
+            aum (валюта -> стоимость в базе) и unpriced (валюты без курса)
+        """
+        base_currency = base_currency.upper()
+        user_ids: List[int] = []
+        currency_index: Dict[str, int] = {}
+        # Разреженные строки: (индекс валюты, баланс)
+        rows: List[List[tuple]] = []
+
+        for portfolio in portfolios:
+            row = []
+            for code, wallet in portfolio.get("wallets", {}).items():
+                code = code.upper()
+                if code not in currency_index:
+                    currency_index[code] = len(currency_index)
+                row.append((currency_index[code], float(wallet.get("balance", 0.0))))
+            user_ids.append(portfolio["user_id"])
+            rows.append(row)
+
+        currencies = list(currency_index)
+        rates = [self._rate_to_base(code, base_currency) for code in currencies]
+        unpriced = [code for code, rate in zip(currencies, rates) if rate is None]
+        rate_vector = [rate if rate is not None else 0.0 for rate in rates]
+
+        if np is not None:
+            totals, aum = self._compute_numpy(rows, len(currencies), rate_vector)
+        else:
+            totals, aum = self._compute_python(rows, len(currencies), rate_vector)
+
+        return {
+            "base_currency": base_currency,
+            "totals": dict(zip(user_ids, totals)),
+            "aum": dict(zip(currencies, aum)),
+            "unpriced": unpriced,
+        }
+
+    @staticmethod
+    def _compute_numpy(rows, n_currencies: int, rate_vector: List[float]):
+        balances = np.zeros((len(rows), n_currencies), dtype=np.float64)
+        for i, row in enumerate(rows):
+            for j, balance in row:
+                # Кошельки, совпавшие после upper(), суммируются, как в
+                # _compute_python
+                balances[i, j] += balance
+        rates = np.asarray(rate_vector, dtype=np.float64)
+        totals = balances @ rates
+        aum = balances.sum(axis=0) * rates
+        return totals.tolist(), aum.tolist()
+
+    @staticmethod
+    def _compute_python(rows, n_currencies: int, rate_vector: List[float]):
+        totals = []
+        column_sums = [0.0] * n_currencies
+        for row in rows:
+            total = 0.0
+            for j, balance in row:
+                total += balance * rate_vector[j]
+                column_sums[j] += balance
+            totals.append(total)
+        aum = [amount * rate for amount, rate in zip(column_sums, rate_vector)]
+        return totals, aum
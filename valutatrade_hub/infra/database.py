@@ -1,16 +1,27 @@
 """
-Singleton для управления базой данных (JSON)
+Singleton для управления базой данных (JSON или SQLite)
 """
 
-import json
 import os
-from typing import Any
+from typing import Any, Dict, Iterator, Optional
 from threading import Lock
+
+from .json_store import JsonStore
+from .settings import SettingsLoader
+from .sqlite_store import SqliteStore
+
 # from .settings import DATA_DIR  # Импортируем константу
 
 
 class DatabaseManager:
-    """Singleton для работы с JSON базой данных"""
+    """
+    Singleton для работы с базой данных.
+
+    Хранилище выбирается настройкой storage_backend: "json" (файлы в
+    каталоге данных) или "sqlite" (одна база в режиме WAL). Интерфейс
+    load/save/update одинаков для обоих, индексированные методы
+    find_user_by_username и load_portfolio используются менеджерами.
+    """
 
     _instance = None
     _lock = Lock()
@@ -24,60 +35,77 @@ class DatabaseManager:
 
     def __init__(self):
         if not self._initialized:
+            settings = SettingsLoader()
             self.data_dir = "data"  # Прямо прописываем
-            self._ensure_data_dir()
+            self.json_store = JsonStore(
+                self.data_dir,
+                portfolios_sharded=(
+                    settings.get("portfolio_storage", "sharded") == "sharded"
+                ),
+                group_commit_ms=settings.get("group_commit_ms", 0),
+                lock_warn_wait_ms=settings.get("lock_wait_warn_ms", 100),
+            )
+            self.backend = settings.get("storage_backend", "json")
+            if self.backend == "sqlite":
+                self.store = SqliteStore(
+                    os.path.join(
+                        self.data_dir, settings.get("sqlite_file", "valutatrade.db")
+                    )
+                )
+                self.store.import_from_json(self.json_store)
+            else:
+                self.store = self.json_store
             self._initialized = True
 
-    def _ensure_data_dir(self) -> None:
-        """Создает директорию для данных, если её нет"""
-        if not os.path.exists(self.data_dir):
-            os.makedirs(self.data_dir)
-
-    def _get_file_path(self, filename: str) -> str:
-        """Возвращает полный путь к файлу"""
-        return os.path.join(self.data_dir, filename)
-
     def load(self, filename: str, default: Any = None) -> Any:
-        """Загружает данные из JSON файла"""
-        filepath = self._get_file_path(filename)
-        if not os.path.exists(filepath):
-            return default if default is not None else []
-
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return default if default is not None else []
+        """Загружает данные по имени файла"""
+        return self.store.load(filename, default)
 
     def save(self, filename: str, data: Any) -> None:
-        """Сохраняет данные в JSON файл"""
-        filepath = self._get_file_path(filename)
-
-        with self._lock:
-            with open(filepath, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False, default=str)
+        """Сохраняет данные по имени файла"""
+        self.store.save(filename, data)
 
     def update(
         self, filename: str, key: str, value: Any, id_field: str = "user_id"
     ) -> bool:
         """Обновляет запись в файле по ключу"""
-        data = self.load(filename, [])
+        return self.store.update(filename, key, value, id_field)
 
-        if isinstance(data, list):
-            for i, item in enumerate(data):
-                if isinstance(item, dict) and item.get(id_field) == key:
-                    if isinstance(value, dict):
-                        data[i].update(value)
-                    else:
-                        data[i] = value
-                    self.save(filename, data)
-                    return True
+    def lock_stats(self) -> Dict[str, Dict[str, float]]:
+        """Ожидание и удержание блокировки каталога данных (JSON-хранилище)"""
+        return self.json_store.file_lock.stats()
 
-        return False
+    # Пользователи
 
     def get_next_user_id(self) -> int:
         """Генерирует следующий ID пользователя"""
-        users = self.load("users.json", [])
-        if not users:
-            return 1
-        return max(user.get("user_id", 0) for user in users) + 1
+        return self.store.get_next_user_id()
+
+    def find_user_by_username(self, username: str) -> Optional[Dict]:
+        """Ищет пользователя по имени"""
+        return self.store.find_user_by_username(username)
+
+    def add_user(self, user_data: Dict) -> int:
+        """Добавляет нового пользователя и возвращает выданный ему ID"""
+        return self.store.add_user(user_data)
+
+    # Портфели
+
+    def load_portfolio(self, user_id: int) -> Optional[Dict]:
+        """Загружает портфель пользователя или возвращает None"""
+        return self.store.load_portfolio(user_id)
+
+    def save_portfolio(
+        self, portfolio_data: Dict, expected_version: Optional[int] = None
+    ) -> bool:
+        """
+        Сохраняет портфель одного пользователя.
+
+        При заданной expected_version запись выполняется, только если
+        сохраненная версия портфеля не изменилась (иначе возвращает False).
+        """
+        return self.store.save_portfolio(portfolio_data, expected_version)
+
+    def iter_portfolios(self) -> Iterator[Dict]:
+        """Перебирает все портфели"""
+        return self.store.iter_portfolios()
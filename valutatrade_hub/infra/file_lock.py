@@ -0,0 +1,123 @@
+"""
+Межпроцессная блокировка каталога данных (fcntl.flock)
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+LOCK_FILE = ".lock"
+
+
+class DirectoryLock:
+    """
+    Разделяемая/исключительная блокировка каталога данных.
+
+    Блокировка берется через flock на файле data_dir/.lock, поэтому действует
+    между процессами (планировщик, несколько CLI, пакетные задачи). У каждого
+    захвата свой дескриптор, так что потоки одного процесса тоже исключают
+    друг друга. Повторный захват в том же потоке вложенный: внутри
+    исключительной блокировки можно брать любую, внутри разделяемой - только
+    разделяемую.
+
+    Время ожидания и удержания копится в stats(); ожидание дольше
+    warn_wait_ms пишется в лог. Без fcntl блокировка ничего не делает.
+
+    Через lock_file можно завести отдельную блокировку для части каталога
+    (например, для файла одного пользователя).
+    """
+
+    def __init__(
+        self, data_dir: str, warn_wait_ms: float = 100, lock_file: str = LOCK_FILE
+    ):
+        self.path = os.path.join(data_dir, lock_file)
+        self.warn_wait = warn_wait_ms / 1000
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {
+            mode: {
+                "acquisitions": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+                "hold_total": 0.0,
+                "hold_max": 0.0,
+            }
+            for mode in ("shared", "exclusive")
+        }
+
+    @property
+    def held(self) -> bool:
+        """Держит ли текущий поток блокировку"""
+        return getattr(self._local, "depth", 0) > 0
+
+    @contextmanager
+    def _acquire(self, mode: str) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+
+        depth = getattr(self._local, "depth", 0)
+        if depth:
+            if mode == "exclusive" and self._local.mode == "shared":
+                raise RuntimeError(
+                    "Нельзя повысить разделяемую блокировку до исключительной"
+                )
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        started = time.perf_counter()
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if mode == "exclusive" else fcntl.LOCK_SH)
+        except BaseException:
+            os.close(fd)
+            raise
+        acquired = time.perf_counter()
+        self._local.depth = 1
+        self._local.mode = mode
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self._record(mode, acquired - started, time.perf_counter() - acquired)
+
+    def _record(self, mode: str, wait: float, hold: float) -> None:
+        with self._stats_lock:
+            stats = self._stats[mode]
+            stats["acquisitions"] += 1
+            stats["wait_total"] += wait
+            stats["wait_max"] = max(stats["wait_max"], wait)
+            stats["hold_total"] += hold
+            stats["hold_max"] = max(stats["hold_max"], hold)
+        if wait >= self.warn_wait:
+            self.logger.warning(
+                f"Ожидание блокировки {self.path} ({mode}): {wait * 1000:.1f} мс"
+            )
+
+    def shared(self):
+        """Блокировка для чтения: читатели не мешают друг другу"""
+        return self._acquire("shared")
+
+    def exclusive(self):
+        """Блокировка для записи: исключает всех читателей и писателей"""
+        return self._acquire("exclusive")
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Счетчики захватов, суммарное и максимальное время ожидания/удержания"""
+        with self._stats_lock:
+            return {mode: dict(values) for mode, values in self._stats.items()}
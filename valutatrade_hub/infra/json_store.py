@@ -0,0 +1,525 @@
+"""
+Хранилище данных в JSON файлах
+"""
+
+import json
+import os
+import stat
+import tempfile
+import time
+from threading import Event, Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .file_lock import DirectoryLock
+from .user_index import UsernameIndex
+
+USERS_FILE = "users.json"
+PORTFOLIOS_FILE = "portfolios.json"
+PORTFOLIO_SHARDS_DIR = "portfolios"
+MIGRATION_MARKER = "_migrated.json"
+
+# umask процесса читается один раз: os.umask меняет его для всех потоков
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _file_mode(filepath: str) -> int:
+    """Права для файла: как у существующего или 0666 за вычетом umask"""
+    try:
+        return stat.S_IMODE(os.stat(filepath).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+def write_atomic(filepath: str, payload: bytes) -> None:
+    """
+    Записывает файл атомарно: временный файл, fsync, os.replace.
+
+    После сбоя на диске остается либо старое, либо новое содержимое
+    целиком, но не обрезанный файл.
+    """
+    directory = os.path.dirname(filepath) or "."
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f".{os.path.basename(filepath)}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # mkstemp создает файл с правами 0600 - возвращаем права
+            # заменяемого файла или обычные для нового (0666 с учетом umask)
+            os.fchmod(f.fileno(), _file_mode(filepath))
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def fsync_directory(directory: str) -> None:
+    """Сбрасывает на диск запись каталога (фиксирует переименования)"""
+    try:
+        fd = os.open(directory or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # Не все платформы позволяют fsync каталога
+        pass
+    finally:
+        os.close(fd)
+
+
+class _CommitBatch:
+    """Группа сохранений, записываемых на диск одним проходом"""
+
+    def __init__(self):
+        self.pending: Dict[str, bytes] = {}
+        self.done = Event()
+        self.error: Optional[BaseException] = None
+
+
+class JsonStore:
+    """
+    Работа с JSON файлами в каталоге данных.
+
+    Каждое сохранение атомарно (временный файл + fsync + os.replace). При
+    group_commit_ms > 0 сохранения, пришедшие в пределах окна, объединяются:
+    первый поток ждет окно и записывает всю группу (для каждого файла только
+    последнюю версию), остальные ждут его подтверждения. save возвращает
+    управление только после того, как данные сброшены на диск.
+
+    Между процессами чтение и запись разделяет file_lock: load берет
+    разделяемую блокировку каталога, save/update - исключительную.
+    Шард портфеля пишется под своей блокировкой (_shard_lock), а общая
+    нужна только неразбитому portfolios.json.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        portfolios_sharded: bool = True,
+        group_commit_ms: int = 0,
+        lock_warn_wait_ms: float = 100,
+    ):
+        self.data_dir = data_dir
+        self.portfolios_sharded = portfolios_sharded
+        self.group_commit_window = max(0, group_commit_ms) / 1000
+        self._lock = Lock()
+        self._batch_lock = Lock()
+        self._batch: Optional[_CommitBatch] = None
+        self._ensure_data_dir()
+        self.file_lock = DirectoryLock(self.data_dir, lock_warn_wait_ms)
+        self.users_index = UsernameIndex(self.data_dir)
+        if self.portfolios_sharded:
+            self.migrate_portfolios_to_shards()
+
+    def _ensure_data_dir(self) -> None:
+        """Создает директорию для данных, если её нет"""
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+    def _get_file_path(self, filename: str) -> str:
+        """Возвращает полный путь к файлу"""
+        return os.path.join(self.data_dir, filename)
+
+    def load(self, filename: str, default: Any = None) -> Any:
+        """Загружает данные из JSON файла"""
+        filepath = self._get_file_path(filename)
+        if not os.path.exists(filepath):
+            return default if default is not None else []
+
+        try:
+            with self.file_lock.shared():
+                with open(filepath, "r", encoding="utf-8") as f:
+                    return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return default if default is not None else []
+
+    @staticmethod
+    def _serialize(data: Any) -> bytes:
+        return json.dumps(data, indent=2, ensure_ascii=False, default=str).encode(
+            "utf-8"
+        )
+
+    def save(self, filename: str, data: Any) -> None:
+        """Сохраняет данные в JSON файл и ждет сброса на диск"""
+        payload = self._serialize(data)
+        # Внутри update группу не ждем: лидер не сможет взять блокировку
+        if not self.group_commit_window or self.file_lock.held:
+            self._commit_locked({filename: payload})
+            return
+
+        with self._batch_lock:
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = _CommitBatch()
+            batch.pending[filename] = payload
+
+        if leader:
+            time.sleep(self.group_commit_window)
+            with self._batch_lock:
+                self._batch = None
+            try:
+                self._commit_locked(batch.pending)
+            except BaseException as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+
+    def _commit_locked(self, pending: Dict[str, bytes]) -> None:
+        """
+        Записывает группу под общей блокировкой каталога.
+
+        Группе из одних шардов портфелей она не нужна: каждый шард пишется
+        под своей блокировкой, которую писатель держит до подтверждения.
+        """
+        shards_prefix = PORTFOLIO_SHARDS_DIR + os.sep
+        if all(name.startswith(shards_prefix) for name in pending):
+            with self._lock:
+                self._commit(pending)
+            return
+        with self.file_lock.exclusive(), self._lock:
+            self._commit(pending)
+
+    def _commit(self, pending: Dict[str, bytes]) -> None:
+        """Атомарно записывает группу файлов, каталоги синхронизирует один раз"""
+        directories = set()
+        for filename, payload in pending.items():
+            filepath = self._get_file_path(filename)
+            write_atomic(filepath, payload)
+            directories.add(os.path.dirname(filepath))
+        for directory in directories:
+            fsync_directory(directory)
+
+    def update(
+        self, filename: str, key: str, value: Any, id_field: str = "user_id"
+    ) -> bool:
+        """Обновляет запись в файле по ключу (чтение и запись под одной блокировкой)"""
+        with self.file_lock.exclusive():
+            data = self.load(filename, [])
+
+            if isinstance(data, list):
+                for i, item in enumerate(data):
+                    if isinstance(item, dict) and item.get(id_field) == key:
+                        if isinstance(value, dict):
+                            data[i].update(value)
+                        else:
+                            data[i] = value
+                        self.save(filename, data)
+                        return True
+
+        return False
+
+    # Пользователи
+
+    def _file_signature(self, filename: str) -> Optional[Tuple[int, int]]:
+        """Подпись файла (mtime и размер) или None, если файла нет"""
+        try:
+            stat = os.stat(self._get_file_path(filename))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _scan_users_file(self) -> Iterator[Tuple[Dict, int, int]]:
+        """Разбирает users.json, отдавая записи с байтовыми смещениями"""
+        filepath = self._get_file_path(USERS_FILE)
+        if not os.path.exists(filepath):
+            return
+        with open(filepath, "r", encoding="utf-8") as f:
+            text = f.read()
+
+        decoder = json.JSONDecoder()
+        position = text.find("[") + 1
+        if position == 0:
+            return
+        # Смещение в байтах считаем нарастающим итогом по символам
+        byte_position = len(text[:position].encode("utf-8"))
+        while True:
+            start = position
+            while position < len(text) and text[position] in " \t\r\n,":
+                position += 1
+            byte_position += len(text[start:position].encode("utf-8"))
+            if position >= len(text) or text[position] == "]":
+                return
+            try:
+                user, end = decoder.raw_decode(text, position)
+            except json.JSONDecodeError:
+                return
+            length = len(text[position:end].encode("utf-8"))
+            yield user, byte_position, length
+            byte_position += length
+            position = end
+
+    def _ensure_users_index(self) -> None:
+        """Перестраивает индекс, если users.json менялся в обход него"""
+        signature = self._file_signature(USERS_FILE)
+        if not self.users_index.matches(signature):
+            self.users_index.rebuild(self._scan_users_file(), signature)
+
+    def _read_user_at(self, offset: int, length: int) -> Optional[Dict]:
+        """Читает одну запись пользователя по смещению в users.json"""
+        try:
+            with open(self._get_file_path(USERS_FILE), "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length).decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def get_next_user_id(self) -> int:
+        """Следующий ID пользователя из счетчика индекса"""
+        with self.file_lock.exclusive(), self._lock:
+            self._ensure_users_index()
+            return self.users_index.next_user_id
+
+    def find_user_by_username(self, username: str) -> Optional[Dict]:
+        """Ищет пользователя по имени через индекс users_index"""
+        with self.file_lock.shared(), self._lock:
+            if self.users_index.matches(self._file_signature(USERS_FILE)):
+                user = self._lookup_user(username)
+                if user is not None or self.users_index.lookup(username) is None:
+                    return user
+
+        # Индекс устарел или разошелся с файлом. Перестраивать его под общей
+        # блокировкой нельзя (другие читатели видят недописанные корзины),
+        # а повышение блокировки не поддерживается - берем исключительную
+        # и проверяем заново: индекс мог уже перестроить другой процесс
+        with self.file_lock.exclusive(), self._lock:
+            self._ensure_users_index()
+            if self.users_index.lookup(username) is None:
+                return None
+            user = self._lookup_user(username)
+            if user is None:
+                self.users_index.rebuild(
+                    self._scan_users_file(), self._file_signature(USERS_FILE)
+                )
+                user = self._lookup_user(username)
+            return user
+
+    def _lookup_user(self, username: str) -> Optional[Dict]:
+        """Запись пользователя по индексу; None, если ее нет или она не совпала"""
+        entry = self.users_index.lookup(username)
+        if entry is None:
+            return None
+        user = self._read_user_at(entry["offset"], entry["length"])
+        if user is None or user.get("username") != username:
+            return None
+        return user
+
+    def _append_user_record(self, user_data: Dict) -> Tuple[int, int]:
+        """
+        Добавляет запись в конец массива users.json без сериализации всех
+        пользователей.
+
+        Новый файл (прежние байты + запись) заменяет старый атомарно, поэтому
+        сбой посреди записи не оставляет обрезанный JSON. Смещения прежних
+        записей не меняются.
+
+        Returns:
+            Смещение и длина записи в байтах
+
+        Raises:
+            ValueError: Не найден конец массива (нестандартная разметка)
+        """
+        filepath = self._get_file_path(USERS_FILE)
+        record = json.dumps(user_data, ensure_ascii=False, default=str).encode("utf-8")
+        if not os.path.exists(filepath):
+            write_atomic(filepath, b"[\n  " + record + b"\n]\n")
+            fsync_directory(self.data_dir)
+            return len(b"[\n  "), len(record)
+
+        with open(filepath, "rb") as f:
+            data = f.read()
+        bracket = data.rfind(b"]")
+        before = data[:bracket].rstrip()
+        if bracket < 0 or not before or data[bracket + 1 :].strip():
+            raise ValueError("users.json: не найден конец массива")
+        separator = b"\n  " if before.endswith(b"[") else b",\n  "
+
+        write_atomic(filepath, before + separator + record + b"\n]\n")
+        fsync_directory(self.data_dir)
+        return len(before) + len(separator), len(record)
+
+    def _load_users_strict(self) -> List[Dict]:
+        """Читает users.json целиком; ошибка разбора не превращается в []"""
+        try:
+            with open(self._get_file_path(USERS_FILE), "r", encoding="utf-8") as f:
+                users = json.load(f)
+        except FileNotFoundError:
+            return []
+        except ValueError as e:
+            raise ValueError(f"users.json поврежден, запись отменена: {e}") from e
+        if not isinstance(users, list):
+            raise ValueError("users.json поврежден: ожидался массив пользователей")
+        return users
+
+    def add_user(self, user_data: Dict) -> int:
+        """
+        Добавляет пользователя дозаписью в users.json и обновляет индекс.
+
+        Проверка имени, выдача ID и запись идут под одной эксклюзивной
+        блокировкой, поэтому параллельные регистрации не получат одно имя
+        или один ID.
+
+        Returns:
+            Выданный ID пользователя
+
+        Raises:
+            ValueError: Имя пользователя уже занято или users.json поврежден
+        """
+        with self.file_lock.exclusive(), self._lock:
+            self._ensure_users_index()
+            username = user_data["username"]
+            if self.users_index.lookup(username) is not None:
+                raise ValueError(f"Имя пользователя '{username}' уже занято")
+            user_data = dict(user_data, user_id=self.users_index.next_user_id)
+            try:
+                offset, length = self._append_user_record(user_data)
+            except ValueError:
+                # Нестандартная разметка - полная перезапись, но только если
+                # файл разбирается целиком: иначе пользователи были бы потеряны
+                users = self._load_users_strict()
+                users.append(user_data)
+                self._commit({USERS_FILE: self._serialize(users)})
+                self._ensure_users_index()
+                return user_data["user_id"]
+            self.users_index.add(
+                user_data["username"],
+                user_data["user_id"],
+                offset,
+                length,
+                self._file_signature(USERS_FILE),
+            )
+        return user_data["user_id"]
+
+    # Портфели
+
+    def _portfolio_shard(self, user_id: int) -> str:
+        """Имя файла-шарда портфеля пользователя"""
+        return os.path.join(PORTFOLIO_SHARDS_DIR, f"{int(user_id)}.json")
+
+    def _shard_lock(self, user_id: int) -> DirectoryLock:
+        """
+        Межпроцессная блокировка шарда одного пользователя.
+
+        Сделки разных пользователей не ждут друг друга и общую блокировку
+        каталога; шард заменяется атомарно, поэтому читателям блокировка
+        не нужна.
+        """
+        shards_dir = self._get_file_path(PORTFOLIO_SHARDS_DIR)
+        os.makedirs(shards_dir, exist_ok=True)
+        return DirectoryLock(
+            shards_dir, self.file_lock.warn_wait * 1000, f".{int(user_id)}.lock"
+        )
+
+    def load_portfolio(self, user_id: int) -> Optional[Dict]:
+        """Загружает портфель пользователя или возвращает None"""
+        if self.portfolios_sharded:
+            data = self.load(self._portfolio_shard(user_id), {})
+            return data or None
+
+        for portfolio in self.load(PORTFOLIOS_FILE, []):
+            if portfolio.get("user_id") == user_id:
+                return portfolio
+        return None
+
+    def save_portfolio(
+        self, portfolio_data: Dict, expected_version: Optional[int] = None
+    ) -> bool:
+        """
+        Сохраняет портфель одного пользователя, увеличивая его версию.
+
+        Args:
+            portfolio_data: Портфель
+            expected_version: Если задана, запись выполняется только при
+                совпадении с сохраненной версией (compare-and-swap)
+
+        Returns:
+            False, если портфель уже изменен другим процессом
+        """
+        user_id = portfolio_data["user_id"]
+        if self.portfolios_sharded:
+            shard = self._portfolio_shard(user_id)
+            with self._shard_lock(user_id).exclusive():
+                current = self.load(shard, {})
+                version = current.get("version", 0)
+                if expected_version is not None and version != expected_version:
+                    return False
+                portfolio_data = dict(portfolio_data, version=version + 1)
+                # Через save: при group_commit_ms шарды разных пользователей
+                # сбрасываются одной группой, блокировка шарда держится до
+                # подтверждения записи
+                self.save(shard, portfolio_data)
+            return True
+
+        # Общий файл читается и пишется под одной блокировкой каталога,
+        # поэтому в группу его запись не попадает (save пишет сразу)
+        with self.file_lock.exclusive():
+            portfolios = self.load(PORTFOLIOS_FILE, [])
+            current = next((p for p in portfolios if p.get("user_id") == user_id), {})
+
+            version = current.get("version", 0)
+            if expected_version is not None and version != expected_version:
+                return False
+            portfolio_data = dict(portfolio_data, version=version + 1)
+
+            for i, portfolio in enumerate(portfolios):
+                if portfolio.get("user_id") == user_id:
+                    portfolios[i] = portfolio_data
+                    break
+            else:
+                portfolios.append(portfolio_data)
+            self.save(PORTFOLIOS_FILE, portfolios)
+        return True
+
+    def iter_portfolios(self) -> Iterator[Dict]:
+        """Перебирает все портфели, не загружая их в память разом"""
+        if not self.portfolios_sharded:
+            yield from self.load(PORTFOLIOS_FILE, [])
+            return
+
+        shards_dir = self._get_file_path(PORTFOLIO_SHARDS_DIR)
+        if not os.path.isdir(shards_dir):
+            return
+        user_ids = sorted(
+            int(name[: -len(".json")])
+            for name in os.listdir(shards_dir)
+            if name.endswith(".json") and name[: -len(".json")].isdigit()
+        )
+        for user_id in user_ids:
+            portfolio = self.load_portfolio(user_id)
+            if portfolio:
+                yield portfolio
+
+    def migrate_portfolios_to_shards(self) -> int:
+        """
+        Однократно раскладывает portfolios.json по файлам пользователей.
+
+        Returns:
+            Количество перенесенных портфелей (0, если миграция уже была)
+        """
+        shards_dir = self._get_file_path(PORTFOLIO_SHARDS_DIR)
+        marker = os.path.join(PORTFOLIO_SHARDS_DIR, MIGRATION_MARKER)
+        if os.path.exists(self._get_file_path(marker)):
+            return 0
+
+        os.makedirs(shards_dir, exist_ok=True)
+        with self.file_lock.exclusive():
+            # Другой процесс мог выполнить миграцию, пока мы ждали блокировку
+            if os.path.exists(self._get_file_path(marker)):
+                return 0
+            migrated = 0
+            for portfolio in self.load(PORTFOLIOS_FILE, []):
+                if isinstance(portfolio, dict) and "user_id" in portfolio:
+                    self.save(self._portfolio_shard(portfolio["user_id"]), portfolio)
+                    migrated += 1
+            self.save(marker, {"source": PORTFOLIOS_FILE, "portfolios": migrated})
+        return migrated
@@ -0,0 +1,101 @@
+"""
+Singleton-кэш таблицы текущих курсов (rates.json)
+"""
+
+import json
+import os
+import time
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from .settings import SettingsLoader
+
+
+class RatesCache:
+    """
+    Singleton для чтения rates.json один раз на процесс.
+
+    Перед каждым обращением файл проверяется по mtime и размеру, поэтому
+    обновление курсов парсером подхватывается сразу. Дополнительно таблица
+    перечитывается не реже чем раз в rates_ttl_seconds.
+    """
+
+    _instance = None
+    _lock = Lock()
+
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(RatesCache, cls).__new__(cls)
+                cls._instance._initialized = False
+            return cls._instance
+
+    def __init__(self):
+        if not self._initialized:
+            settings = SettingsLoader()
+            self.filepath = os.path.join(settings.get("data_dir", "data"), "rates.json")
+            self.ttl_seconds = settings.get("rates_ttl_seconds", 300)
+            self._data: Dict = {"pairs": {}, "last_refresh": None}
+            self._signature: Optional[Tuple[int, int]] = None
+            self._loaded_at = 0.0
+            # Увеличивается при каждой смене содержимого таблицы
+            self.version = 0
+            self._initialized = True
+
+    def _revalidate(self) -> None:
+        """Перечитывает файл, если он изменился или истек TTL"""
+        try:
+            stat = os.stat(self.filepath)
+            signature = (stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+
+        expired = time.monotonic() - self._loaded_at > self.ttl_seconds
+        if signature == self._signature and not expired:
+            return
+
+        if signature is None:
+            data = {"pairs": {}, "last_refresh": None}
+        else:
+            try:
+                with open(self.filepath, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                # Файл в процессе записи - оставляем прежние данные
+                return
+
+        # Версия отслеживает только пары: смена одного last_refresh не
+        # должна заставлять перестраивать производные структуры
+        if data.get("pairs") != self._data.get("pairs"):
+            self.version += 1
+        self._data = data
+        self._signature = signature
+        self._loaded_at = time.monotonic()
+
+    def get_rates(self) -> Dict:
+        """Возвращает таблицу курсов (не изменять: объект общий)"""
+        with self._lock:
+            self._revalidate()
+            return self._data
+
+    def get_pairs(self) -> Dict:
+        """Возвращает словарь пар вида {"BTC_USD": {"rate": ...}}"""
+        return self.get_rates().get("pairs", {})
+
+    def get_pairs_versioned(self) -> Tuple[Dict, int]:
+        """Пары и версия, прочитанные вместе (без гонки с обновлением файла)"""
+        with self._lock:
+            self._revalidate()
+            return self._data.get("pairs", {}), self.version
+
+    def get_version(self) -> int:
+        """Версия таблицы курсов с учетом последних изменений файла"""
+        with self._lock:
+            self._revalidate()
+            return self.version
+
+    def invalidate(self) -> None:
+        """Принудительно перечитывает файл при следующем обращении"""
+        with self._lock:
+            self._signature = None
+            self._loaded_at = 0.0
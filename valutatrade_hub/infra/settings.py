@@ -2,6 +2,8 @@
 Singleton для загрузки настроек
 """
 
+import os
+
 
 class SettingsLoader:
     """Singleton для загрузки настроек"""
@@ -16,6 +18,17 @@ class SettingsLoader:
                 "default_base_currency": "USD",
                 "rates_ttl_seconds": 300,
                 "log_file": "valutatrade.log",
+                # "sharded" - файл на пользователя, "monolithic" - portfolios.json
+                "portfolio_storage": os.getenv(
+                    "VALUTATRADE_PORTFOLIO_STORAGE", "sharded"
+                ),
+                # "json" - файлы в data_dir, "sqlite" - база data_dir/sqlite_file
+                "storage_backend": os.getenv("VALUTATRADE_STORAGE_BACKEND", "json"),
+                "sqlite_file": "valutatrade.db",
+                # Окно группового коммита JSON-записей, мс (0 - писать сразу)
+                "group_commit_ms": int(os.getenv("VALUTATRADE_GROUP_COMMIT_MS", "0")),
+                # Порог ожидания блокировки data_dir, после которого пишем в лог
+                "lock_wait_warn_ms": 100,
             }
         return cls._instance
 
@@ -0,0 +1,363 @@
+"""
+Хранилище данных в SQLite (WAL)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from typing import Any, Dict, Iterator, List, Optional
+
+from .json_store import PORTFOLIOS_FILE, USERS_FILE, JsonStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    hashed_password TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    registration_date TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username);
+
+CREATE TABLE IF NOT EXISTS portfolios (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id INTEGER NOT NULL REFERENCES portfolios (user_id) ON DELETE CASCADE,
+    currency_code TEXT NOT NULL,
+    balance REAL NOT NULL,
+    PRIMARY KEY (user_id, currency_code)
+);
+CREATE INDEX IF NOT EXISTS idx_wallets_user_id ON wallets (user_id);
+
+CREATE TABLE IF NOT EXISTS rate_history (
+    id TEXT NOT NULL,
+    pair TEXT NOT NULL,
+    from_currency TEXT NOT NULL,
+    to_currency TEXT NOT NULL,
+    rate REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    meta TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS idx_rate_history_pair_timestamp
+    ON rate_history (pair, epoch);
+
+CREATE TABLE IF NOT EXISTS documents (
+    name TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+_MIGRATION_DOCUMENT = "_migrated_from_json"
+
+
+class SqliteStore:
+    """
+    Хранилище пользователей, портфелей и истории курсов в SQLite.
+
+    Повторяет интерфейс JsonStore (load/save/update по имени файла), а для
+    горячих путей дает индексированные запросы: поиск пользователя по имени
+    и портфеля по user_id. База работает в режиме WAL, поэтому читатели не
+    блокируются писателями, а несколько процессов могут работать с ней
+    одновременно. Соединение у каждого потока свое.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self.connection().executescript(SCHEMA)
+        self._upgrade_schema()
+
+    def _upgrade_schema(self) -> None:
+        """Добавляет колонки, появившиеся после создания базы"""
+        conn = self.connection()
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(portfolios)")}
+        if "version" not in columns:
+            conn.execute(
+                "ALTER TABLE portfolios ADD COLUMN version INTEGER NOT NULL DEFAULT 0"
+            )
+
+    # Соединения и транзакции
+
+    def connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Транзакция записи (BEGIN IMMEDIATE сразу берет блокировку)"""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # Совместимость с JsonStore
+
+    def load(self, filename: str, default: Any = None) -> Any:
+        """Загружает данные по имени файла JSON-хранилища"""
+        if filename == USERS_FILE:
+            rows = self.connection().execute("SELECT * FROM users ORDER BY user_id")
+            return [dict(row) for row in rows]
+        if filename == PORTFOLIOS_FILE:
+            return list(self.iter_portfolios())
+
+        row = (
+            self.connection()
+            .execute("SELECT data FROM documents WHERE name = ?", (filename,))
+            .fetchone()
+        )
+        if row is None:
+            return default if default is not None else []
+        return json.loads(row["data"])
+
+    def save(self, filename: str, data: Any) -> None:
+        """Полностью заменяет данные по имени файла JSON-хранилища"""
+        with self.transaction() as conn:
+            if filename == USERS_FILE:
+                conn.execute("DELETE FROM users")
+                for user in data:
+                    self._insert_user(conn, user)
+            elif filename == PORTFOLIOS_FILE:
+                conn.execute("DELETE FROM portfolios")
+                for portfolio in data:
+                    self._write_portfolio(conn, portfolio, portfolio.get("version", 0))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)",
+                    (filename, json.dumps(data, ensure_ascii=False, default=str)),
+                )
+
+    def update(
+        self, filename: str, key: str, value: Any, id_field: str = "user_id"
+    ) -> bool:
+        """Обновляет запись по ключу"""
+        if filename == USERS_FILE and id_field in ("user_id", "username"):
+            with self.transaction() as conn:
+                row = conn.execute(
+                    f"SELECT * FROM users WHERE {id_field} = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return False
+                user = dict(row)
+                if isinstance(value, dict):
+                    user.update(value)
+                else:
+                    user = value
+                conn.execute("DELETE FROM users WHERE user_id = ?", (row["user_id"],))
+                self._insert_user(conn, user)
+            return True
+
+        if filename == PORTFOLIOS_FILE and id_field == "user_id":
+            portfolio = self.load_portfolio(key)
+            if portfolio is None:
+                return False
+            if isinstance(value, dict):
+                portfolio.update(value)
+            else:
+                portfolio = value
+            self.save_portfolio(portfolio)
+            return True
+
+        data = self.load(filename, [])
+        if isinstance(data, list):
+            for i, item in enumerate(data):
+                if isinstance(item, dict) and item.get(id_field) == key:
+                    if isinstance(value, dict):
+                        data[i].update(value)
+                    else:
+                        data[i] = value
+                    self.save(filename, data)
+                    return True
+        return False
+
+    # Пользователи
+
+    @staticmethod
+    def _insert_user(conn: sqlite3.Connection, user: Dict) -> None:
+        conn.execute(
+            "INSERT INTO users (user_id, username, hashed_password, salt, "
+            "registration_date) VALUES (?, ?, ?, ?, ?)",
+            (
+                user["user_id"],
+                user["username"],
+                user["hashed_password"],
+                user["salt"],
+                str(user["registration_date"]),
+            ),
+        )
+
+    def get_next_user_id(self) -> int:
+        """Следующий ID пользователя (MAX по первичному ключу)"""
+        row = (
+            self.connection()
+            .execute("SELECT COALESCE(MAX(user_id), 0) + 1 AS next_id FROM users")
+            .fetchone()
+        )
+        return row["next_id"]
+
+    def find_user_by_username(self, username: str) -> Optional[Dict]:
+        """Ищет пользователя по имени через индекс idx_users_username"""
+        row = (
+            self.connection()
+            .execute("SELECT * FROM users WHERE username = ?", (username,))
+            .fetchone()
+        )
+        return dict(row) if row else None
+
+    def add_user(self, user_data: Dict) -> int:
+        """
+        Добавляет нового пользователя, выдавая ему следующий ID.
+
+        Returns:
+            Выданный ID пользователя
+
+        Raises:
+            ValueError: Имя пользователя уже занято
+        """
+        username = user_data["username"]
+        with self.transaction() as conn:
+            if conn.execute(
+                "SELECT 1 FROM users WHERE username = ?", (username,)
+            ).fetchone():
+                raise ValueError(f"Имя пользователя '{username}' уже занято")
+            row = conn.execute(
+                "SELECT COALESCE(MAX(user_id), 0) + 1 AS next_id FROM users"
+            ).fetchone()
+            user_data = dict(user_data, user_id=row["next_id"])
+            self._insert_user(conn, user_data)
+        return user_data["user_id"]
+
+    # Портфели
+
+    @staticmethod
+    def _write_portfolio(
+        conn: sqlite3.Connection, portfolio: Dict, version: int
+    ) -> None:
+        user_id = portfolio["user_id"]
+        conn.execute(
+            "INSERT INTO portfolios (user_id, version) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET version = excluded.version",
+            (user_id, version),
+        )
+        conn.execute("DELETE FROM wallets WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO wallets (user_id, currency_code, balance) VALUES (?, ?, ?)",
+            [
+                (user_id, code, float(wallet.get("balance", 0.0)))
+                for code, wallet in portfolio.get("wallets", {}).items()
+            ],
+        )
+
+    @staticmethod
+    def _portfolio_from_rows(
+        user_id: int, version: int, rows: List[sqlite3.Row]
+    ) -> Dict:
+        return {
+            "user_id": user_id,
+            "wallets": {
+                row["currency_code"]: {
+                    "currency_code": row["currency_code"],
+                    "balance": row["balance"],
+                }
+                for row in rows
+                if row["currency_code"] is not None
+            },
+            "version": version,
+        }
+
+    def load_portfolio(self, user_id: int) -> Optional[Dict]:
+        """Загружает портфель пользователя по первичному ключу"""
+        conn = self.connection()
+        row = conn.execute(
+            "SELECT version FROM portfolios WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            "SELECT currency_code, balance FROM wallets WHERE user_id = ? "
+            "ORDER BY rowid",
+            (user_id,),
+        ).fetchall()
+        return self._portfolio_from_rows(user_id, row["version"], rows)
+
+    def save_portfolio(
+        self, portfolio_data: Dict, expected_version: Optional[int] = None
+    ) -> bool:
+        """
+        Сохраняет портфель одного пользователя, увеличивая его версию.
+
+        Returns:
+            False, если expected_version не совпала с сохраненной версией
+        """
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT version FROM portfolios WHERE user_id = ?",
+                (portfolio_data["user_id"],),
+            ).fetchone()
+            version = row["version"] if row else 0
+            if expected_version is not None and version != expected_version:
+                return False
+            self._write_portfolio(conn, portfolio_data, version + 1)
+        return True
+
+    def iter_portfolios(self) -> Iterator[Dict]:
+        """Перебирает все портфели одним запросом"""
+        rows = self.connection().execute(
+            "SELECT p.user_id, p.version, w.currency_code, w.balance "
+            "FROM portfolios p "
+            "LEFT JOIN wallets w ON w.user_id = p.user_id "
+            "ORDER BY p.user_id, w.rowid"
+        )
+        for user_id, group in groupby(rows, key=lambda row: row["user_id"]):
+            group = list(group)
+            yield self._portfolio_from_rows(user_id, group[0]["version"], group)
+
+    # Миграция
+
+    def import_from_json(self, json_store: JsonStore) -> bool:
+        """
+        Однократно переносит пользователей и портфели из JSON-хранилища.
+
+        Returns:
+            True, если перенос выполнен при этом вызове
+        """
+        # Проверка идет внутри транзакции записи: два процесса, стартующие
+        # одновременно, не перенесут данные дважды
+        with self.transaction() as conn:
+            done = conn.execute(
+                "SELECT 1 FROM documents WHERE name = ?", (_MIGRATION_DOCUMENT,)
+            ).fetchone()
+            if done is not None:
+                return False
+
+            users = json_store.load(USERS_FILE, [])
+            for user in users:
+                self._insert_user(conn, user)
+            for portfolio in json_store.iter_portfolios():
+                self._write_portfolio(conn, portfolio, portfolio.get("version", 0))
+            conn.execute(
+                "INSERT INTO documents (name, data) VALUES (?, ?)",
+                (_MIGRATION_DOCUMENT, json.dumps({"users": len(users)})),
+            )
+        return True
@@ -0,0 +1,137 @@
+"""
+Постоянный индекс имен пользователей для JSON-хранилища
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+INDEX_DIR = "users_index"
+META_FILE = "meta.json"
+BUCKETS = 256
+
+
+class UsernameIndex:
+    """
+    Индекс username -> (user_id, смещение и длина записи в users.json).
+
+    Имена раскладываются по BUCKETS небольшим файлам по хешу, поэтому поиск
+    и добавление читают и пишут только одну корзину. В meta.json хранится
+    счетчик следующего user_id и подпись users.json (mtime и размер) на
+    момент последней записи: если файл изменили в обход индекса, подпись не
+    совпадет и индекс нужно перестроить.
+    """
+
+    def __init__(self, data_dir: str):
+        self.directory = os.path.join(data_dir, INDEX_DIR)
+
+    # Служебное
+
+    def _bucket_path(self, username: str) -> str:
+        digest = hashlib.sha1(username.encode("utf-8")).hexdigest()
+        bucket = int(digest[:4], 16) % BUCKETS
+        return os.path.join(self.directory, f"{bucket:02x}.json")
+
+    @staticmethod
+    def _read(path: str) -> Dict:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _write(path: str, data: Dict) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _meta(self) -> Dict:
+        return self._read(os.path.join(self.directory, META_FILE))
+
+    # Состояние
+
+    def matches(self, signature: Optional[Tuple[int, int]]) -> bool:
+        """Совпадает ли подпись users.json с записанной в индексе"""
+        meta = self._meta()
+        if not meta:
+            return False
+        stored = meta.get("signature")
+        return (tuple(stored) if stored else None) == signature
+
+    @property
+    def next_user_id(self) -> int:
+        return self._meta().get("next_user_id", 1)
+
+    # Чтение и запись
+
+    def lookup(self, username: str) -> Optional[Dict]:
+        """Возвращает запись индекса {user_id, offset, length} или None"""
+        return self._read(self._bucket_path(username)).get(username)
+
+    def add(
+        self,
+        username: str,
+        user_id: int,
+        offset: int,
+        length: int,
+        signature: Optional[Tuple[int, int]],
+    ) -> None:
+        """Добавляет имя в индекс и сдвигает счетчик user_id"""
+        path = self._bucket_path(username)
+        bucket = self._read(path)
+        bucket[username] = {"user_id": user_id, "offset": offset, "length": length}
+        self._write(path, bucket)
+
+        meta = self._meta()
+        meta["next_user_id"] = max(meta.get("next_user_id", 1), user_id + 1)
+        meta["signature"] = list(signature) if signature else None
+        self._write(os.path.join(self.directory, META_FILE), meta)
+
+    def rebuild(
+        self,
+        entries: Iterable[Tuple[Dict, int, int]],
+        signature: Optional[Tuple[int, int]],
+    ) -> int:
+        """
+        Перестраивает индекс целиком.
+
+        Args:
+            entries: Тройки (запись пользователя, смещение, длина в байтах)
+            signature: Подпись users.json, по которому строился индекс
+
+        Returns:
+            Количество проиндексированных пользователей
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        buckets: Dict[str, Dict] = {}
+        next_user_id = 1
+        count = 0
+        for user, offset, length in entries:
+            path = self._bucket_path(user["username"])
+            buckets.setdefault(path, {})[user["username"]] = {
+                "user_id": user["user_id"],
+                "offset": offset,
+                "length": length,
+            }
+            next_user_id = max(next_user_id, user["user_id"] + 1)
+            count += 1
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # *.tmp - чужие незавершенные записи, их удаляет сам владелец
+            if name.endswith(".tmp") or name == META_FILE or path in buckets:
+                continue
+            os.remove(path)
+        for path, bucket in buckets.items():
+            self._write(path, bucket)
+
+        # Счетчик не уменьшается, чтобы ID удаленных пользователей не повторялись
+        meta = self._meta()
+        meta["next_user_id"] = max(meta.get("next_user_id", 1), next_user_id)
+        meta["signature"] = list(signature) if signature else None
+        self._write(os.path.join(self.directory, META_FILE), meta)
+        return count
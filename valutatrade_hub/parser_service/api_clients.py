@@ -3,126 +3,410 @@
 Клиенты для работы с внешними API
 """
 
+import asyncio
+import re
 import time
 import json
-from typing import Dict
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Mapping, Optional
 import requests
 from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from ..core.exceptions import ApiRequestError
+from .async_http import AsyncHttpClient
 from .config import ParserConfig
+from .response_cache import ProviderResponseCache
+from .timestamps import now_timestamp
+
+# Итог последнего запроса клиента (last_fetch_status)
+FETCH_FRESH = "fresh"  # получены новые курсы
+FETCH_UNCHANGED = "unchanged"  # ответ 304 или те же курсы, что в прошлый раз
+FETCH_SKIPPED = "skipped"  # запрос не отправлялся: новых данных еще нет
+FETCH_FAILED = "failed"
+
+
+class FetchTicket:
+    """
+    Разрешение одного запроса записать ответ в кэш провайдера.
+
+    RatesUpdater отзывает билет у запроса, не успевшего к UPDATE_DEADLINE:
+    его ответ отбрасывается и не должен менять кэш (иначе следующее
+    обновление сочтет новые курсы прежними и не запишет их в историю).
+    Запрос фиксирует билет перед записью; действует то, что случилось
+    раньше.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state: Optional[str] = None
+
+    def _settle(self, state: str) -> bool:
+        with self._lock:
+            if self._state is None:
+                self._state = state
+            return self._state == state
+
+    def commit(self) -> bool:
+        """Фиксирует запись ответа; False, если билет уже отозван"""
+        return self._settle("committed")
+
+    def revoke(self) -> bool:
+        """Отзывает билет; False, если ответ уже записан"""
+        return self._settle("revoked")
 
 
 class BaseApiClient(ABC):
-    """Базовый класс API клиента"""
+    """
+    Базовый класс API клиента.
+
+    Запросы идут через общую для клиента requests.Session с пулом
+    keep-alive соединений, поэтому долгоживущий планировщик не платит за
+    новое TCP/TLS соединение на каждом обновлении. Сессия создается при
+    первом запросе и закрывается close() (RatesUpdater.close).
 
-    def __init__(self, config: ParserConfig):
+    С response_cache клиент не обращается к провайдеру до его объявленного
+    времени следующего обновления, отправляет условные запросы по ETag и
+    Last-Modified и сообщает в last_fetch_status, изменились ли курсы.
+    Итог хранится отдельно для каждого потока: опоздавший запрос прошлого
+    обновления не перепишет итог текущего.
+    """
+
+    # Имя провайдера в RatesUpdater.providers и в кэше ответов
+    name = "provider"
+
+    def __init__(
+        self,
+        config: ParserConfig,
+        response_cache: Optional[ProviderResponseCache] = None,
+    ):
         self.config = config
+        self.response_cache = response_cache
+        self._status = threading.local()
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def last_fetch_status(self) -> str:
+        """Итог последнего запроса в текущем потоке"""
+        return getattr(self._status, "value", FETCH_FRESH)
+
+    @last_fetch_status.setter
+    def last_fetch_status(self, value: str) -> None:
+        self._status.value = value
+
+    def _request_timeout(self) -> float:
+        """Таймаут запроса: все попытки с повторами укладываются в UPDATE_DEADLINE"""
+        attempts = self.config.HTTP_RETRIES + 1
+        return min(self.config.REQUEST_TIMEOUT, self.config.UPDATE_DEADLINE / attempts)
+
+    @property
+    def session(self) -> requests.Session:
+        """Сессия с пулом соединений, повторами GET и поддержкой gzip"""
+        with self._session_lock:
+            if self._session is None:
+                self._session = self._create_session()
+            return self._session
+
+    def _create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.config.HTTP_RETRIES,
+            backoff_factor=self.config.HTTP_RETRY_BACKOFF,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.config.HTTP_POOL_SIZE,
+            pool_maxsize=self.config.HTTP_POOL_SIZE,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update(
+            {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+        )
+        return session
+
+    def close(self) -> None:
+        """Закрывает сессию и ее соединения"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    # Кэш ответов
+
+    def _cached_if_fresh(self) -> Optional[Dict]:
+        """Курсы из кэша, если у провайдера еще не может быть новых данных"""
+        cache = self.response_cache
+        if cache is None or not cache.is_fresh(self.name):
+            return None
+        self.last_fetch_status = FETCH_SKIPPED
+        return cache.rates(self.name)
+
+    def _conditional_headers(self) -> Dict[str, str]:
+        if self.response_cache is None:
+            return {}
+        return self.response_cache.conditional_headers(self.name)
+
+    def _next_update(
+        self, data: Optional[Dict], headers: Mapping[str, str]
+    ) -> Optional[float]:
+        """Момент (epoch), раньше которого новых данных не будет"""
+        match = re.search(r"max-age=(\d+)", headers.get("cache-control", ""))
+        if match and int(match.group(1)) > 0:
+            return time.time() + int(match.group(1))
+        return None
+
+    def _discarded(self, ticket: Optional[FetchTicket]) -> bool:
+        """Билет отозван: ответ опоздал и в кэш не записывается"""
+        if ticket is None or ticket.commit():
+            return False
+        self.last_fetch_status = FETCH_FAILED
+        return True
+
+    def _remember(
+        self,
+        rates: Dict,
+        data: Optional[Dict],
+        headers: Mapping[str, str],
+        ticket: Optional[FetchTicket] = None,
+    ) -> Dict:
+        """Сохраняет ответ в кэше и отмечает, изменились ли курсы"""
+        if self._discarded(ticket):
+            return {}
+        cache = self.response_cache
+        if cache is None or not rates:
+            self.last_fetch_status = FETCH_FRESH if rates else FETCH_FAILED
+            return rates
+        changed = cache.store(
+            self.name,
+            rates,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+            next_update=self._next_update(data, headers),
+        )
+        self.last_fetch_status = FETCH_FRESH if changed else FETCH_UNCHANGED
+        return rates
+
+    def _not_modified(
+        self, headers: Mapping[str, str], ticket: Optional[FetchTicket] = None
+    ) -> Dict:
+        """Ответ 304: курсы прежние, берем их из кэша"""
+        if self._discarded(ticket):
+            return {}
+        self.response_cache.touch(self.name, self._next_update(None, headers))
+        self.last_fetch_status = FETCH_UNCHANGED
+        return self.response_cache.rates(self.name)
+
+    @abstractmethod
+    def fetch_rates(self, ticket: Optional[FetchTicket] = None) -> dict:
+        """
+        Получаем курсы валют с метаданными.
+
+        С ticket ответ записывается в кэш, только если билет не отозван.
+        """
+        pass
 
     @abstractmethod
-    def fetch_rates(self) -> dict:
-        """Получаем курсы валют с метаданными"""
+    async def fetch_rates_async(
+        self, http: AsyncHttpClient, semaphore: asyncio.Semaphore
+    ) -> dict:
+        """
+        Асинхронный вариант fetch_rates.
+
+        Запросы идут через общий для цикла событий http-клиент, их
+        одновременное число ограничивает semaphore провайдера. Ошибки
+        запроса пробрасываются как ApiRequestError.
+        """
         pass
 
 
 class CoinGeckoClient(BaseApiClient):
     """Клиент для CoinGecko API"""
 
-    def fetch_rates(self) -> Dict:
+    name = "coingecko"
+
+    def _params(self, ids: List[str]) -> Dict[str, str]:
+        return {"ids": ",".join(ids), "vs_currencies": "usd"}
+
+    def _parse_rates(self, data: Dict) -> Dict:
+        """Преобразует ответ simple/price в словарь курсов"""
+        rates = {}
+        for code, api_id in self.config.CRYPTO_ID_MAP.items():
+            if api_id in data and "usd" in data[api_id]:
+                rate_key = f"{code}_{self.config.BASE_CURRENCY}"
+                rates[rate_key] = {
+                    "rate": data[api_id]["usd"],
+                    "source": "CoinGecko",
+                    "timestamp": now_timestamp(),
+                }
+        return rates
+
+    def fetch_rates(self, ticket: Optional[FetchTicket] = None) -> Dict:
         """Получает курсы криптовалют от CoinGecko."""
+        cached = self._cached_if_fresh()
+        if cached is not None:
+            return cached
         try:
             url = self.config.COINGECKO_URL
-            params = {
-                "ids": ",".join(self.config.CRYPTO_ID_MAP.values()),
-                "vs_currencies": "usd",
-            }
+            params = self._params(list(self.config.CRYPTO_ID_MAP.values()))
 
-            response = requests.get(
-                url, params=params, timeout=self.config.REQUEST_TIMEOUT
+            response = self.session.get(
+                url,
+                params=params,
+                headers=self._conditional_headers(),
+                timeout=self._request_timeout(),
             )
+            if response.status_code == 304:
+                return self._not_modified(response.headers, ticket)
             response.raise_for_status()
             data = response.json()
-
-            rates = {}
-            for code, api_id in self.config.CRYPTO_ID_MAP.items():
-                if api_id in data and "usd" in data[api_id]:
-                    rate_key = f"{code}_{self.config.BASE_CURRENCY}"
-                    rates[rate_key] = {
-                        "rate": data[api_id]["usd"],
-                        "source": "CoinGecko",
-                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                    }
-
-            return rates
+            return self._remember(
+                self._parse_rates(data), data, response.headers, ticket
+            )
 
         except Exception:
             # Если API не работает, возвращаем пустой словарь
+            self.last_fetch_status = FETCH_FAILED
             return {}
 
+    async def fetch_rates_async(
+        self, http: AsyncHttpClient, semaphore: asyncio.Semaphore
+    ) -> Dict:
+        """
+        Получает курсы криптовалют, разбивая список монет на запросы по
+        COINGECKO_IDS_PER_REQUEST; одновременно идут не больше запросов,
+        чем позволяет semaphore провайдера.
+        """
+        cached = self._cached_if_fresh()
+        if cached is not None:
+            return cached
+        ids = list(self.config.CRYPTO_ID_MAP.values())
+        size = max(1, self.config.COINGECKO_IDS_PER_REQUEST)
+
+        async def fetch_chunk(chunk: List[str]) -> Dict:
+            async with semaphore:
+                return await http.get_json(
+                    self.config.COINGECKO_URL,
+                    self._params(chunk),
+                    timeout=self.config.REQUEST_TIMEOUT,
+                )
+
+        responses = await asyncio.gather(
+            *(fetch_chunk(ids[i : i + size]) for i in range(0, len(ids), size)),
+            return_exceptions=True,
+        )
+        errors = [r for r in responses if isinstance(r, BaseException)]
+        for error in errors:
+            # Сбой части запросов допустим, но не ошибка в самом коде
+            if not isinstance(error, ApiRequestError):
+                raise error
+        if errors and len(errors) == len(responses):
+            raise errors[0]
+        data: Dict = {}
+        for response in responses:
+            if isinstance(response, dict):
+                data.update(response)
+        # Запрос разбит на части, поэтому условные заголовки не используются
+        return self._remember(self._parse_rates(data), data, {})
+
 
 class ExchangeRateApiClient(BaseApiClient):
     """Клиент для ExchangeRate-API"""
 
-    def fetch_rates(self) -> Dict:
-        """Получает курсы фиатных валют от ExchangeRate-API"""
-        try:
-            url = self.config.EXCHANGERATE_API_URL
+    name = "exchangerate"
 
-            response = requests.get(url, timeout=self.config.REQUEST_TIMEOUT)
-            response.raise_for_status()
-            data = response.json()
+    def _next_update(
+        self, data: Optional[Dict], headers: Mapping[str, str]
+    ) -> Optional[float]:
+        """Время следующего обновления из time_next_update_* ответа"""
+        if data:
+            if data.get("time_next_update_unix"):
+                return float(data["time_next_update_unix"])
+            if data.get("time_next_update_utc"):
+                try:
+                    return parsedate_to_datetime(
+                        data["time_next_update_utc"]
+                    ).timestamp()
+                except (TypeError, ValueError):
+                    pass
+        return super()._next_update(data, headers)
+
+    def _parse_rates(self, data: Dict) -> Dict:
+        """Преобразует ответ latest/USD в словарь курсов"""
+        if data.get("result") != "success":
+            return {}
 
-            if data.get("result") != "success":
-                return {}
+        rates = {}
+        # Проверяем разные форматы ответа ExchangeRate-API
+        if "conversion_rates" in data:
+            all_rates = data.get("conversion_rates", {})
+            base_currency = data.get("base_code", "USD")
 
-            rates = {}
-            # Проверяем разные форматы ответа ExchangeRate-API
-            if "conversion_rates" in data:
-                all_rates = data.get("conversion_rates", {})
-                base_currency = data.get("base_code", "USD")
-                # print(f"Доступно валют: {len(all_rates)}")
+        elif "rates" in data:
+            all_rates = data.get("rates", {})
+            base_currency = data.get("base_code", "USD")
 
-            elif "rates" in data:
-                all_rates = data.get("rates", {})
-                base_currency = data.get("base_code", "USD")
-                # print(f"Доступно валют: {len(all_rates)}")
+        else:
+            return {}
 
+        # Берем валюты из конфига
+        for currency in self.config.FIAT_CURRENCIES:
+            if currency in all_rates:
+                rate_key = f"{currency}_{base_currency}"
+                rates[rate_key] = {
+                    "rate": float(all_rates[currency]),
+                    "source": "ExchangeRate-API",
+                    "timestamp": now_timestamp(),
+                    "meta": {
+                        "base_currency": base_currency,
+                        "time_last_update": data.get("time_last_update_utc", ""),
+                    },
+                }
             else:
-                # print(f"Пример данных: {str(data)[:200]}...")
-                return {}
-
-            # Берем валюты из конфига
-            found_count = 0
-            for currency in self.config.FIAT_CURRENCIES:
-                if currency in all_rates:
-                    rate_key = f"{currency}_{base_currency}"
-                    rates[rate_key] = {
-                        "rate": float(all_rates[currency]),
-                        "source": "ExchangeRate-API",
-                        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                        "meta": {
-                            "base_currency": base_currency,
-                            "time_last_update": data.get("time_last_update_utc", ""),
-                        },
-                    }
-                    found_count += 1
-                else:
-                    print(f"  Валюта {currency} не найдена в ответе API")
-
-            # Всегда добавляем базовую валюту
-            base_key = f"{base_currency}_{base_currency}"
-            rates[base_key] = {
-                "rate": 1.0,
-                "source": "ExchangeRate-API",
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ"),
-                "meta": {
-                    "base_currency": base_currency,
-                    "time_last_update": data.get("time_last_update_utc", ""),
-                },
-            }
-            found_count += 1
-
-            print(f"Всего получено {len(rates)} фиатных курсов")
-            return rates
+                print(f"  Валюта {currency} не найдена в ответе API")
+
+        # Всегда добавляем базовую валюту
+        base_key = f"{base_currency}_{base_currency}"
+        rates[base_key] = {
+            "rate": 1.0,
+            "source": "ExchangeRate-API",
+            "timestamp": now_timestamp(),
+            "meta": {
+                "base_currency": base_currency,
+                "time_last_update": data.get("time_last_update_utc", ""),
+            },
+        }
+
+        print(f"Всего получено {len(rates)} фиатных курсов")
+        return rates
+
+    def fetch_rates(self, ticket: Optional[FetchTicket] = None) -> Dict:
+        """Получает курсы фиатных валют от ExchangeRate-API"""
+        cached = self._cached_if_fresh()
+        if cached is not None:
+            return cached
+        self.last_fetch_status = FETCH_FAILED
+        try:
+            url = self.config.EXCHANGERATE_API_URL
+
+            response = self.session.get(
+                url,
+                headers=self._conditional_headers(),
+                timeout=self._request_timeout(),
+            )
+            if response.status_code == 304:
+                return self._not_modified(response.headers, ticket)
+            response.raise_for_status()
+            data = response.json()
+            return self._remember(
+                self._parse_rates(data), data, response.headers, ticket
+            )
 
         except requests.exceptions.RequestException as e:
             print(f"Ошибка соединения с ExchangeRate-API: {e}")
@@ -133,3 +417,20 @@ class ExchangeRateApiClient(BaseApiClient):
         except Exception as e:
             print(f"Неожиданная ошибка ExchangeRate-API: {e}")
             return {}
+
+    async def fetch_rates_async(
+        self, http: AsyncHttpClient, semaphore: asyncio.Semaphore
+    ) -> Dict:
+        """Получает курсы фиатных валют одним (условным) запросом"""
+        cached = self._cached_if_fresh()
+        if cached is not None:
+            return cached
+        async with semaphore:
+            data, headers = await http.fetch_json(
+                self.config.EXCHANGERATE_API_URL,
+                timeout=self.config.REQUEST_TIMEOUT,
+                headers=self._conditional_headers(),
+            )
+        if data is None:
+            return self._not_modified(headers)
+        return self._remember(self._parse_rates(data), data, headers)
@@ -0,0 +1,215 @@
+# valutatrade_hub/parser_service/async_http.py
+"""
+Минимальный асинхронный HTTP/1.1 клиент на asyncio
+"""
+
+import asyncio
+import gzip
+import json
+import ssl
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from ..core.exceptions import ApiRequestError
+
+_Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class AsyncHttpClient:
+    """
+    GET-запросы к JSON API без сторонних зависимостей.
+
+    Поддерживает HTTPS, gzip/deflate, chunked-ответы и keep-alive: после
+    полностью прочитанного ответа соединение возвращается в пул своего
+    хоста (не больше pool_size простаивающих на хост). Клиент привязан к
+    циклу событий, в котором создавались соединения.
+    """
+
+    def __init__(self, pool_size: int = 4, user_agent: str = "valutatrade-hub"):
+        self.pool_size = pool_size
+        self.user_agent = user_agent
+        self._idle: Dict[Tuple[str, str, int], List[_Connection]] = {}
+        self._ssl_context: Optional[ssl.SSLContext] = None
+
+    async def get_json(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        timeout: float = 30,
+    ) -> Any:
+        """Выполняет GET и разбирает тело ответа как JSON"""
+        data, _ = await self.fetch_json(url, params, timeout)
+        return data
+
+    async def fetch_json(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        timeout: float = 30,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[Any, Dict[str, str]]:
+        """
+        Выполняет GET с дополнительными заголовками (например, условными).
+
+        Returns:
+            Разобранный JSON (None при ответе 304) и заголовки ответа
+        """
+        try:
+            status, response_headers, body = await asyncio.wait_for(
+                self.get(url, params, headers), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            raise ApiRequestError(f"таймаут {timeout} с: {url}") from None
+        except (
+            OSError,
+            EOFError,
+            asyncio.IncompleteReadError,
+            ValueError,
+            zlib.error,
+        ) as e:
+            # EOFError и zlib.error - обрезанное или испорченное сжатое тело
+            raise ApiRequestError(f"{type(e).__name__}: {e}") from e
+        if status == 304:
+            return None, response_headers
+        if status >= 400:
+            raise ApiRequestError(f"HTTP {status}: {url}")
+        try:
+            return json.loads(body), response_headers
+        except ValueError as e:
+            raise ApiRequestError(f"некорректный JSON: {e}") from e
+
+    async def get(
+        self,
+        url: str,
+        params: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, Dict[str, str], bytes]:
+        """
+        Выполняет GET.
+
+        Returns:
+            Код ответа, заголовки (имена в нижнем регистре) и тело
+        """
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+
+        query = parts.query
+        if params:
+            query = f"{query}&{urlencode(params)}" if query else urlencode(params)
+        target = (parts.path or "/") + (f"?{query}" if query else "")
+        extra = "".join(
+            f"{name}: {value}\r\n" for name, value in (headers or {}).items()
+        )
+        request = (
+            f"GET {target} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            f"User-Agent: {self.user_agent}\r\n"
+            "Accept: application/json\r\n"
+            "Accept-Encoding: gzip, deflate\r\n"
+            f"{extra}"
+            "Connection: keep-alive\r\n\r\n"
+        ).encode("latin-1")
+
+        # Простаивающее соединение сервер мог уже закрыть: GET идемпотентен,
+        # поэтому при обрыве повторяем запрос на новом соединении
+        while True:
+            reused = bool(self._idle.get(key))
+            reader, writer = await self._connect(key)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, headers, body, keep_alive = await self._read_response(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                writer.close()
+                raise
+            break
+
+        if keep_alive and len(self._idle.setdefault(key, [])) < self.pool_size:
+            self._idle[key].append((reader, writer))
+        else:
+            writer.close()
+
+        encoding = headers.get("content-encoding", "").lower()
+        if encoding == "gzip":
+            body = gzip.decompress(body)
+        elif encoding == "deflate":
+            body = zlib.decompress(body)
+        return status, headers, body
+
+    async def _connect(self, key: Tuple[str, str, int]) -> _Connection:
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+
+        scheme, host, port = key
+        context = None
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            context = self._ssl_context
+        return await asyncio.open_connection(host, port, ssl=context)
+
+    @staticmethod
+    async def _read_response(
+        reader: asyncio.StreamReader,
+    ) -> Tuple[int, Dict[str, str], bytes, bool]:
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("соединение закрыто сервером")
+        version, status, *_ = status_line.decode("latin-1").split(" ", 2)
+        status = int(status)
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = headers.get("connection", "").lower() != "close" and (
+            version != "HTTP/1.0"
+        )
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if size == 0:
+                    # Завершающие заголовки (trailers) до пустой строки
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            body = b"".join(chunks)
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif status in (204, 304) or 100 <= status < 200:
+            body = b""
+        else:
+            # Тело до закрытия соединения - переиспользовать его нельзя
+            body = await reader.read()
+            keep_alive = False
+        return status, headers, body, keep_alive
+
+    async def close(self) -> None:
+        """Закрывает все простаивающие соединения"""
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
@@ -0,0 +1,229 @@
+# valutatrade_hub/parser_service/candles.py
+"""
+Агрегация истории курсов в OHLC-свечи
+"""
+
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from ..infra.json_store import write_atomic
+from .history_tiers import CandleTier
+from .storage import RatesStorage
+from .timestamps import from_epoch
+
+try:
+    import numpy as np
+except ImportError:  # Без NumPy свечи считаются обычным проходом
+    np = None
+
+# Поддерживаемые интервалы свечей в секундах
+INTERVALS: Dict[str, int] = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+
+# Смещения журнала запоздавших тиков, до которых кэши свечей проверены
+STATE_FILE = "state.json"
+
+
+def aggregate_candles(
+    timestamps: Sequence[int], rates: Sequence[float], step: int
+) -> List[Dict]:
+    """
+    Группирует отсортированные тики в свечи длиной step секунд.
+
+    Returns:
+        Список свечей с полями bucket, open, high, low, close, ticks
+    """
+    if len(timestamps) == 0:
+        return []
+
+    if np is not None:
+        ts = np.asarray(timestamps, dtype=np.int64)
+        values = np.asarray(rates, dtype=np.float64)
+        buckets = ts - ts % step
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+        ends = np.append(starts[1:], len(ts))
+        highs = np.maximum.reduceat(values, starts)
+        lows = np.minimum.reduceat(values, starts)
+        return [
+            {
+                "bucket": int(buckets[start]),
+                "open": float(values[start]),
+                "high": float(high),
+                "low": float(low),
+                "close": float(values[end - 1]),
+                "ticks": int(end - start),
+            }
+            for start, end, high, low in zip(starts, ends, highs, lows)
+        ]
+
+    candles: List[Dict] = []
+    for epoch, rate in zip(timestamps, rates):
+        bucket = epoch - epoch % step
+        if candles and candles[-1]["bucket"] == bucket:
+            candle = candles[-1]
+            candle["high"] = max(candle["high"], rate)
+            candle["low"] = min(candle["low"], rate)
+            candle["close"] = rate
+            candle["ticks"] += 1
+        else:
+            candles.append(
+                {
+                    "bucket": bucket,
+                    "open": rate,
+                    "high": rate,
+                    "low": rate,
+                    "close": rate,
+                    "ticks": 1,
+                }
+            )
+    return candles
+
+
+def merge_candles(candles: Iterable[Dict], step: int) -> List[Dict]:
+    """
+    Сводит отсортированные свечи меньшего интервала в свечи длиной step.
+
+    Свечи интервала не меньше step остаются как есть.
+    """
+    merged: List[Dict] = []
+    for candle in candles:
+        bucket = candle["bucket"] - candle["bucket"] % step
+        if merged and merged[-1]["bucket"] == bucket:
+            last = merged[-1]
+            last["high"] = max(last["high"], candle["high"])
+            last["low"] = min(last["low"], candle["low"])
+            last["close"] = candle["close"]
+            last["ticks"] += candle["ticks"]
+        else:
+            merged.append(dict(candle, bucket=bucket))
+    return merged
+
+
+class CandleAggregator:
+    """
+    Построение свечей по истории с кэшем закрытых свечей.
+
+    Свеча считается закрытой, когда в истории появился тик следующего
+    интервала. Закрытые свечи дописываются в файлы фиксированных записей
+    (CandleTier в CANDLES_DIR/<интервал>/), поэтому закрытие свечи стоит
+    одну запись, а при новых тиках пересчитывается только открытая свеча.
+    Если в историю попал запоздавший тик раньше границы закрытых свечей
+    (журнал RatesStorage.read_late_ticks), кэш обрезается с его интервала
+    и пересчитывается.
+
+    Участки истории, уже свернутые компакцией, берутся прямо из свечей
+    ярусов 1m/1h (с настоящими open/high/low), а не из их курсов закрытия.
+    """
+
+    def __init__(self, storage: RatesStorage):
+        self.storage = storage
+        self.cache_dir = storage.config.CANDLES_DIR
+        self._lock = threading.Lock()
+        self._tiers = {
+            interval: CandleTier(self.cache_dir, interval, step)
+            for interval, step in INTERVALS.items()
+        }
+
+    @property
+    def _state_path(self) -> str:
+        return os.path.join(self.cache_dir, STATE_FILE)
+
+    def _load_state(self) -> Dict:
+        """Прочитанные смещения журнала запоздавших тиков по кэшам"""
+        try:
+            with open(self._state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self, state: Dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(self._state_path, json.dumps(state).encode("utf-8"))
+
+    def invalidate(self, pair: str, interval: str) -> None:
+        """Сбрасывает кэш свечей пары (например, после правки истории)"""
+        self._tiers[interval].drop_from(pair)
+
+    def _apply_late_ticks(self, pair: str, interval: str, tier: CandleTier) -> None:
+        """Обрезает закрытые свечи с интервала самого раннего запоздавшего тика"""
+        state = self._load_state()
+        key = f"{pair}_{interval}"
+        offset = state.get(key)
+        entries, new_offset = self.storage.read_late_ticks(offset or 0)
+        if offset is not None:
+            late = [epoch for name, epoch in entries if name == pair]
+            last = tier.last_bucket(pair)
+            if late and last is not None and min(late) < last + tier.step:
+                earliest = min(late)
+                tier.drop_from(pair, earliest - earliest % tier.step)
+        elif tier.last_bucket(pair) is not None:
+            # Кэш без смещения (старый или потерянный) - строим заново
+            tier.drop_from(pair)
+        if new_offset != offset:
+            state[key] = new_offset
+            self._save_state(state)
+
+    def _history_candles(
+        self, pair: str, step: int, start: Optional[int]
+    ) -> List[Dict]:
+        """
+        Свечи истории пары начиная с start: по участкам ярусов, как в
+        RatesStorage.get_series, но свернутые участки дают свечи ярусов.
+        """
+        parts: List[Dict] = []
+        # None в плане - участок сырых тиков
+        for source, lo, hi in self.storage.tiers.plan(None):
+            part_start = (
+                lo if start is None else start if lo is None else max(start, lo)
+            )
+            part_end = None if hi is None else hi - 1
+            if part_start is not None and part_end is not None:
+                if part_start > part_end:
+                    continue
+            if source is None:
+                timestamps, rates = self.storage.raw_series(pair, part_start, part_end)
+                parts.extend(aggregate_candles(timestamps, rates, step))
+            else:
+                parts.extend(source.candles(pair, part_start, part_end))
+        return merge_candles(parts, step)
+
+    def get_candles(
+        self,
+        pair: str,
+        interval: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> List[Dict]:
+        """
+        Возвращает свечи пары за диапазон [start, end] в epoch-секундах.
+
+        Raises:
+            ValueError: Неизвестный интервал
+        """
+        if interval not in INTERVALS:
+            raise ValueError(
+                f"Неизвестный интервал '{interval}'. Допустимые: {', '.join(INTERVALS)}"
+            )
+        pair = pair.upper()
+        step = INTERVALS[interval]
+        tier = self._tiers[interval]
+
+        with self._lock:
+            self._apply_late_ticks(pair, interval, tier)
+            last = tier.last_bucket(pair)
+            closed_until = None if last is None else last + step
+
+            # Читаем только историю после последней закрытой свечи
+            fresh = self._history_candles(pair, step, closed_until)
+            if len(fresh) > 1:
+                tier.append(pair, fresh[:-1])
+
+        first = None if start is None else start - start % step
+        candles = tier.candles(pair, first, end) + fresh[-1:]
+        return [
+            dict(candle, time=from_epoch(candle["bucket"]))
+            for candle in candles
+            if (start is None or candle["bucket"] + step > start)
+            and (end is None or candle["bucket"] <= end)
+        ]
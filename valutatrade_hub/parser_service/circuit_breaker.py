@@ -0,0 +1,191 @@
+# valutatrade_hub/parser_service/circuit_breaker.py
+"""
+Автоматический выключатель (circuit breaker) для провайдеров курсов
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from ..infra.file_lock import DirectoryLock
+from ..infra.json_store import write_atomic
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Выключатель одного провайдера.
+
+    closed - запросы идут как обычно. После failure_threshold ошибок подряд
+    выключатель размыкается (open) и запросы к провайдеру пропускаются до
+    retry_at. Пауза растет экспоненциально с каждым размыканием
+    (base_delay * 2^n, не больше max_delay) и случайно сдвигается на
+    ±jitter, чтобы несколько процессов не проверяли провайдер одновременно.
+    По истечении паузы пропускается один пробный запрос (half_open): успех
+    замыкает выключатель, ошибка снова размыкает его с большей паузой.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 3,
+        base_delay: float = 30.0,
+        max_delay: float = 1800.0,
+        jitter: float = 0.2,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.total_successes = 0
+        self.trips = 0  # размыканий подряд, определяет длину паузы
+        self.retry_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # Время последнего исхода запроса: при слиянии состояний процессов
+        # побеждает более свежее
+        self.updated_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    def allow_request(self) -> bool:
+        """Можно ли сейчас обращаться к провайдеру"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() >= (self.retry_at or 0):
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.total_successes += 1
+            self.updated_at = self.clock()
+            self.consecutive_failures = 0
+            self.trips = 0
+            self.state = CLOSED
+            self.retry_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self, error: Optional[str] = None) -> None:
+        with self._lock:
+            self.total_failures += 1
+            self.updated_at = self.clock()
+            self.consecutive_failures += 1
+            self.last_error = error
+            if (
+                self.state == HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self._trip()
+
+    def _trip(self) -> None:
+        self.trips += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.trips - 1))
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.state = OPEN
+        self.retry_at = self.clock() + delay
+        self._probe_in_flight = False
+
+    def snapshot(self) -> Dict:
+        """Состояние и счетчики для сохранения и вывода"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_failures": self.total_failures,
+                "total_successes": self.total_successes,
+                "trips": self.trips,
+                "retry_at": self.retry_at,
+                "last_error": self.last_error,
+                "updated_at": self.updated_at,
+            }
+
+    def restore(self, data: Dict) -> None:
+        """Восстанавливает состояние, сохраненное snapshot()"""
+        with self._lock:
+            self.state = data.get("state", CLOSED)
+            if self.state == HALF_OPEN:
+                # Пробный запрос прерван перезапуском - пробуем снова
+                self.state = OPEN
+            self.consecutive_failures = data.get("consecutive_failures", 0)
+            self.total_failures = data.get("total_failures", 0)
+            self.total_successes = data.get("total_successes", 0)
+            self.trips = data.get("trips", 0)
+            self.retry_at = data.get("retry_at")
+            self.last_error = data.get("last_error")
+            self.updated_at = data.get("updated_at")
+
+
+class CircuitBreakerRegistry:
+    """
+    Выключатели всех провайдеров с сохранением состояния в JSON-файл.
+
+    Состояние переживает перезапуск, а CLI может показать его, даже если
+    обновления выполняет планировщик в другом процессе. При сохранении файл
+    перечитывается под межпроцессной блокировкой: выключатели других
+    провайдеров сохраняются как есть, а для своего побеждает состояние
+    с более поздним updated_at.
+    """
+
+    def __init__(self, path: str, **breaker_options):
+        self.path = path
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        self.file_lock = DirectoryLock(
+            directory, lock_file=f".{os.path.basename(path)}.lock"
+        )
+        self.breaker_options = breaker_options
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._saved = self.load_snapshot()
+
+    def get(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = CircuitBreaker(name, **self.breaker_options)
+                if name in self._saved:
+                    breaker.restore(self._saved[name])
+                self._breakers[name] = breaker
+            return breaker
+
+    def load_snapshot(self) -> Dict[str, Dict]:
+        """Последнее сохраненное состояние выключателей (из файла)"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save(self) -> None:
+        with self.file_lock.exclusive(), self._lock:
+            snapshot = self.load_snapshot()
+            for name, breaker in self._breakers.items():
+                state = breaker.snapshot()
+                saved = snapshot.get(name)
+                if saved and (saved.get("updated_at") or 0) > (
+                    state["updated_at"] or 0
+                ):
+                    # Другой процесс видел провайдера позже - берем его состояние
+                    breaker.restore(saved)
+                else:
+                    snapshot[name] = state
+            write_atomic(self.path, json.dumps(snapshot, indent=2).encode("utf-8"))
+            self._saved = snapshot
@@ -0,0 +1,520 @@
+# valutatrade_hub/parser_service/columnar_store.py
+"""
+Колоночное хранилище истории курсов
+"""
+
+import bisect
+import heapq
+import json
+import os
+import shutil
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from itertools import islice, zip_longest
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ..infra.file_lock import DirectoryLock
+from ..infra.json_store import write_atomic
+from .timestamps import from_epoch, to_epoch
+
+try:
+    import numpy as np
+except ImportError:  # NumPy необязателен: без него колонки читаются в array
+    np = None
+
+TIMESTAMPS_FILE = "timestamps.int64"
+RATES_FILE = "rates.float64"
+SIDE_FILE = "side.ndjson"
+SOURCES_FILE = "sources.json"
+
+_ITEM_SIZE = 8
+_UNKNOWN_SOURCE = "unknown"
+
+# Каталоги пары на время компакции: новая версия и заменяемая старая
+_COMPACT_SUFFIX = ".compact"
+_OLD_SUFFIX = ".old"
+
+
+def _pack(values: Sequence, typecode: str) -> bytes:
+    """Упаковывает значения колонки в little-endian байты"""
+    data = array(typecode, values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+class ColumnarHistoryStore:
+    """
+    История курсов в виде колонок по валютным парам.
+
+    Для каждой пары хранятся два бинарных файла фиксированной ширины:
+    epoch-секунды (int64) и курсы (float64), а также побочная таблица
+    side.ndjson с источником и meta. Колонки только дописываются и
+    отсортированы по времени, поэтому диапазон по времени - это бинарный
+    поиск и срез. При наличии NumPy колонки открываются через memmap и
+    срезы не копируют данные.
+
+    Все изменения колонок идут под блокировкой каталога (DirectoryLock),
+    поэтому планировщик и CLI могут дописывать одни и те же пары.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.file_lock = DirectoryLock(self.directory)
+        with self._exclusive():
+            self._recover_compaction()
+        self._sources: List[str] = []
+        self._source_ids: Dict[str, int] = {}
+        self._reload_sources()
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Изменение колонок: потоки процесса и другие процессы"""
+        with self.file_lock.exclusive(), self._lock:
+            yield
+
+    # Справочник источников
+
+    def _load_sources(self) -> List[str]:
+        """Загружает интернированные имена источников"""
+        try:
+            with open(
+                os.path.join(self.directory, SOURCES_FILE), "r", encoding="utf-8"
+            ) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return []
+
+    def _save_sources(self) -> None:
+        write_atomic(
+            os.path.join(self.directory, SOURCES_FILE),
+            json.dumps(self._sources, ensure_ascii=False).encode("utf-8"),
+        )
+
+    def _reload_sources(self) -> None:
+        self._sources = self._load_sources()
+        self._source_ids = {name: i for i, name in enumerate(self._sources)}
+
+    def _source_id(self, name: str) -> int:
+        """
+        Возвращает ID источника, регистрируя новый при необходимости.
+
+        Новый ID выдается под блокировкой каталога по свежей копии
+        справочника: иначе два процесса дали бы разным источникам один ID.
+        """
+        if name not in self._source_ids:
+            with self.file_lock.exclusive():
+                self._reload_sources()
+                if name not in self._source_ids:
+                    self._source_ids[name] = len(self._sources)
+                    self._sources.append(name)
+                    self._save_sources()
+        return self._source_ids[name]
+
+    def _source_name(self, source_id: Optional[int]) -> str:
+        if source_id is not None and source_id >= len(self._sources):
+            # Источник мог зарегистрировать другой процесс
+            self._reload_sources()
+        if source_id is None or source_id >= len(self._sources):
+            return _UNKNOWN_SOURCE
+        return self._sources[source_id]
+
+    # Пути
+
+    def _pair_path(self, pair: str, filename: str) -> str:
+        return os.path.join(self.directory, pair, filename)
+
+    def pairs(self) -> List[str]:
+        """Список валютных пар в хранилище"""
+        return sorted(
+            name
+            for name in os.listdir(self.directory)
+            if "." not in name
+            and os.path.exists(self._pair_path(name, TIMESTAMPS_FILE))
+        )
+
+    def is_empty(self) -> bool:
+        return not self.pairs()
+
+    # Запись
+
+    def append(self, records: Iterable[Dict]) -> int:
+        """Дописывает записи, раскладывая их по колонкам пар"""
+        grouped: Dict[str, List[Dict]] = {}
+        for record in records:
+            pair = f"{record['from_currency']}_{record['to_currency']}".upper()
+            grouped.setdefault(pair, []).append(record)
+
+        with self._exclusive():
+            for pair, items in grouped.items():
+                self._append_pair(pair, items)
+        return sum(len(items) for items in grouped.values())
+
+    def _append_pair(self, pair: str, items: List[Dict]) -> None:
+        os.makedirs(os.path.join(self.directory, pair), exist_ok=True)
+        count = self._repair(pair)
+
+        timestamps = [to_epoch(item["timestamp"]) for item in items]
+        rates = [float(item["rate"]) for item in items]
+        side = [
+            json.dumps(
+                [
+                    self._source_id(item.get("source", _UNKNOWN_SOURCE)),
+                    item.get("meta") or {},
+                ],
+                ensure_ascii=False,
+                separators=(",", ":"),
+                default=str,
+            )
+            for item in items
+        ]
+
+        last = self._last_timestamp(pair) if count else None
+        in_order = all(a <= b for a, b in zip(timestamps, timestamps[1:]))
+        if not in_order or (last is not None and timestamps[0] < last):
+            self._rewrite_sorted(pair, timestamps, rates, side)
+            return
+
+        # Колонка времени пишется первой, side - последней (см. _repair)
+        with open(self._pair_path(pair, TIMESTAMPS_FILE), "ab") as f:
+            f.write(_pack(timestamps, "q"))
+        with open(self._pair_path(pair, RATES_FILE), "ab") as f:
+            f.write(_pack(rates, "d"))
+        with open(self._pair_path(pair, SIDE_FILE), "a", encoding="utf-8") as f:
+            f.write("\n".join(side) + "\n")
+
+    def _repair(self, pair: str) -> int:
+        """Выравнивает колонки пары после прерванной записи"""
+        sizes = [
+            os.path.getsize(path) if os.path.exists(path) else 0
+            for path in (
+                self._pair_path(pair, TIMESTAMPS_FILE),
+                self._pair_path(pair, RATES_FILE),
+            )
+        ]
+        count = min(sizes) // _ITEM_SIZE
+        if sizes[0] == sizes[1] == count * _ITEM_SIZE:
+            return count
+
+        for filename in (TIMESTAMPS_FILE, RATES_FILE):
+            with open(self._pair_path(pair, filename), "ab") as f:
+                f.truncate(count * _ITEM_SIZE)
+        side = self._read_side_lines(pair)[:count]
+        self._write_file(pair, SIDE_FILE, "".join(line + "\n" for line in side))
+        return count
+
+    def _rewrite_sorted(
+        self,
+        pair: str,
+        timestamps: List[int],
+        rates: List[float],
+        side: List[str],
+    ) -> None:
+        """Редкий путь: вставка записей не по порядку с полной перезаписью пары"""
+        old_ts, old_rates = self._read_columns(pair)
+        all_ts = list(old_ts) + timestamps
+        all_rates = list(old_rates) + rates
+        all_side = self._read_side_lines(pair)[: len(old_ts)]
+        all_side += [""] * (len(old_ts) - len(all_side)) + side
+
+        order = sorted(range(len(all_ts)), key=all_ts.__getitem__)
+        self._write_file(pair, TIMESTAMPS_FILE, _pack([all_ts[i] for i in order], "q"))
+        self._write_file(pair, RATES_FILE, _pack([all_rates[i] for i in order], "d"))
+        self._write_file(pair, SIDE_FILE, "".join(all_side[i] + "\n" for i in order))
+
+    def _write_file(self, pair: str, filename: str, payload) -> None:
+        """Атомарно перезаписывает файл пары (временный файл с уникальным именем)"""
+        if not isinstance(payload, bytes):
+            payload = payload.encode("utf-8")
+        write_atomic(self._pair_path(pair, filename), payload)
+
+    def _last_timestamp(self, pair: str) -> Optional[int]:
+        path = self._pair_path(pair, TIMESTAMPS_FILE)
+        with open(path, "rb") as f:
+            f.seek(-_ITEM_SIZE, os.SEEK_END)
+            last = array("q")
+            last.frombytes(f.read(_ITEM_SIZE))
+        if sys.byteorder == "big":
+            last.byteswap()
+        return last[0]
+
+    # Удаление старых данных
+
+    def drop_before(self, epoch: int) -> int:
+        """
+        Удаляет записи раньше epoch во всех парах.
+
+        Новые колонки пары собираются в каталоге <PAIR>.compact без
+        блокировки. Под межпроцессной блокировкой в них дописываются строки,
+        пришедшие за время копирования, и каталоги меняются местами двумя
+        переименованиями; прерванную замену доводит _recover_compaction.
+
+        Returns:
+            Количество удаленных записей
+        """
+        dropped = 0
+        for pair in self.pairs():
+            with self._exclusive():
+                count = self._repair(pair)
+                timestamps, _ = self._read_columns(pair)
+                position = self._search(timestamps, epoch)
+                side_offset, side_size = self._side_offset(pair, position)
+                inode = os.stat(self._pair_path(pair, TIMESTAMPS_FILE)).st_ino
+            del timestamps
+            if not position:
+                continue
+
+            # (файл, начало сохраняемой части, размер на момент снимка)
+            parts = [
+                (TIMESTAMPS_FILE, position * _ITEM_SIZE, count * _ITEM_SIZE),
+                (RATES_FILE, position * _ITEM_SIZE, count * _ITEM_SIZE),
+                (SIDE_FILE, side_offset, side_size),
+            ]
+            compact_dir = os.path.join(self.directory, pair + _COMPACT_SUFFIX)
+            shutil.rmtree(compact_dir, ignore_errors=True)
+            os.makedirs(compact_dir)
+            try:
+                for filename, offset, size in parts:
+                    self._copy_range(
+                        self._pair_path(pair, filename),
+                        os.path.join(compact_dir, filename),
+                        offset,
+                        size,
+                    )
+            except FileNotFoundError:
+                # Каталог убрал _recover_compaction стартующего процесса
+                continue
+
+            with self._exclusive():
+                current = os.stat(self._pair_path(pair, TIMESTAMPS_FILE))
+                if (
+                    current.st_ino != inode
+                    or current.st_size < count * _ITEM_SIZE
+                    or not os.path.isdir(compact_dir)
+                ):
+                    # Пара перезаписана во время копирования - в другой раз
+                    shutil.rmtree(compact_dir, ignore_errors=True)
+                    continue
+                for filename, _, size in parts:
+                    self._copy_range(
+                        self._pair_path(pair, filename),
+                        os.path.join(compact_dir, filename),
+                        size,
+                        None,
+                        append=True,
+                    )
+                pair_dir = os.path.join(self.directory, pair)
+                old_dir = pair_dir + _OLD_SUFFIX
+                os.rename(pair_dir, old_dir)
+                os.rename(compact_dir, pair_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            dropped += position
+        return dropped
+
+    def _side_offset(self, pair: str, lines: int) -> Tuple[int, int]:
+        """Смещение строки номер lines в side.ndjson и размер файла"""
+        path = self._pair_path(pair, SIDE_FILE)
+        if not os.path.exists(path):
+            return 0, 0
+        offset = 0
+        with open(path, "rb") as f:
+            for _ in range(lines):
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+        return offset, os.path.getsize(path)
+
+    @staticmethod
+    def _copy_range(
+        src_path: str,
+        dst_path: str,
+        offset: int,
+        end: Optional[int],
+        append: bool = False,
+    ) -> None:
+        """Копирует байты [offset, end) файла (end=None - до конца)"""
+        if not os.path.exists(src_path):
+            open(dst_path, "ab").close()
+            return
+        with (
+            open(src_path, "rb") as src,
+            open(dst_path, "ab" if append else "wb") as dst,
+        ):
+            src.seek(offset)
+            if end is None:
+                shutil.copyfileobj(src, dst)
+            else:
+                dst.write(src.read(max(0, end - offset)))
+
+    def _recover_compaction(self) -> None:
+        """Доводит или откатывает замену каталогов, прерванную сбоем"""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(_OLD_SUFFIX):
+                pair_dir = path[: -len(_OLD_SUFFIX)]
+                if not os.path.exists(pair_dir):
+                    compact_dir = pair_dir + _COMPACT_SUFFIX
+                    # Вторая половина замены не выполнена: ставим новую
+                    # версию, если она есть, иначе возвращаем старую
+                    if os.path.isdir(compact_dir):
+                        os.rename(compact_dir, pair_dir)
+                    else:
+                        os.rename(path, pair_dir)
+                        continue
+                shutil.rmtree(path, ignore_errors=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(_COMPACT_SUFFIX):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    # Чтение
+
+    def _read_column(self, path: str, typecode: str):
+        """Открывает колонку: memmap с NumPy или array без него"""
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        length = size // _ITEM_SIZE
+        if np is not None:
+            dtype = "<i8" if typecode == "q" else "<f8"
+            if length == 0:
+                return np.empty(0, dtype=dtype)
+            return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+        values = array(typecode)
+        if length:
+            with open(path, "rb") as f:
+                values.frombytes(f.read(length * _ITEM_SIZE))
+            if sys.byteorder == "big":
+                values.byteswap()
+        return values
+
+    def _read_columns(self, pair: str) -> Tuple[Sequence[int], Sequence[float]]:
+        timestamps = self._read_column(self._pair_path(pair, TIMESTAMPS_FILE), "q")
+        rates = self._read_column(self._pair_path(pair, RATES_FILE), "d")
+        length = min(len(timestamps), len(rates))
+        return timestamps[:length], rates[:length]
+
+    def _read_side_lines(self, pair: str) -> List[str]:
+        path = self._pair_path(pair, SIDE_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+
+    @staticmethod
+    def _search(timestamps: Sequence[int], value: int, right: bool = False) -> int:
+        """Бинарный поиск позиции метки времени в отсортированной колонке"""
+        if np is not None and isinstance(timestamps, np.ndarray):
+            side = "right" if right else "left"
+            return int(np.searchsorted(timestamps, value, side=side))
+        if right:
+            return bisect.bisect_right(timestamps, value)
+        return bisect.bisect_left(timestamps, value)
+
+    def get_series(
+        self,
+        pair: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[Sequence[int], Sequence[float]]:
+        """
+        Возвращает колонки времени и курсов пары за диапазон [start, end].
+
+        С NumPy результат - срезы memmap без копирования данных.
+        """
+        pair = pair.upper()
+        if not os.path.exists(self._pair_path(pair, TIMESTAMPS_FILE)):
+            return self._read_column("", "q"), self._read_column("", "d")
+        timestamps, rates = self._read_columns(pair)
+        lo = 0 if start is None else self._search(timestamps, start)
+        hi = len(timestamps) if end is None else self._search(timestamps, end, True)
+        return timestamps[lo:hi], rates[lo:hi]
+
+    def last_epoch(self, pair: str) -> Optional[int]:
+        """Самая поздняя метка времени пары (последний элемент колонки)"""
+        try:
+            return int(self._last_timestamp(pair.upper()))
+        except (FileNotFoundError, OSError):
+            return None
+
+    def rate_at(self, pair: str, epoch: int) -> Optional[Tuple[int, float]]:
+        """Последний известный курс пары не позже момента epoch"""
+        pair = pair.upper()
+        if not os.path.exists(self._pair_path(pair, TIMESTAMPS_FILE)):
+            return None
+        timestamps, rates = self._read_columns(pair)
+        position = self._search(timestamps, epoch, right=True) - 1
+        if position < 0:
+            return None
+        return int(timestamps[position]), float(rates[position])
+
+    def _iter_pair(
+        self, pair: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[Tuple[int, str, Dict]]:
+        timestamps, rates = self._read_columns(pair)
+        lo = 0 if start is None else self._search(timestamps, start)
+        hi = len(timestamps) if end is None else self._search(timestamps, end, True)
+        from_currency, to_currency = pair.split("_")
+        side_path = self._pair_path(pair, SIDE_FILE)
+        side_file = (
+            open(side_path, "r", encoding="utf-8")
+            if os.path.exists(side_path)
+            else iter(())
+        )
+        try:
+            # Строки побочной таблицы идут параллельно колонкам
+            side_lines = islice(side_file, lo, hi)
+            for epoch, rate, line in zip_longest(
+                timestamps[lo:hi], rates[lo:hi], side_lines
+            ):
+                if epoch is None or rate is None:
+                    break
+                source_id, meta = None, {}
+                if line and line.strip():
+                    source_id, meta = json.loads(line)
+                timestamp = from_epoch(epoch)
+                yield (
+                    int(epoch),
+                    pair,
+                    {
+                        "id": f"{pair}_{timestamp}",
+                        "from_currency": from_currency,
+                        "to_currency": to_currency,
+                        "rate": float(rate),
+                        "timestamp": timestamp,
+                        "source": self._source_name(source_id),
+                        "meta": meta,
+                    },
+                )
+        finally:
+            if hasattr(side_file, "close"):
+                side_file.close()
+
+    def iter_records(self) -> Iterator[Dict]:
+        """Потоково отдает записи всех пар в порядке времени"""
+        streams = [self._iter_pair(pair) for pair in self.pairs()]
+        for _, _, record in heapq.merge(*streams, key=lambda item: item[:2]):
+            yield record
+
+    def iter_range(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        pairs: Optional[Iterable[str]] = None,
+    ) -> Iterator[Dict]:
+        """
+        Потоково отдает записи за [start, end] в порядке времени.
+
+        Диапазон в колонках каждой пары находится бинарным поиском, пары
+        вне фильтра pairs не открываются.
+        """
+        names = self.pairs()
+        if pairs is not None:
+            wanted = {pair.upper() for pair in pairs}
+            names = [name for name in names if name in wanted]
+        streams = [self._iter_pair(name, start, end) for name in names]
+        for _, _, record in heapq.merge(*streams, key=lambda item: item[:2]):
+            yield record
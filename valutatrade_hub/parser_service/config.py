@@ -7,6 +7,16 @@ import os
 from dataclasses import dataclass, field
 from typing import Dict
 
+from ..infra.settings import SettingsLoader
+
+
+def _sqlite_path() -> str:
+    """Путь к базе SQLite по настройкам data_dir и sqlite_file"""
+    settings = SettingsLoader()
+    return os.path.join(
+        settings.get("data_dir", "data"), settings.get("sqlite_file", "valutatrade.db")
+    )
+
 
 @dataclass
 class ParserConfig:
@@ -43,9 +53,76 @@ class ParserConfig:
     RATES_FILE_PATH: str = "data/rates.json"
     HISTORY_FILE_PATH: str = "data/exchange_rates.json"
 
+    # Журнал истории: каталог сегментов и лимит размера одного сегмента
+    HISTORY_DIR: str = "data/history"
+    HISTORY_SEGMENT_MAX_BYTES: int = 4 * 1024 * 1024
+    # Закрытые сегменты запечатываются: сжатие "gzip" или "lzma" блоками
+    # по HISTORY_SEAL_BLOCK_RECORDS записей ("" - не запечатывать)
+    HISTORY_SEAL_CODEC: str = "gzip"
+    HISTORY_SEAL_BLOCK_RECORDS: int = 1024
+
+    # Бэкенд истории: "segments" (NDJSON), "columnar" (колонки по парам)
+    # или "sqlite" (таблица rate_history в общей базе)
+    HISTORY_BACKEND: str = os.getenv("VALUTATRADE_HISTORY_BACKEND", "segments")
+    HISTORY_COLUMNAR_DIR: str = "data/history_columns"
+    # База та же, что у основного хранилища: data_dir/sqlite_file из настроек
+    HISTORY_SQLITE_PATH: str = field(default_factory=_sqlite_path)
+
+    # Последние ответы провайдеров: ETag/Last-Modified и время обновления
+    PROVIDER_CACHE_PATH: str = "data/provider_cache.json"
+
+    # Запись истории только при изменении курса: допуски сравнения с
+    # последним записанным значением и период контрольной записи (секунды)
+    DEDUP_ABS_EPSILON: float = 1e-9
+    DEDUP_REL_EPSILON: float = 1e-6
+    DEDUP_HEARTBEAT_SECONDS: int = 3600
+
+    # Хранение истории по ярусам: сырые тики RETENTION_RAW_DAYS дней,
+    # минутные свечи RETENTION_MINUTE_WEEKS недель, часовые - всегда.
+    # Компакция запускается планировщиком раз в RETENTION_COMPACT_INTERVAL с
+    HISTORY_TIERS_DIR: str = "data/history_tiers"
+    RETENTION_RAW_DAYS: int = 7
+    RETENTION_MINUTE_WEEKS: int = 4
+    RETENTION_COMPACT_INTERVAL: float = 3600.0
+
+    # Выгрузка истории (export-history): записей в одной порции записи
+    EXPORT_CHUNK_RECORDS: int = 5000
+
+    # Кэш закрытых OHLC-свечей
+    CANDLES_DIR: str = "data/candles"
+
     # Параметры запросов
     REQUEST_TIMEOUT: int = 30
 
+    # Пул keep-alive соединений клиента и повторы идемпотентных GET
+    HTTP_POOL_SIZE: int = 4
+    HTTP_RETRIES: int = 2
+    HTTP_RETRY_BACKOFF: float = 0.3
+
+    # Асинхронное обновление: запросов одновременно на провайдера
+    # и монет CoinGecko в одном запросе
+    ASYNC_PROVIDER_CONCURRENCY: int = 4
+    COINGECKO_IDS_PER_REQUEST: int = 50
+
+    # Выключатель провайдера: ошибок подряд до размыкания, пауза до
+    # пробного запроса (растет вдвое с каждым размыканием) и ее разброс
+    BREAKER_FAILURE_THRESHOLD: int = 3
+    BREAKER_BASE_DELAY: float = 30.0
+    BREAKER_MAX_DELAY: float = 1800.0
+    BREAKER_JITTER: float = 0.2
+    BREAKER_STATE_PATH: str = "data/circuit_breakers.json"
+
+    # Планировщик: интервал обновления каждого провайдера (секунды) и
+    # случайная задержка запуска в долях интервала
+    SCHEDULE_INTERVALS: Dict[str, float] = field(
+        default_factory=lambda: {"coingecko": 30.0, "exchangerate": 3600.0}
+    )
+    SCHEDULE_JITTER: float = 0.1
+
+    # Общий срок одного обновления: провайдеры опрашиваются параллельно,
+    # не ответившие к сроку считаются пропущенными
+    UPDATE_DEADLINE: float = 15.0
+
     def get_exchangerate_url(self) -> str:
         """Возвращает URL для ExchangeRate-API"""
         return f"{self.EXCHANGERATE_API_URL}/{self.EXCHANGERATE_API_KEY}\
@@ -0,0 +1,108 @@
+# valutatrade_hub/parser_service/dedup.py
+"""
+Отсев неизменившихся курсов перед записью в историю
+"""
+
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from .timestamps import to_epoch
+
+
+class RateDeduplicator:
+    """
+    Стадия приема между получением курсов и RatesStorage.
+
+    Курс пары сравнивается с последним записанным в историю значением
+    (math.isclose с abs_epsilon и rel_epsilon). В историю идут только
+    настоящие изменения и контрольные записи (heartbeat) - если пара не
+    записывалась дольше heartbeat_seconds. Сравнение идет с записанным,
+    а не с последним полученным значением, поэтому медленный дрейф курса
+    тоже рано или поздно попадет в историю.
+
+    Последние записанные значения берутся из истории при первой встрече
+    пары (storage.get_rate_at), дальше хранятся в памяти.
+    """
+
+    def __init__(
+        self,
+        storage,
+        abs_epsilon: float = 1e-9,
+        rel_epsilon: float = 1e-6,
+        heartbeat_seconds: int = 3600,
+    ):
+        self.storage = storage
+        self.abs_epsilon = abs_epsilon
+        self.rel_epsilon = rel_epsilon
+        self.heartbeat_seconds = heartbeat_seconds
+        self._lock = threading.Lock()
+        # pair -> (курс, epoch) последней записи в истории
+        self._last_stored: Dict[str, Optional[Tuple[float, int]]] = {}
+
+        self.written = 0
+        self.heartbeats = 0
+        self.suppressed = 0
+        self.suppressed_by_pair: Dict[str, int] = {}
+
+    def _last(self, pair: str, epoch: int) -> Optional[Tuple[float, int]]:
+        if pair not in self._last_stored:
+            found = self.storage.get_rate_at(pair, epoch)
+            self._last_stored[pair] = (
+                (float(found["rate"]), to_epoch(found["timestamp"])) if found else None
+            )
+        return self._last_stored[pair]
+
+    def filter(self, records: List[Dict], timestamp: str) -> List[Dict]:
+        """
+        Оставляет записи тика, которые нужно сохранить в историю.
+
+        Args:
+            records: Записи с ключами from_currency, to_currency, rate
+            timestamp: Метка времени тика в формате истории
+
+        Returns:
+            Изменившиеся курсы и контрольные записи
+        """
+        epoch = to_epoch(timestamp)
+        accepted = []
+        with self._lock:
+            for record in records:
+                pair = f"{record['from_currency']}_{record['to_currency']}".upper()
+                rate = float(record["rate"])
+                last = self._last(pair, epoch)
+                if last is not None:
+                    last_rate, last_epoch = last
+                    unchanged = math.isclose(
+                        rate,
+                        last_rate,
+                        rel_tol=self.rel_epsilon,
+                        abs_tol=self.abs_epsilon,
+                    )
+                    if unchanged and epoch - last_epoch < self.heartbeat_seconds:
+                        self.suppressed += 1
+                        self.suppressed_by_pair[pair] = (
+                            self.suppressed_by_pair.get(pair, 0) + 1
+                        )
+                        continue
+                    if unchanged:
+                        self.heartbeats += 1
+                self._last_stored[pair] = (rate, epoch)
+                accepted.append(record)
+            self.written += len(accepted)
+        return accepted
+
+    def reset(self) -> None:
+        """Забывает последние значения: они перечитаются из истории"""
+        with self._lock:
+            self._last_stored.clear()
+
+    def stats(self) -> Dict:
+        """Счетчики записанных, контрольных и отсеянных курсов"""
+        with self._lock:
+            return {
+                "written": self.written,
+                "heartbeats": self.heartbeats,
+                "suppressed": self.suppressed,
+                "suppressed_by_pair": dict(self.suppressed_by_pair),
+            }
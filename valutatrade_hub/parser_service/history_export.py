@@ -0,0 +1,73 @@
+# valutatrade_hub/parser_service/history_export.py
+"""
+Потоковая выгрузка истории курсов в CSV и NDJSON
+"""
+
+import csv
+import io
+import json
+from itertools import islice
+from typing import Callable, Dict, Iterable, Optional, TextIO
+
+EXPORT_FORMATS = ("csv", "ndjson")
+
+CSV_FIELDS = ("id", "from_currency", "to_currency", "rate", "timestamp", "source")
+
+
+def _render_csv(chunk: list, header: bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if header:
+        writer.writerow(CSV_FIELDS + ("meta",))
+    for record in chunk:
+        writer.writerow(
+            [record.get(field, "") for field in CSV_FIELDS]
+            + [json.dumps(record.get("meta") or {}, ensure_ascii=False, default=str)]
+        )
+    return buffer.getvalue()
+
+
+def _render_ndjson(chunk: list) -> str:
+    return "".join(
+        json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str)
+        + "\n"
+        for record in chunk
+    )
+
+
+def export_history(
+    records: Iterable[Dict],
+    stream: TextIO,
+    fmt: str = "csv",
+    chunk_size: int = 5000,
+    progress: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Пишет записи истории в поток порциями по chunk_size.
+
+    В памяти одновременно только одна порция: записи берутся из
+    генератора (RatesStorage.iter_history_filtered), форматируются и
+    сбрасываются в поток. После каждой порции вызывается progress с
+    числом уже выгруженных записей. meta в CSV пишется строкой JSON.
+
+    Returns:
+        Количество выгруженных записей
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(
+            f"неизвестный формат '{fmt}', доступны: {', '.join(EXPORT_FORMATS)}"
+        )
+    records = iter(records)
+    total = 0
+    while chunk := list(islice(records, chunk_size)):
+        if fmt == "csv":
+            stream.write(_render_csv(chunk, header=total == 0))
+        else:
+            stream.write(_render_ndjson(chunk))
+        stream.flush()
+        total += len(chunk)
+        if progress is not None:
+            progress(total)
+    if fmt == "csv" and total == 0:
+        stream.write(_render_csv([], header=True))
+    return total
@@ -0,0 +1,451 @@
+# valutatrade_hub/parser_service/history_log.py
+"""
+Журнал истории курсов из сегментов, допускающий только дозапись
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..infra.file_lock import DirectoryLock
+from .sealed_segment import SEALED_SUFFIX, SealedSegment, write_sealed
+from .timestamps import to_epoch
+
+MANIFEST_NAME = "manifest.json"
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".ndjson"
+
+
+class SegmentedHistoryLog:
+    """
+    История курсов в виде набора сегментов NDJSON (одна запись на строку).
+
+    Новые записи дописываются в конец активного сегмента, поэтому добавление
+    тика стоит ровно столько байт, сколько занимает сам тик. Когда активный
+    сегмент превышает лимит по размеру, он закрывается и запись продолжается
+    в новый. Манифест хранит список закрытых сегментов и имя активного.
+
+    Закрытые сегменты можно запечатать (seal): переписать в сжатый формат
+    с блочным индексом по времени (см. sealed_segment.py).
+
+    Дозапись и изменения манифеста идут под блокировкой каталога журнала
+    (DirectoryLock), поэтому планировщик и CLI могут писать одновременно.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_max_bytes: int = 4 * 1024 * 1024,
+        legacy_file: Optional[str] = None,
+    ):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self._lock = threading.Lock()
+        self._manifest_mtime: Optional[int] = None
+        os.makedirs(self.directory, exist_ok=True)
+        self.file_lock = DirectoryLock(self.directory)
+        self._manifest = self._load_manifest()
+        if legacy_file:
+            self._migrate_legacy(legacy_file)
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Исключительный доступ к журналу: потоки процесса и другие процессы"""
+        with self.file_lock.exclusive(), self._lock:
+            yield
+
+    # Манифест
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def _load_manifest(self) -> Dict:
+        """Читает манифест или создает пустой"""
+        try:
+            self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"version": 1, "next_segment": 1, "active": None, "segments": []}
+
+    def _refresh_manifest(self) -> None:
+        """Перечитывает манифест, если его обновил другой процесс"""
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._manifest_mtime:
+            self._manifest = self._load_manifest()
+
+    def _save_manifest(self) -> None:
+        """Атомарно перезаписывает манифест (он небольшой)"""
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self._manifest_mtime = os.stat(self.manifest_path).st_mtime_ns
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _new_segment_name(self) -> str:
+        number = self._manifest["next_segment"]
+        self._manifest["next_segment"] = number + 1
+        return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+    # Запись
+
+    @staticmethod
+    def _encode(records: Iterable[Dict]) -> List[str]:
+        return [
+            json.dumps(record, ensure_ascii=False, separators=(",", ":"), default=str)
+            for record in records
+        ]
+
+    def append(self, records: Iterable[Dict]) -> int:
+        """Дописывает записи в активный сегмент и возвращает их количество"""
+        lines = self._encode(records)
+        if not lines:
+            return 0
+        with self._exclusive():
+            self._write(("\n".join(lines) + "\n").encode("utf-8"))
+        return len(lines)
+
+    def _write(self, payload: bytes) -> None:
+        """Дописывает готовые строки в активный сегмент (только под _exclusive)"""
+        self._refresh_manifest()
+        active = self._manifest.get("active")
+        if active is None:
+            active = self._roll()
+        else:
+            path = self._segment_path(active)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            if size and size + len(payload) > self.segment_max_bytes:
+                active = self._roll()
+
+        with open(self._segment_path(active), "ab+") as f:
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # Недописанная строка после сбоя: не склеиваем с ней
+                    # новые записи, иначе при чтении пропадут и они
+                    payload = b"\n" + payload
+            f.write(payload)
+
+    def _roll(self) -> str:
+        """Закрывает активный сегмент и открывает новый"""
+        active = self._manifest.get("active")
+        if active is not None:
+            self._manifest["segments"].append(self._describe_segment(active))
+        new_name = self._new_segment_name()
+        self._manifest["active"] = new_name
+        self._save_manifest()
+        return new_name
+
+    def _describe_segment(self, name: str) -> Dict:
+        """Собирает сводку по сегменту для манифеста"""
+        count = 0
+        first_ts = last_ts = None
+        for record in self._read_segment(name):
+            count += 1
+            timestamp = record.get("timestamp")
+            if first_ts is None:
+                first_ts = timestamp
+            last_ts = timestamp
+        path = self._segment_path(name)
+        return {
+            "name": name,
+            "records": count,
+            "bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+            "first_ts": first_ts,
+            "last_ts": last_ts,
+        }
+
+    # Чтение
+
+    def segment_names(self) -> List[str]:
+        """Имена сегментов в порядке записи, активный последним"""
+        names = [segment["name"] for segment in self._manifest["segments"]]
+        if self._manifest.get("active"):
+            names.append(self._manifest["active"])
+        return names
+
+    def _read_segment(
+        self, name: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """
+        Читает один сегмент, для диапазона [start, end] - только его записи.
+
+        Запечатанный сегмент распаковывает лишь блоки, попадающие в диапазон.
+        """
+        if name.endswith(SEGMENT_SUFFIX) and not os.path.exists(
+            self._segment_path(name)
+        ):
+            # Сегмент могли запечатать, пока читатель шел по старому списку
+            sealed = name[: -len(SEGMENT_SUFFIX)] + SEALED_SUFFIX
+            if os.path.exists(self._segment_path(sealed)):
+                name = sealed
+        if name.endswith(SEALED_SUFFIX):
+            try:
+                segment = SealedSegment(self._segment_path(name))
+            except FileNotFoundError:
+                return
+            yield from segment.iter_records(start, end)
+            return
+
+        records = self._read_lines(name)
+        if start is None and end is None:
+            yield from records
+            return
+        for record in records:
+            try:
+                epoch = to_epoch(record.get("timestamp"))
+            except (TypeError, ValueError):
+                continue
+            if (start is None or epoch >= start) and (end is None or epoch <= end):
+                yield record
+
+    def _read_lines(self, name: str, offset: int = 0) -> Iterator[Dict]:
+        """Построчно читает сегмент NDJSON, пропуская поврежденные строки"""
+        try:
+            f = open(self._segment_path(name), "rb")
+        except FileNotFoundError:
+            # Сегмента нет или его удалила компакция
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line.decode("utf-8"))
+                except ValueError:
+                    # Недописанная строка после сбоя - пропускаем
+                    continue
+
+    def iter_records(self) -> Iterator[Dict]:
+        """Потоково отдает все записи истории по порядку"""
+        with self._lock:
+            self._refresh_manifest()
+            names = self.segment_names()
+        for name in names:
+            yield from self._read_segment(name)
+
+    @staticmethod
+    def _segment_number(name: str) -> int:
+        return int(name[len(SEGMENT_PREFIX) :].split(".", 1)[0])
+
+    def end_position(self) -> Optional[Tuple[int, int]]:
+        """
+        Позиция конца журнала: номер активного сегмента и его размер.
+
+        Точна, пока вызывающий держит file_lock (сразу после append).
+        """
+        with self._lock:
+            self._refresh_manifest()
+            active = self._manifest.get("active")
+        if active is None:
+            return None
+        path = self._segment_path(active)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return self._segment_number(active), size
+
+    def iter_after(self, position: Optional[Tuple[int, int]]) -> Iterator[Dict]:
+        """
+        Записи, дописанные после позиции end_position (None - все записи).
+
+        Запечатанный сегмент с позицией внутри считается прочитанным:
+        сегмент закрывается только дозаписью, которая сдвигает позицию.
+        """
+        if position is None:
+            yield from self.iter_records()
+            return
+        number, offset = position
+        with self._lock:
+            self._refresh_manifest()
+            names = self.segment_names()
+        for name in names:
+            current = self._segment_number(name)
+            if current < number:
+                continue
+            if current > number:
+                yield from self._read_segment(name)
+            elif name.endswith(SEGMENT_SUFFIX):
+                yield from self._read_lines(name, offset)
+
+    def iter_range(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        pairs: Optional[Iterable[str]] = None,
+    ) -> Iterator[Dict]:
+        """
+        Потоково отдает записи с меткой времени в [start, end] (epoch).
+
+        Запечатанные сегменты целиком вне диапазона не открываются.
+        Фильтр pairs (коды вида BTC_USD) применяется при чтении.
+        """
+        with self._lock:
+            self._refresh_manifest()
+            segments = list(self._manifest["segments"])
+            active = self._manifest.get("active")
+        names = [
+            segment["name"]
+            for segment in segments
+            if not segment.get("sealed") or self._overlaps(segment, start, end)
+        ]
+        if active:
+            names.append(active)
+        wanted = None if pairs is None else {pair.upper() for pair in pairs}
+        for name in names:
+            for record in self._read_segment(name, start, end):
+                if wanted is None or (
+                    f"{record.get('from_currency')}_{record.get('to_currency')}"
+                    in wanted
+                ):
+                    yield record
+
+    @staticmethod
+    def _overlaps(segment: Dict, start: Optional[int], end: Optional[int]) -> bool:
+        """Пересекается ли запечатанный сегмент с диапазоном по min/max epoch"""
+        min_epoch, max_epoch = segment.get("min_epoch"), segment.get("max_epoch")
+        if min_epoch is None or max_epoch is None:
+            return True
+        return (start is None or max_epoch >= start) and (
+            end is None or min_epoch <= end
+        )
+
+    # Запечатывание
+
+    def seal(self, codec: str = "gzip", block_records: int = 1024) -> int:
+        """
+        Переписывает закрытые сегменты NDJSON в запечатанный формат.
+
+        Сжатие идет без блокировки: дозапись продолжается в активный
+        сегмент, под блокировкой только подменяется запись в манифесте.
+
+        Returns:
+            Количество запечатанных сегментов
+        """
+        with self._lock:
+            self._refresh_manifest()
+            pending = [
+                segment["name"]
+                for segment in self._manifest["segments"]
+                if not segment.get("sealed")
+            ]
+
+        sealed_count = 0
+        for name in pending:
+            sealed_name = name[: -len(SEGMENT_SUFFIX)] + SEALED_SUFFIX
+            sealed_path = self._segment_path(sealed_name)
+            footer = write_sealed(
+                sealed_path, self._read_lines(name), codec, block_records
+            )
+            blocks = footer["blocks"]
+            description = {
+                "name": sealed_name,
+                "records": footer["records"],
+                "bytes": os.path.getsize(sealed_path),
+                "first_ts": footer["first_ts"],
+                "last_ts": footer["last_ts"],
+                "sealed": True,
+                "codec": codec,
+                "min_epoch": min((block[0] for block in blocks), default=None),
+                "max_epoch": max((block[1] for block in blocks), default=None),
+            }
+
+            with self._exclusive():
+                self._refresh_manifest()
+                segments = self._manifest["segments"]
+                position = next(
+                    (i for i, seg in enumerate(segments) if seg["name"] == name),
+                    None,
+                )
+                if position is not None:
+                    segments[position] = description
+                    self._save_manifest()
+            if position is None:
+                # Сегмент удалили, пока он сжимался
+                os.remove(sealed_path)
+                continue
+            os.remove(self._segment_path(name))
+            sealed_count += 1
+        return sealed_count
+
+    # Удаление старых данных
+
+    def drop_before(self, epoch: int) -> int:
+        """
+        Удаляет закрытые сегменты, все записи которых старше epoch.
+
+        Активный сегмент и сегменты с более новыми записями не трогаются,
+        поэтому дозапись не ждет удаления: под блокировкой меняется только
+        манифест, файлы удаляются после.
+
+        Returns:
+            Количество удаленных записей
+        """
+        with self._exclusive():
+            self._refresh_manifest()
+            expired = [
+                segment
+                for segment in self._manifest["segments"]
+                if (self._newest_epoch(segment) or epoch) < epoch
+            ]
+            if not expired:
+                return 0
+            names = {segment["name"] for segment in expired}
+            self._manifest["segments"] = [
+                segment
+                for segment in self._manifest["segments"]
+                if segment["name"] not in names
+            ]
+            self._save_manifest()
+
+        for name in names:
+            try:
+                os.remove(self._segment_path(name))
+            except FileNotFoundError:
+                pass
+        return sum(segment["records"] for segment in expired)
+
+    @staticmethod
+    def _newest_epoch(segment: Dict) -> Optional[int]:
+        """Самая поздняя метка сегмента (у запечатанных - из индекса блоков)"""
+        if segment.get("max_epoch") is not None:
+            return segment["max_epoch"]
+        if segment.get("last_ts"):
+            return to_epoch(segment["last_ts"])
+        return None
+
+    # Миграция
+
+    def _migrate_legacy(self, legacy_file: str) -> None:
+        """
+        Однократно переносит историю из старого exchange_rates.json.
+
+        Проверка, перенос и отметка в манифесте идут в одной критической
+        секции: процессы, стартующие одновременно, не перенесут историю
+        несколько раз.
+        """
+        if self._manifest.get("migrated_from") or not os.path.exists(legacy_file):
+            return
+        with self._exclusive():
+            self._refresh_manifest()
+            if self._manifest.get("migrated_from") or self.segment_names():
+                return
+            try:
+                with open(legacy_file, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                legacy = []
+            if isinstance(legacy, list) and legacy:
+                lines = self._encode(legacy)
+                self._write(("\n".join(lines) + "\n").encode("utf-8"))
+            self._manifest["migrated_from"] = os.path.basename(legacy_file)
+            self._save_manifest()
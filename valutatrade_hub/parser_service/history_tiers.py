@@ -0,0 +1,253 @@
+# valutatrade_hub/parser_service/history_tiers.py
+"""
+Ярусы истории курсов из агрегированных свечей (1m, 1h)
+"""
+
+import bisect
+import json
+import os
+import struct
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from ..infra.file_lock import DirectoryLock
+from ..infra.json_store import write_atomic
+
+TIER_SUFFIX = ".bin"
+WATERMARKS_FILE = "tiers.json"
+
+# Свеча: начало интервала, open, high, low, close (float64), число тиков
+_CANDLE = struct.Struct("<qddddq")
+
+# Колонки свечей пары в памяти
+_Columns = Tuple[array, array, array, array, array, array]
+
+
+class CandleTier:
+    """
+    Ярус истории: свечи одного интервала по парам.
+
+    Для каждой пары хранится файл <PAIR>.bin из записей фиксированной
+    длины, отсортированных по началу интервала. Свечи только дописываются
+    (компакция добавляет закрытые интервалы), старые удаляются целиком
+    заменой файла. Колонки кэшируются в памяти до изменения файла.
+
+    Дозапись и замена файлов идут под блокировкой каталога яруса, поэтому
+    замена не теряет свечи, дописанные другим процессом.
+    """
+
+    def __init__(self, directory: str, name: str, step: int):
+        self.directory = os.path.join(directory, name)
+        self.name = name
+        self.step = step
+        self._lock = threading.Lock()
+        self.file_lock = DirectoryLock(self.directory)
+        # pair -> (колонки, (inode, размер) прочитанного файла)
+        self._cache: Dict[str, Tuple[_Columns, Tuple[int, int]]] = {}
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Изменение файлов яруса: потоки процесса и другие процессы"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.file_lock.exclusive(), self._lock:
+            yield
+
+    def _path(self, pair: str) -> str:
+        return os.path.join(self.directory, f"{pair}{TIER_SUFFIX}")
+
+    def pairs(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[: -len(TIER_SUFFIX)]
+            for name in os.listdir(self.directory)
+            if name.endswith(TIER_SUFFIX)
+        )
+
+    def _load(self, pair: str) -> _Columns:
+        """Колонки bucket, open, high, low, close, ticks пары"""
+        try:
+            stat = os.stat(self._path(pair))
+            signature = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            signature = (0, 0)
+        cached = self._cache.get(pair)
+        if cached is not None and cached[1] == signature:
+            return cached[0]
+
+        columns = (
+            array("q"),
+            array("d"),
+            array("d"),
+            array("d"),
+            array("d"),
+            array("q"),
+        )
+        if signature[1]:
+            with open(self._path(pair), "rb") as f:
+                data = f.read(signature[1] - signature[1] % _CANDLE.size)
+            for entry in _CANDLE.iter_unpack(data):
+                for column, value in zip(columns, entry):
+                    column.append(value)
+        self._cache[pair] = (columns, signature)
+        return columns
+
+    def last_bucket(self, pair: str) -> Optional[int]:
+        with self._lock:
+            buckets = self._load(pair.upper())[0]
+        return buckets[-1] if buckets else None
+
+    def append(self, pair: str, candles: List[Dict]) -> int:
+        """Дописывает свечи новее последней сохраненной"""
+        pair = pair.upper()
+        with self._exclusive():
+            buckets = self._load(pair)[0]
+            last = buckets[-1] if buckets else None
+            fresh = [c for c in candles if last is None or c["bucket"] > last]
+            if not fresh:
+                return 0
+            with open(self._path(pair), "ab") as f:
+                f.write(
+                    b"".join(
+                        _CANDLE.pack(
+                            c["bucket"],
+                            c["open"],
+                            c["high"],
+                            c["low"],
+                            c["close"],
+                            c["ticks"],
+                        )
+                        for c in fresh
+                    )
+                )
+        return len(fresh)
+
+    def drop_before(self, pair: str, epoch: int) -> int:
+        """Удаляет свечи, начавшиеся раньше epoch"""
+        pair = pair.upper()
+        with self._exclusive():
+            buckets = self._load(pair)[0]
+            count = bisect.bisect_left(buckets, epoch)
+            if not count:
+                return 0
+            with open(self._path(pair), "rb") as f:
+                f.seek(count * _CANDLE.size)
+                remaining = f.read()
+            write_atomic(self._path(pair), remaining)
+        return count
+
+    def drop_from(self, pair: str, epoch: Optional[int] = None) -> int:
+        """Удаляет свечи, начавшиеся не раньше epoch (None - все свечи пары)"""
+        pair = pair.upper()
+        with self._exclusive():
+            buckets = self._load(pair)[0]
+            keep = 0 if epoch is None else bisect.bisect_left(buckets, epoch)
+            dropped = len(buckets) - keep
+            if not dropped:
+                return 0
+            with open(self._path(pair), "rb") as f:
+                remaining = f.read(keep * _CANDLE.size)
+            # Новый inode: кэш других процессов не примет старые колонки
+            write_atomic(self._path(pair), remaining)
+        return dropped
+
+    def _range(self, pair: str, start: Optional[int], end: Optional[int]):
+        with self._lock:
+            columns = self._load(pair.upper())
+        buckets = columns[0]
+        lo = 0 if start is None else bisect.bisect_left(buckets, start)
+        hi = len(buckets) if end is None else bisect.bisect_right(buckets, end)
+        return columns, lo, hi
+
+    def candles(
+        self, pair: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> List[Dict]:
+        """Свечи пары, начавшиеся в диапазоне [start, end]"""
+        columns, lo, hi = self._range(pair, start, end)
+        fields = ("bucket", "open", "high", "low", "close", "ticks")
+        return [
+            dict(zip(fields, (column[i] for column in columns))) for i in range(lo, hi)
+        ]
+
+    def get_series(
+        self, pair: str, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Tuple[Sequence[int], Sequence[float]]:
+        """Колонки (начало интервала, курс закрытия) за диапазон [start, end]"""
+        columns, lo, hi = self._range(pair, start, end)
+        return columns[0][lo:hi], columns[4][lo:hi]
+
+    def rate_at(self, pair: str, epoch: int) -> Optional[Tuple[int, float]]:
+        """
+        Курс закрытия последней свечи, закончившейся не позже epoch.
+
+        Свеча, внутри которой лежит epoch, не подходит: ее закрытие может
+        быть позже epoch. Метка - последняя секунда интервала свечи.
+        """
+        columns, _, hi = self._range(pair, None, epoch - self.step + 1)
+        if not hi:
+            return None
+        return columns[0][hi - 1] + self.step - 1, columns[4][hi - 1]
+
+
+class HistoryTiers:
+    """
+    Агрегированные ярусы истории и границы, с которых ярусы полны.
+
+    raw_from - начиная с этого момента сырые тики хранятся полностью,
+    более старые уже свернуты в свечи. minute_from - начиная с этого
+    момента полон ярус 1m, раньше остается только 1h. None означает, что
+    граница еще не сдвигалась и ярус хранит всю историю.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.minute = CandleTier(directory, "1m", 60)
+        self.hourly = CandleTier(directory, "1h", 3600)
+        self._signature: Optional[Tuple[int, int]] = None
+        self._watermarks: Dict = {}
+
+    @property
+    def watermarks_path(self) -> str:
+        return os.path.join(self.directory, WATERMARKS_FILE)
+
+    def watermarks(self) -> Tuple[Optional[int], Optional[int]]:
+        """Границы (raw_from, minute_from), перечитываются при изменении файла"""
+        try:
+            stat = os.stat(self.watermarks_path)
+            signature = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            return None, None
+        if signature != self._signature:
+            try:
+                with open(self.watermarks_path, "r", encoding="utf-8") as f:
+                    self._watermarks = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._watermarks = {}
+            self._signature = signature
+        return self._watermarks.get("raw_from"), self._watermarks.get("minute_from")
+
+    def set_watermarks(
+        self, raw_from: Optional[int], minute_from: Optional[int], **extra
+    ) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        payload = {"raw_from": raw_from, "minute_from": minute_from, **extra}
+        write_atomic(self.watermarks_path, json.dumps(payload, indent=2).encode())
+
+    def plan(self, raw_source) -> List[Tuple[object, Optional[int], Optional[int]]]:
+        """
+        Источники данных по времени: (источник, с, до) - полуинтервалы
+        [с, до) по возрастанию, None - без границы. Для каждого участка
+        выбран самый подробный ярус, который его покрывает.
+        """
+        raw_from, minute_from = self.watermarks()
+        if raw_from is None:
+            return [(raw_source, None, None)]
+        if minute_from is None or minute_from >= raw_from:
+            return [(self.minute, None, raw_from), (raw_source, raw_from, None)]
+        return [
+            (self.hourly, None, minute_from),
+            (self.minute, minute_from, raw_from),
+            (raw_source, raw_from, None),
+        ]
@@ -0,0 +1,293 @@
+# valutatrade_hub/parser_service/rate_index.py
+"""
+Индекс курсов по времени для поиска "курс на момент T"
+"""
+
+import bisect
+import json
+import os
+import struct
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ..infra.file_lock import DirectoryLock
+from .timestamps import to_epoch
+
+INDEX_SUFFIX = ".idx"
+# Позиция журнала истории, до которой записи уже попали в индекс
+MARK_FILE = "mark.json"
+
+# Запись индекса: epoch-секунды (int64) и курс (float64), little-endian
+_ENTRY = struct.Struct("<qd")
+
+
+class RateIndex:
+    """
+    Постоянный индекс по парам: отсортированные метки времени и курсы.
+
+    Для каждой пары хранится файл <PAIR>.idx из записей фиксированной длины.
+    Новые тики дописываются в конец файла, в памяти держатся отсортированные
+    колонки, по которым поиск выполняется бинарным поиском. Если файл вырос
+    в другом процессе, дочитывается только его хвост.
+
+    Все изменения файлов идут под блокировкой каталога индекса
+    (DirectoryLock), поэтому перезапись файла пары не теряет тики, которые
+    дописывает другой процесс. В mark.json хранится позиция журнала, до
+    которой записи проиндексированы: после сбоя между записью в журнал и в
+    индекс RatesStorage дочитывает пропущенный хвост (catch_up).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.file_lock = DirectoryLock(self.directory)
+        # pair -> (метки времени, курсы, прочитанный размер файла, inode)
+        self._cache: Dict[str, Tuple[array, array, int, int]] = {}
+
+    def exists(self) -> bool:
+        """Построен ли индекс (есть отметка позиции журнала)"""
+        return os.path.exists(self._mark_path)
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        """Изменение файлов индекса: потоки процесса и другие процессы"""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.file_lock.exclusive(), self._lock:
+            yield
+
+    def _path(self, pair: str) -> str:
+        return os.path.join(self.directory, f"{pair}{INDEX_SUFFIX}")
+
+    def pairs(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            name[: -len(INDEX_SUFFIX)]
+            for name in os.listdir(self.directory)
+            if name.endswith(INDEX_SUFFIX)
+        )
+
+    # Отметка позиции журнала
+
+    @property
+    def _mark_path(self) -> str:
+        return os.path.join(self.directory, MARK_FILE)
+
+    def mark(self) -> Optional[Tuple[int, int]]:
+        """Позиция журнала (номер сегмента, смещение), покрытая индексом"""
+        try:
+            with open(self._mark_path, "r", encoding="utf-8") as f:
+                position = json.load(f).get("position")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return tuple(position) if position else None
+
+    def _save_mark(self, position: Optional[Tuple[int, int]]) -> None:
+        # Индекс восстанавливается из журнала, поэтому без fsync
+        tmp_path = f"{self._mark_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"position": list(position) if position else None}, f)
+        os.replace(tmp_path, self._mark_path)
+
+    @staticmethod
+    def _group(records: Iterable[Dict]) -> Dict[str, List[Tuple[int, float]]]:
+        grouped: Dict[str, List[Tuple[int, float]]] = {}
+        for record in records:
+            pair = f"{record['from_currency']}_{record['to_currency']}".upper()
+            grouped.setdefault(pair, []).append(
+                (to_epoch(record["timestamp"]), float(record["rate"]))
+            )
+        return grouped
+
+    # Построение
+
+    def build(
+        self, records: Iterable[Dict], position: Optional[Tuple[int, int]] = None
+    ) -> int:
+        """
+        Строит индекс с нуля по потоку записей истории.
+
+        position - позиция журнала после последней из records. Файлы пар
+        заменяются по одному под блокировкой, каталог остается на месте.
+        """
+        series = self._group(records)
+        with self._exclusive():
+            for pair in set(self.pairs()) - set(series):
+                os.remove(self._path(pair))
+            for pair, entries in series.items():
+                entries.sort(key=lambda entry: entry[0])
+                self._rewrite(pair, entries)
+            self._save_mark(position)
+            self._cache.clear()
+        return sum(len(entries) for entries in series.values())
+
+    def _rewrite(self, pair: str, entries: Iterable[Tuple[int, float]]) -> None:
+        """Заменяет файл пары (только под _exclusive)"""
+        tmp_path = f"{self._path(pair)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(_ENTRY.pack(*entry) for entry in entries))
+        os.replace(tmp_path, self._path(pair))
+
+    # Инкрементальное обновление
+
+    def add(
+        self, records: Iterable[Dict], position: Optional[Tuple[int, int]] = None
+    ) -> None:
+        """Добавляет в индекс новые записи истории и сдвигает отметку журнала"""
+        grouped = self._group(records)
+        with self._exclusive():
+            for pair, entries in grouped.items():
+                self._add_pair(pair, entries)
+            if position is not None:
+                self._save_mark(position)
+
+    def catch_up(
+        self, records: Iterable[Dict], position: Optional[Tuple[int, int]]
+    ) -> int:
+        """
+        Дочитывает записи журнала после отметки (после сбоя между записью
+        в журнал и в индекс). Уже проиндексированные тики не дублируются.
+
+        Returns:
+            Количество добавленных записей
+        """
+        grouped = self._group(records)
+        added = 0
+        with self._exclusive():
+            for pair, entries in grouped.items():
+                timestamps, rates = self._load(pair)
+                fresh = []
+                for epoch, rate in entries:
+                    lo = bisect.bisect_left(timestamps, epoch)
+                    hi = bisect.bisect_right(timestamps, epoch)
+                    if rate not in rates[lo:hi]:
+                        fresh.append((epoch, rate))
+                if fresh:
+                    self._add_pair(pair, fresh)
+                    added += len(fresh)
+            self._save_mark(position)
+        return added
+
+    def _add_pair(self, pair: str, entries: List[Tuple[int, float]]) -> None:
+        """Дописывает тики пары (только под _exclusive)"""
+        timestamps, rates = self._load(pair)
+        _, _, read_size, inode = self._cache[pair]
+        in_order = all(a[0] <= b[0] for a, b in zip(entries, entries[1:]))
+        if in_order and (not timestamps or entries[0][0] >= timestamps[-1]):
+            payload = b"".join(_ENTRY.pack(*entry) for entry in entries)
+            with open(self._path(pair), "ab") as f:
+                f.write(payload)
+            timestamps.extend(entry[0] for entry in entries)
+            rates.extend(entry[1] for entry in entries)
+            if not inode:
+                inode = os.stat(self._path(pair)).st_ino
+            # Под блокировкой файл никто не дописывал: размер известен точно
+            self._cache[pair] = (timestamps, rates, read_size + len(payload), inode)
+            return
+
+        # Запоздавшие тики: вставляем по месту и перезаписываем файл пары
+        for epoch, rate in entries:
+            position = bisect.bisect_right(timestamps, epoch)
+            timestamps.insert(position, epoch)
+            rates.insert(position, rate)
+        self._rewrite(pair, zip(timestamps, rates))
+        self._cache.pop(pair, None)
+
+    # Удаление старых данных
+
+    def drop_before(self, epoch: int) -> int:
+        """
+        Удаляет из индекса записи раньше epoch.
+
+        Хвост файла пары копируется во временный файл без блокировки; тики,
+        дописанные за это время (в том числе другими процессами), переносятся
+        под межпроцессной блокировкой индекса перед заменой.
+
+        Returns:
+            Количество удаленных записей
+        """
+        dropped = 0
+        for pair in self.pairs():
+            path = self._path(pair)
+            with self._lock:
+                timestamps, _ = self._load(pair)
+                count = bisect.bisect_left(timestamps, epoch)
+                _, _, size, inode = self._cache[pair]
+            if not count:
+                continue
+
+            tmp_path = f"{path}.compact"
+            with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                src.seek(count * _ENTRY.size)
+                dst.write(src.read(size - count * _ENTRY.size))
+
+            with self._exclusive():
+                stat = os.stat(path)
+                if stat.st_ino != inode or stat.st_size < size:
+                    # Файл перестроен во время копирования - в другой раз
+                    os.remove(tmp_path)
+                    continue
+                with open(path, "rb") as src, open(tmp_path, "ab") as dst:
+                    src.seek(size)
+                    dst.write(src.read())
+                os.replace(tmp_path, path)
+                self._cache.pop(pair, None)
+            dropped += count
+        return dropped
+
+    # Чтение
+
+    def _load(self, pair: str) -> Tuple[array, array]:
+        """Возвращает колонки пары, дочитывая файл при необходимости"""
+        path = self._path(pair)
+        try:
+            stat = os.stat(path)
+            size, inode = stat.st_size - stat.st_size % _ENTRY.size, stat.st_ino
+        except FileNotFoundError:
+            size, inode = 0, 0
+
+        timestamps, rates, read_size, read_inode = self._cache.get(
+            pair, (array("q"), array("d"), 0, inode)
+        )
+        if size < read_size or inode != read_inode:
+            # Файл перестроен - читаем заново
+            timestamps, rates, read_size = array("q"), array("d"), 0
+        if size > read_size:
+            with open(path, "rb") as f:
+                f.seek(read_size)
+                chunk = f.read(size - read_size)
+            for epoch, rate in _ENTRY.iter_unpack(chunk):
+                timestamps.append(epoch)
+                rates.append(rate)
+        self._cache[pair] = (timestamps, rates, size, inode)
+        return timestamps, rates
+
+    def get_series(
+        self,
+        pair: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[Sequence[int], Sequence[float]]:
+        """Колонки (epoch-секунды, курсы) пары за диапазон [start, end]"""
+        with self._lock:
+            timestamps, rates = self._load(pair.upper())
+        lo = 0 if start is None else bisect.bisect_left(timestamps, start)
+        hi = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+        return timestamps[lo:hi], rates[lo:hi]
+
+    def last_epoch(self, pair: str) -> Optional[int]:
+        """Самая поздняя метка времени пары"""
+        with self._lock:
+            timestamps, _ = self._load(pair.upper())
+        return timestamps[-1] if timestamps else None
+
+    def rate_at(self, pair: str, epoch: int) -> Optional[Tuple[int, float]]:
+        """Последний известный курс пары не позже момента epoch"""
+        with self._lock:
+            timestamps, rates = self._load(pair.upper())
+        position = bisect.bisect_right(timestamps, epoch) - 1
+        if position < 0:
+            return None
+        return timestamps[position], rates[position]
@@ -0,0 +1,156 @@
+# valutatrade_hub/parser_service/response_cache.py
+"""
+Кэш последних ответов провайдеров курсов
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from ..infra.file_lock import DirectoryLock
+from ..infra.json_store import write_atomic
+
+
+class ProviderResponseCache:
+    """
+    Последний ответ каждого провайдера: курсы, валидаторы ETag и
+    Last-Modified для условных запросов и момент next_update (epoch),
+    раньше которого у провайдера не может быть новых данных.
+
+    Кэш хранится в JSON-файле, поэтому переживает перезапуск планировщика
+    и CLI. Отпечаток fingerprint (курсы без временных меток) позволяет
+    отличить новые данные от повторной отдачи прежних.
+
+    Файл общий для планировщика и CLI: чтение подхватывает записи других
+    процессов, а запись перечитывает файл под межпроцессной блокировкой и
+    меняет только запись своего провайдера.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        self.file_lock = DirectoryLock(
+            directory, lock_file=f".{os.path.basename(path)}.lock"
+        )
+        self._lock = threading.Lock()
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._entries: Dict[str, Dict] = self._load()
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stat = os.fstat(f.fileno())
+                self._signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _reload_if_changed(self) -> None:
+        """Перечитывает файл, если его заменил другой процесс"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (stat.st_ino, stat.st_size, stat.st_mtime_ns) != self._signature:
+            self._entries = self._load()
+
+    def _save(self) -> None:
+        payload = json.dumps(self._entries, indent=2, ensure_ascii=False, default=str)
+        write_atomic(self.path, payload.encode("utf-8"))
+        # Свою запись не перечитываем: файл меняется только под file_lock
+        stat = os.stat(self.path)
+        self._signature = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def _update(self, name: str, change: Callable[[Dict], None]) -> Dict:
+        """
+        Меняет запись провайдера поверх свежего содержимого файла.
+
+        Returns:
+            Запись провайдера до изменения
+        """
+        with self.file_lock.exclusive(), self._lock:
+            self._entries = self._load()
+            previous = dict(self._entries.get(name, {}))
+            change(self._entries.setdefault(name, {}))
+            self._save()
+        return previous
+
+    @staticmethod
+    def fingerprint(rates: Dict) -> str:
+        """Отпечаток курсов без временных меток"""
+        values = {pair: data.get("rate") for pair, data in rates.items()}
+        return hashlib.sha1(
+            json.dumps(values, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, name: str) -> Dict:
+        with self._lock:
+            self._reload_if_changed()
+            return dict(self._entries.get(name, {}))
+
+    def rates(self, name: str) -> Dict:
+        """Курсы из последнего ответа провайдера"""
+        return self.get(name).get("rates", {})
+
+    def is_fresh(self, name: str, now: Optional[float] = None) -> bool:
+        """Можно ли не обращаться к провайдеру: новых данных еще нет"""
+        entry = self.get(name)
+        next_update = entry.get("next_update")
+        if not next_update or not entry.get("rates"):
+            return False
+        return (now if now is not None else time.time()) < next_update
+
+    def conditional_headers(self, name: str) -> Dict[str, str]:
+        """Заголовки If-None-Match / If-Modified-Since для условного запроса"""
+        entry = self.get(name)
+        if not entry.get("rates"):
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(
+        self,
+        name: str,
+        rates: Dict,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        next_update: Optional[float] = None,
+    ) -> bool:
+        """
+        Запоминает новый ответ провайдера.
+
+        Returns:
+            True, если курсы отличаются от предыдущего ответа
+        """
+        fingerprint = self.fingerprint(rates)
+
+        def change(entry: Dict) -> None:
+            entry.clear()
+            entry.update(
+                rates=rates,
+                fingerprint=fingerprint,
+                etag=etag,
+                last_modified=last_modified,
+                next_update=next_update,
+                fetched_at=time.time(),
+            )
+
+        previous = self._update(name, change)
+        return previous.get("fingerprint") != fingerprint
+
+    def touch(self, name: str, next_update: Optional[float] = None) -> None:
+        """Отмечает ответ 304: данные прежние, сдвигается только next_update"""
+
+        def change(entry: Dict) -> None:
+            entry["next_update"] = next_update
+            entry["fetched_at"] = time.time()
+
+        self._update(name, change)
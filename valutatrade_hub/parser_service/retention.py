@@ -0,0 +1,122 @@
+# valutatrade_hub/parser_service/retention.py
+"""
+Компакция истории курсов: свертка старых тиков в ярусы свечей
+"""
+
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+from ..infra.file_lock import DirectoryLock
+from .candles import aggregate_candles
+from .storage import RatesStorage
+from .timestamps import from_epoch
+
+_HOUR = 3600
+_DAY = 86400
+
+
+class HistoryCompactor:
+    """
+    Хранение истории по ярусам.
+
+    Сырые тики хранятся raw_days дней, минутные свечи - minute_weeks
+    недель, часовые - всегда. Компакция сворачивает тики старше raw_days
+    сразу в свечи 1m и 1h (агрегатом aggregate_candles), сдвигает границы
+    ярусов и только после этого удаляет свернутые тики и устаревшие
+    минутные свечи. Сбой на любом шаге оставляет данные в двух ярусах, но
+    не теряет их; повторная компакция продолжит с последней свечи яруса.
+
+    Границы выравниваются по часу, поэтому в ярусы попадают только
+    закрытые интервалы. Дозапись новых тиков компакцию не ждет: ярусы
+    пишет только компакция, а бэкенды удаляют старые данные без
+    долгих блокировок. Несколько процессов компактируют по очереди
+    (блокировка каталога ярусов). В конце прохода закрытые сегменты
+    журнала запечатываются (storage.seal_history).
+    """
+
+    def __init__(
+        self,
+        storage: RatesStorage,
+        raw_days: Optional[int] = None,
+        minute_weeks: Optional[int] = None,
+    ):
+        self.storage = storage
+        config = storage.config
+        self.raw_days = config.RETENTION_RAW_DAYS if raw_days is None else raw_days
+        self.minute_weeks = (
+            config.RETENTION_MINUTE_WEEKS if minute_weeks is None else minute_weeks
+        )
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(storage.tiers.directory, exist_ok=True)
+        self.lock = DirectoryLock(storage.tiers.directory)
+
+    @staticmethod
+    def _now() -> int:
+        """Текущее время в шкале меток истории (epoch UTC)"""
+        return int(time.time())
+
+    def compact(self, now: Optional[int] = None) -> Dict:
+        """
+        Выполняет один проход компакции.
+
+        Returns:
+            Отчет: границы ярусов, число свернутых свечей и удаленных записей
+        """
+        now = self._now() if now is None else now
+        raw_cutoff = (now - self.raw_days * _DAY) // _HOUR * _HOUR
+        minute_cutoff = min(
+            raw_cutoff, (now - self.minute_weeks * 7 * _DAY) // _HOUR * _HOUR
+        )
+        tiers = self.storage.tiers
+        report = {
+            "raw_from": from_epoch(raw_cutoff),
+            "minute_from": from_epoch(minute_cutoff),
+            "candles_1m": 0,
+            "candles_1h": 0,
+            "raw_dropped": 0,
+            "minute_dropped": 0,
+            "segments_sealed": 0,
+        }
+        started = time.perf_counter()
+
+        with self.lock.exclusive():
+            # 1. Сворачиваем тики старше границы в оба яруса
+            for pair in self.storage.raw_pairs():
+                for tier, key in (
+                    (tiers.minute, "candles_1m"),
+                    (tiers.hourly, "candles_1h"),
+                ):
+                    last = tier.last_bucket(pair)
+                    since = None if last is None else last + tier.step
+                    if since is not None and since >= raw_cutoff:
+                        continue
+                    timestamps, rates = self.storage.raw_series(
+                        pair, since, raw_cutoff - 1
+                    )
+                    candles = aggregate_candles(timestamps, rates, tier.step)
+                    report[key] += tier.append(pair, candles)
+
+            # 2. Запросы переходят на ярусы, и только потом удаляем данные
+            previous_raw, previous_minute = tiers.watermarks()
+            raw_from = max(raw_cutoff, previous_raw or raw_cutoff)
+            minute_from = max(minute_cutoff, previous_minute or minute_cutoff)
+            tiers.set_watermarks(raw_from, minute_from, compacted_at=from_epoch(now))
+
+            # 3. Удаляем свернутые тики и устаревшие минутные свечи
+            report["raw_dropped"] = self.storage.drop_raw_before(raw_from)
+            for pair in tiers.minute.pairs():
+                report["minute_dropped"] += tiers.minute.drop_before(pair, minute_from)
+
+            # 4. Оставшиеся закрытые сегменты сжимаем
+            report["segments_sealed"] = self.storage.seal_history()
+
+        report["elapsed"] = round(time.perf_counter() - started, 3)
+        self.logger.info(
+            f"History compacted: {report['candles_1m']} 1m and "
+            f"{report['candles_1h']} 1h candles, {report['raw_dropped']} ticks and "
+            f"{report['minute_dropped']} 1m candles dropped, "
+            f"{report['segments_sealed']} segments sealed in {report['elapsed']}s"
+        )
+        return report
@@ -4,23 +4,140 @@
 Планировщик для периодического обновления курсов.
 """
 
+import asyncio
+import heapq
+import random
 import time
 import threading
 import logging
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+from .async_http import AsyncHttpClient
+from .retention import HistoryCompactor
 from .updater import RatesUpdater
 
+COMPACT_JOB = "compact-history"
+
+
+class ScheduledJob:
+    """
+    Периодическое обновление одного провайдера и статистика его запусков.
+
+    action - синхронная функция вместо обновления провайдера (например,
+    компакция истории).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        interval: float,
+        next_run: float,
+        action: Optional[Callable[[], object]] = None,
+    ):
+        self.name = name
+        self.interval = interval
+        self.next_run = next_run  # момент по сетке интервала, без jitter
+        self.action = action
+        self.running = False
+
+        self.runs = 0
+        self.skipped = 0  # тики, пропущенные из-за незавершенного запуска
+        self.missed = 0  # тики, слитые в один при догоняющем запуске
+        self.failures = 0
+        self.last_duration: Optional[float] = None
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag: Optional[float] = None
+        self.max_lag = 0.0
+
+    def record(self, lag: float, duration: float, failed: bool) -> None:
+        """Запоминает опоздание запуска относительно срока и длительность"""
+        self.runs += 1
+        self.failures += failed
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.total_duration += duration
+
+    def stats(self) -> Dict:
+        return {
+            "interval": self.interval,
+            "running": self.running,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "missed": self.missed,
+            "failures": self.failures,
+            "last_duration": self.last_duration,
+            "avg_duration": self.total_duration / self.runs if self.runs else None,
+            "max_duration": self.max_duration,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+        }
+
 
 class RatesScheduler:
-    """Планировщик обновления курсов"""
+    """
+    Планировщик обновления курсов.
+
+    У каждого провайдера свой интервал (SCHEDULE_INTERVALS, например
+    крипта каждые 30 с, фиат раз в час). Сроки запусков лежат в куче,
+    цикл спит ровно до ближайшего из них или до остановки. Срок сдвигается
+    на случайную долю интервала (SCHEDULE_JITTER), сама сетка интервалов
+    при этом не уплывает. Если предыдущий запуск провайдера еще идет, тик
+    пропускается; если планировщик отстал на несколько тиков, выполняется
+    один догоняющий запуск сразу. Длительность и опоздание запусков
+    копятся по каждому провайдеру (stats). Той же очередью раз в
+    RETENTION_COMPACT_INTERVAL запускается компакция истории.
+
+    С use_asyncio=True фоновый поток вместо пула потоков крутит цикл
+    событий (run_async): обновления идут через run_update_async с общим
+    пулом соединений. run_async можно запустить и в собственном цикле
+    событий приложения.
+    """
 
-    def __init__(self, interval_minutes: int = 5):
-        self.interval = interval_minutes * 60  # в секундах
+    def __init__(
+        self,
+        interval_minutes: Optional[float] = None,
+        use_asyncio: bool = False,
+        intervals: Optional[Dict[str, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.use_asyncio = use_asyncio
         self.updater = RatesUpdater()
         self.logger = logging.getLogger(__name__)
+        self.clock = clock
+        self.jitter = self.updater.config.SCHEDULE_JITTER
+
+        if intervals is None:
+            if interval_minutes is not None:
+                # Старый режим: общий интервал для всех провайдеров
+                intervals = {
+                    name: interval_minutes * 60 for name in self.updater.providers
+                }
+            else:
+                intervals = self.updater.config.SCHEDULE_INTERVALS
+        now = self.clock()
+        self.jobs: Dict[str, ScheduledJob] = {
+            name: ScheduledJob(name, float(interval), now)
+            for name, interval in intervals.items()
+            if name in self.updater.providers
+        }
+        # Компакция истории идет отдельной задачей и не мешает дозаписи
+        compact_interval = self.updater.config.RETENTION_COMPACT_INTERVAL
+        if compact_interval > 0:
+            self.compactor = HistoryCompactor(self.updater.storage)
+            self.jobs[COMPACT_JOB] = ScheduledJob(
+                COMPACT_JOB, float(compact_interval), now, self.compactor.compact
+            )
+        self._queue: List[Tuple[float, int, str]] = []
+        self._sequence = 0
+
         self._stop_event = threading.Event()
         self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_stop: Optional[asyncio.Event] = None
 
     def start(self) -> None:
         """Запускает планировщик в отдельном потоке"""
@@ -28,32 +145,172 @@ class RatesScheduler:
             self.logger.warning("Scheduler already running")
             return
         self._stop_event.clear()
-        self._thread = threading.Thread(target=self._run, daemon=True)
+        target = self._run_event_loop if self.use_asyncio else self._run
+        self._thread = threading.Thread(target=target, daemon=True)
         self._thread.start()
-        self.logger.info(f"Scheduler started (interval: {self.interval // 60} min)")
+        intervals = ", ".join(
+            f"{job.name}: {job.interval:g}s" for job in self.jobs.values()
+        )
+        self.logger.info(f"Scheduler started (intervals: {intervals})")
 
     def stop(self) -> None:
         """Останавливает планировщик"""
         self._stop_event.set()
+        if self._loop is not None and self._async_stop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._async_stop.set)
+            except RuntimeError:
+                # Цикл событий уже завершился
+                pass
         if self._thread:
             self._thread.join(timeout=5)
+        self.updater.close()
         self.logger.info("Scheduler stopped")
 
+    def stats(self) -> Dict[str, Dict]:
+        """Статистика запусков по провайдерам и компакции"""
+        return {name: job.stats() for name, job in self.jobs.items()}
+
+    def _reset_queue(self) -> None:
+        """Ставит все провайдеры в очередь с немедленным первым запуском"""
+        now = self.clock()
+        self._queue = []
+        for job in self.jobs.values():
+            job.next_run = now
+            self._push(job, now)
+
+    def _push(self, job: ScheduledJob, due: float) -> None:
+        self._sequence += 1
+        heapq.heappush(self._queue, (due, self._sequence, job.name))
+
+    def _pop_due(self) -> List[Tuple[ScheduledJob, float]]:
+        """
+        Снимает с кучи наступившие сроки и планирует следующие.
+
+        Returns:
+            Провайдеры, которые нужно запустить сейчас, и их сроки
+        """
+        launch = []
+        now = self.clock()
+        while self._queue and self._queue[0][0] <= now:
+            due, _, name = heapq.heappop(self._queue)
+            job = self.jobs[name]
+            if job.running:
+                job.skipped += 1
+                self.logger.warning(
+                    f"Scheduled update of {name} skipped: previous run in progress"
+                )
+            else:
+                job.running = True
+                launch.append((job, due))
+            self._schedule_next(job, now)
+        return launch
+
+    def _schedule_next(self, job: ScheduledJob, now: float) -> None:
+        job.next_run += job.interval
+        if job.next_run <= now:
+            # Отстали на несколько тиков: опоздавший запуск, снятый сейчас,
+            # догоняет их все, следующий срок - первый впереди по сетке
+            behind = int((now - job.next_run) // job.interval) + 1
+            job.missed += behind
+            job.next_run += behind * job.interval
+            self.logger.warning(
+                f"Scheduler behind on {job.name}: {behind} tick(s) merged"
+            )
+        due = job.next_run + random.uniform(0, self.jitter * job.interval)
+        self._push(job, due)
+
+    def _seconds_until_next(self) -> float:
+        return max(0.0, self._queue[0][0] - self.clock())
+
+    def _finish(
+        self, job: ScheduledJob, due: float, started: float, failed: bool
+    ) -> None:
+        duration = self.clock() - started
+        job.record(started - due, duration, failed)
+        job.running = False
+        self.logger.info(
+            f"Scheduled update of {job.name} completed in {duration:.3f}s "
+            f"(lag {started - due:.3f}s)"
+        )
+
+    def _execute(self, job: ScheduledJob, due: float) -> None:
+        started = self.clock()
+        failed = False
+        try:
+            if job.action is not None:
+                job.action()
+            else:
+                self.updater.run_update(source=job.name)
+        except Exception as e:
+            failed = True
+            self.logger.error(f"Scheduled update of {job.name} failed: {e}")
+        finally:
+            self._finish(job, due, started, failed)
+
     def _run(self) -> None:
         """Основной цикл планировщика"""
         self.logger.info("Scheduler running...")
-        while not self._stop_event.is_set():
-            try:
-                self.logger.info("Scheduled update started")
-                self.updater.run_update()
-                self.logger.info("Scheduled update completed")
-            except Exception as e:
-                self.logger.error(f"Scheduled update failed: {e}")
-            # Ждем указанный интервал или прерывание
-            for _ in range(self.interval):
-                if self._stop_event.is_set():
-                    break
-                time.sleep(1)
+        self._reset_queue()
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, len(self.jobs)), thread_name_prefix="rates-job"
+        )
+        try:
+            while self._queue and not self._stop_event.is_set():
+                for job, due in self._pop_due():
+                    executor.submit(self._execute, job, due)
+                # Спим до ближайшего срока или до остановки
+                self._stop_event.wait(self._seconds_until_next())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_event_loop(self) -> None:
+        """Фоновый поток с собственным циклом событий"""
+        asyncio.run(self.run_async())
+
+    async def _execute_async(
+        self, job: ScheduledJob, due: float, http: AsyncHttpClient
+    ) -> None:
+        started = self.clock()
+        failed = False
+        try:
+            if job.action is not None:
+                await asyncio.to_thread(job.action)
+            else:
+                await self.updater.run_update_async(source=job.name, http=http)
+        except Exception as e:
+            failed = True
+            self.logger.error(f"Scheduled update of {job.name} failed: {e}")
+        finally:
+            self._finish(job, due, started, failed)
+
+    async def run_async(self) -> None:
+        """Основной цикл планировщика в цикле событий"""
+        self._async_stop = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        http = AsyncHttpClient(pool_size=self.updater.config.HTTP_POOL_SIZE)
+        tasks: Set[asyncio.Task] = set()
+        self.logger.info("Scheduler running (asyncio)...")
+        self._reset_queue()
+        try:
+            while self._queue and not self._stop_event.is_set():
+                for job, due in self._pop_due():
+                    task = asyncio.create_task(self._execute_async(job, due, http))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                # Ждем ближайший срок или сигнал остановки
+                try:
+                    await asyncio.wait_for(
+                        self._async_stop.wait(), timeout=self._seconds_until_next()
+                    )
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await http.close()
+            self._loop = None
 
     def run_once(self) -> None:
         """Запускает одно обновление."""
@@ -0,0 +1,239 @@
+# valutatrade_hub/parser_service/sealed_segment.py
+"""
+Запечатанные сегменты истории: сжатые блоки со словарями и индексом
+"""
+
+import gzip
+import json
+import lzma
+import os
+import struct
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..infra.json_store import fsync_directory
+from .timestamps import from_epoch, to_epoch
+
+SEALED_SUFFIX = ".sealed"
+
+_MAGIC = b"VTHS\x01"
+# Хвост файла: смещение оглавления (uint64) и сигнатура
+_TRAILER = struct.Struct("<Q4s")
+_TRAILER_TAG = b"VTHS"
+
+_STANDARD_KEYS = frozenset(
+    ("id", "from_currency", "to_currency", "rate", "timestamp", "source", "meta")
+)
+
+CODECS: Dict[str, Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "gzip": (lambda data: gzip.compress(data, mtime=0), gzip.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+class _Interner:
+    """Словарь значений: значение -> номер в списке"""
+
+    def __init__(self):
+        self.values: List = []
+        self._ids: Dict = {}
+
+    def __call__(self, value) -> int:
+        key = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+        if key not in self._ids:
+            self._ids[key] = len(self.values)
+            self.values.append(value)
+        return self._ids[key]
+
+
+def _encode_block(records: List[Dict], codes, sources, metas) -> Tuple[bytes, int, int]:
+    """
+    Раскладывает записи блока по колонкам с номерами из словарей.
+
+    Метки времени хранятся разностями от предыдущей. Поля, которые не
+    восстанавливаются по остальным (id или метка времени нестандартного
+    вида, лишние ключи), попадают в разреженный словарь extra.
+    """
+    epochs, from_ids, to_ids, rates, source_ids, meta_ids = [], [], [], [], [], []
+    extra: Dict[str, Dict] = {}
+    previous = 0
+    for position, record in enumerate(records):
+        from_currency = record.get("from_currency", "")
+        to_currency = record.get("to_currency", "")
+        timestamp = record.get("timestamp")
+        try:
+            epoch = to_epoch(timestamp)
+        except (TypeError, ValueError):
+            epoch = previous
+        epochs.append(epoch - previous)
+        previous = epoch
+        from_ids.append(codes(from_currency))
+        to_ids.append(codes(to_currency))
+        rates.append(record.get("rate"))
+        source_ids.append(sources(record.get("source")))
+        meta_ids.append(metas(record.get("meta") or {}))
+
+        fields = {key: record[key] for key in record if key not in _STANDARD_KEYS}
+        if timestamp != from_epoch(epoch):
+            fields["timestamp"] = timestamp
+        if record.get("id") != f"{from_currency}_{to_currency}_{timestamp}":
+            fields["id"] = record.get("id")
+        if fields:
+            extra[str(position)] = fields
+
+    block = {
+        "e": epochs,
+        "f": from_ids,
+        "t": to_ids,
+        "r": rates,
+        "s": source_ids,
+        "m": meta_ids,
+        "x": extra,
+    }
+    payload = json.dumps(block, separators=(",", ":"), default=str).encode("utf-8")
+    absolute = []
+    total = 0
+    for delta in epochs:
+        total += delta
+        absolute.append(total)
+    return payload, min(absolute), max(absolute)
+
+
+def write_sealed(
+    path: str,
+    records: Iterable[Dict],
+    codec: str = "gzip",
+    block_records: int = 1024,
+) -> Dict:
+    """
+    Записывает записи в запечатанный сегмент (атомарно, через .tmp).
+
+    Returns:
+        Оглавление сегмента (словари, индекс блоков, число записей)
+    """
+    compress = CODECS[codec][0]
+    codes, sources, metas = _Interner(), _Interner(), _Interner()
+    blocks: List[List[int]] = []
+    count = 0
+    first_ts = last_ts = None
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_MAGIC)
+        offset = len(_MAGIC)
+
+        def flush(batch: List[Dict]) -> None:
+            nonlocal offset
+            payload, min_epoch, max_epoch = _encode_block(batch, codes, sources, metas)
+            data = compress(payload)
+            f.write(data)
+            # [min epoch, max epoch, смещение, длина, записей]
+            blocks.append([min_epoch, max_epoch, offset, len(data), len(batch)])
+            offset += len(data)
+
+        batch: List[Dict] = []
+        for record in records:
+            if first_ts is None:
+                first_ts = record.get("timestamp")
+            last_ts = record.get("timestamp")
+            batch.append(record)
+            count += 1
+            if len(batch) >= block_records:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+        footer = {
+            "version": 1,
+            "codec": codec,
+            "records": count,
+            "first_ts": first_ts,
+            "last_ts": last_ts,
+            "codes": codes.values,
+            "sources": sources.values,
+            "metas": metas.values,
+            "blocks": blocks,
+        }
+        f.write(json.dumps(footer, ensure_ascii=False, default=str).encode("utf-8"))
+        f.write(_TRAILER.pack(offset, _TRAILER_TAG))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(path))
+    return footer
+
+
+class SealedSegment:
+    """
+    Чтение запечатанного сегмента.
+
+    Записи лежат блоками по block_records, каждый блок сжат отдельно
+    (gzip или lzma). Коды валют, источники и meta заменены номерами в
+    словарях оглавления. Индекс блоков хранит минимальную и максимальную
+    метку времени, поэтому запрос по диапазону распаковывает только
+    пересекающиеся с ним блоки.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"не запечатанный сегмент: {path}")
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            trailer_offset = f.tell()
+            footer_offset, tag = _TRAILER.unpack(f.read(_TRAILER.size))
+            if tag != _TRAILER_TAG:
+                raise ValueError(f"поврежденный сегмент: {path}")
+            f.seek(footer_offset)
+            self.footer = json.loads(f.read(trailer_offset - footer_offset))
+        self._decompress = CODECS[self.footer["codec"]][1]
+
+    @property
+    def records(self) -> int:
+        return self.footer["records"]
+
+    def blocks_for(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> List[List[int]]:
+        """Блоки, метки времени которых пересекаются с [start, end]"""
+        return [
+            block
+            for block in self.footer["blocks"]
+            if (start is None or block[1] >= start) and (end is None or block[0] <= end)
+        ]
+
+    def iter_records(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """Записи сегмента (за диапазон [start, end], если он задан)"""
+        codes = self.footer["codes"]
+        sources = self.footer["sources"]
+        metas = self.footer["metas"]
+        with open(self.path, "rb") as f:
+            for _, _, offset, length, _ in self.blocks_for(start, end):
+                f.seek(offset)
+                block = json.loads(self._decompress(f.read(length)))
+                extra = block["x"]
+                epoch = 0
+                for position, delta in enumerate(block["e"]):
+                    epoch += delta
+                    if (start is not None and epoch < start) or (
+                        end is not None and epoch > end
+                    ):
+                        continue
+                    from_currency = codes[block["f"][position]]
+                    to_currency = codes[block["t"][position]]
+                    fields = extra.get(str(position), {})
+                    timestamp = fields.get("timestamp", from_epoch(epoch))
+                    meta = metas[block["m"][position]]
+                    record = {
+                        "id": f"{from_currency}_{to_currency}_{timestamp}",
+                        "from_currency": from_currency,
+                        "to_currency": to_currency,
+                        "rate": block["r"][position],
+                        "timestamp": timestamp,
+                        "source": sources[block["s"][position]],
+                        "meta": dict(meta) if isinstance(meta, dict) else meta,
+                    }
+                    record.update(fields)
+                    yield record
@@ -0,0 +1,163 @@
+# valutatrade_hub/parser_service/sqlite_history.py
+"""
+История курсов в таблице rate_history базы SQLite
+"""
+
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..infra.sqlite_store import SqliteStore
+from .timestamps import to_epoch
+
+# Строк на одну транзакцию удаления: дозапись ждет не дольше одной пачки
+_DELETE_BATCH = 5000
+
+
+class SqliteHistoryStore:
+    """
+    Бэкенд истории для RatesStorage поверх SqliteStore.
+
+    Диапазоны и поиск "курс на момент T" идут по индексу (pair, epoch).
+    """
+
+    def __init__(self, db_path: str):
+        self.store = SqliteStore(db_path)
+
+    def is_empty(self) -> bool:
+        row = self.store.connection().execute("SELECT 1 FROM rate_history LIMIT 1")
+        return row.fetchone() is None
+
+    def append(self, records: Iterable[Dict]) -> int:
+        """Добавляет записи одной транзакцией"""
+        rows = [
+            (
+                record["id"],
+                f"{record['from_currency']}_{record['to_currency']}".upper(),
+                record["from_currency"],
+                record["to_currency"],
+                float(record["rate"]),
+                record["timestamp"],
+                to_epoch(record["timestamp"]),
+                record.get("source", "unknown"),
+                json.dumps(record.get("meta") or {}, ensure_ascii=False, default=str),
+            )
+            for record in records
+        ]
+        with self.store.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO rate_history (id, pair, from_currency, to_currency, "
+                "rate, timestamp, epoch, source, meta) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def pairs(self) -> List[str]:
+        rows = self.store.connection().execute(
+            "SELECT DISTINCT pair FROM rate_history ORDER BY pair"
+        )
+        return [row[0] for row in rows]
+
+    def drop_before(self, epoch: int) -> int:
+        """Удаляет записи раньше epoch короткими транзакциями по индексу пары"""
+        dropped = 0
+        for pair in self.pairs():
+            while True:
+                with self.store.transaction() as conn:
+                    deleted = conn.execute(
+                        "DELETE FROM rate_history WHERE rowid IN ("
+                        "SELECT rowid FROM rate_history "
+                        "WHERE pair = ? AND epoch < ? LIMIT ?)",
+                        (pair, epoch, _DELETE_BATCH),
+                    ).rowcount
+                dropped += deleted
+                if deleted < _DELETE_BATCH:
+                    break
+        return dropped
+
+    def iter_records(self) -> Iterator[Dict]:
+        """Потоково отдает записи в порядке добавления"""
+        rows = self.store.connection().execute(
+            "SELECT id, from_currency, to_currency, rate, timestamp, source, meta "
+            "FROM rate_history ORDER BY rowid"
+        )
+        for row in rows:
+            record = dict(row)
+            record["meta"] = json.loads(record["meta"])
+            yield record
+
+    def iter_range(
+        self,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+        pairs: Optional[Iterable[str]] = None,
+    ) -> Iterator[Dict]:
+        """
+        Потоково отдает записи за [start, end] в порядке добавления.
+
+        С фильтром pairs выборка идет по индексу (pair, epoch).
+        """
+        query = (
+            "SELECT id, from_currency, to_currency, rate, timestamp, source, meta "
+            "FROM rate_history WHERE epoch >= ? AND epoch <= ?"
+        )
+        params: List = [
+            start if start is not None else -(2**63),
+            end if end is not None else 2**63 - 1,
+        ]
+        if pairs is not None:
+            wanted = sorted({pair.upper() for pair in pairs})
+            query += f" AND pair IN ({', '.join('?' * len(wanted))})"
+            params.extend(wanted)
+        rows = self.store.connection().execute(query + " ORDER BY rowid", params)
+        for row in rows:
+            record = dict(row)
+            record["meta"] = json.loads(record["meta"])
+            yield record
+
+    def get_series(
+        self,
+        pair: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[List[int], List[float]]:
+        """Колонки (epoch-секунды, курсы) пары за диапазон [start, end]"""
+        rows = self.store.connection().execute(
+            "SELECT epoch, rate FROM rate_history "
+            "WHERE pair = ? AND epoch >= ? AND epoch <= ? ORDER BY epoch",
+            (
+                pair.upper(),
+                start if start is not None else -(2**63),
+                end if end is not None else 2**63 - 1,
+            ),
+        )
+        timestamps: List[int] = []
+        rates: List[float] = []
+        for epoch, rate in rows:
+            timestamps.append(epoch)
+            rates.append(rate)
+        return timestamps, rates
+
+    def last_epoch(self, pair: str) -> Optional[int]:
+        """Самая поздняя метка времени пары (по индексу (pair, epoch))"""
+        row = (
+            self.store.connection()
+            .execute(
+                "SELECT MAX(epoch) FROM rate_history WHERE pair = ?", (pair.upper(),)
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def rate_at(self, pair: str, epoch: int) -> Optional[Tuple[int, float]]:
+        """Последний известный курс пары не позже момента epoch"""
+        row = (
+            self.store.connection()
+            .execute(
+                "SELECT epoch, rate FROM rate_history WHERE pair = ? AND epoch <= ? "
+                "ORDER BY epoch DESC LIMIT 1",
+                (pair.upper(), epoch),
+            )
+            .fetchone()
+        )
+        return (row["epoch"], row["rate"]) if row else None
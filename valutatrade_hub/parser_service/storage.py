@@ -4,11 +4,26 @@
 """
 
 import json
+import logging
 import os
+from array import array
 from datetime import datetime
-from typing import Dict, List
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
+from .columnar_store import ColumnarHistoryStore
 from .config import ParserConfig
+from .history_log import SegmentedHistoryLog
+from .history_tiers import HistoryTiers
+from .rate_index import RateIndex
+from .sqlite_history import SqliteHistoryStore
+from .timestamps import from_epoch, now_timestamp, to_epoch
+
+# Размер пачки при переносе истории между бэкендами
+_MIGRATION_CHUNK = 10000
+
+# Журнал запоздавших тиков: по нему кэши свечей пересчитывают закрытые свечи
+LATE_TICKS_FILE = "late_ticks.ndjson"
 
 
 class RatesStorage:
@@ -17,6 +32,11 @@ class RatesStorage:
     def __init__(self, config: ParserConfig):
         self.config = config
         self._ensure_data_dir()
+        self.history_backend = self._create_history_backend()
+        self.rate_index = self._create_rate_index()
+        # Свечи 1m/1h, в которые компакция сворачивает старые тики
+        self.tiers = HistoryTiers(self.config.HISTORY_TIERS_DIR)
+        self.logger = logging.getLogger(__name__)
 
     def _ensure_data_dir(self) -> None:
         """Создает директорию для данных, если её нет"""
@@ -24,20 +44,69 @@ class RatesStorage:
         if data_dir and not os.path.exists(data_dir):
             os.makedirs(data_dir)
 
-    def save_historical_record(
-        self,
+    def _create_history_backend(self):
+        """Создает бэкенд истории по настройке HISTORY_BACKEND"""
+        # HISTORY_FILE_PATH остается источником для однократной миграции
+        segment_log = SegmentedHistoryLog(
+            self.config.HISTORY_DIR,
+            segment_max_bytes=self.config.HISTORY_SEGMENT_MAX_BYTES,
+            legacy_file=self.config.HISTORY_FILE_PATH,
+        )
+        if self.config.HISTORY_BACKEND == "columnar":
+            store = ColumnarHistoryStore(self.config.HISTORY_COLUMNAR_DIR)
+        elif self.config.HISTORY_BACKEND == "sqlite":
+            store = SqliteHistoryStore(self.config.HISTORY_SQLITE_PATH)
+        else:
+            return segment_log
+
+        if store.is_empty():
+            # Переносим уже накопленную историю пачками
+            records = segment_log.iter_records()
+            while chunk := list(islice(records, _MIGRATION_CHUNK)):
+                store.append(chunk)
+        return store
+
+    def _create_rate_index(self) -> Optional[RateIndex]:
+        """Индекс по времени нужен только сегментам: у колонок и SQLite он свой"""
+        if not isinstance(self.history_backend, SegmentedHistoryLog):
+            return None
+        index = RateIndex(os.path.join(self.config.HISTORY_DIR, "index"))
+        log = self.history_backend
+        if not index.exists():
+            with log.file_lock.exclusive():
+                index.build(log.iter_records(), log.end_position())
+        elif index.mark() != log.end_position():
+            # Сбой между записью в журнал и в индекс: дочитываем хвост
+            with log.file_lock.exclusive():
+                index.catch_up(log.iter_after(index.mark()), log.end_position())
+        return index
+
+    def rebuild_index(self) -> int:
+        """Перестраивает индекс по времени из журнала истории"""
+        if self.rate_index is None:
+            return 0
+        log = self.history_backend
+        with log.file_lock.exclusive():
+            return self.rate_index.build(log.iter_records(), log.end_position())
+
+    @staticmethod
+    def _current_timestamp() -> str:
+        """Метка времени в формате истории (UTC, как читает to_epoch)"""
+        return now_timestamp()
+
+    @staticmethod
+    def _build_record(
         from_currency: str,
         to_currency: str,
         rate: float,
         source: str,
-        meta: Dict = None,
-    ) -> str:
-        """Сохраняет одну запись в историю"""
+        meta: Optional[Dict],
+        timestamp: str,
+    ) -> Dict:
+        """Формирует запись истории"""
         # Генерируем ID как в задании: BTC_USD_2025-10-10T12:00:00Z
-        timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-        record_id = f"{from_currency}_{to_currency}_{timestamp}"
-        record = {
-            "id": record_id,
+        return {
+            "id": f"{from_currency}_{to_currency}_{timestamp}",
             "from_currency": from_currency.upper(),
             "to_currency": to_currency.upper(),
             "rate": rate,
@@ -45,31 +114,353 @@ class RatesStorage:
             "source": source,
             "meta": meta or {},
         }
-        # Загружаем существующие данные
-        history = self.load_history()
-        history.append(record)
-        # Сохраняем обратно
-        with open(self.config.HISTORY_FILE_PATH, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, default=str)
-        return record_id
 
-    def load_history(self) -> List[Dict]:
-        """Загружает исторические данные"""
-        if not os.path.exists(self.config.HISTORY_FILE_PATH):
-            return []
+    def save_historical_record(
+        self,
+        from_currency: str,
+        to_currency: str,
+        rate: float,
+        source: str,
+        meta: Dict = None,
+    ) -> str:
+        """Сохраняет одну запись в историю"""
+        record = self._build_record(
+            from_currency, to_currency, rate, source, meta, self._current_timestamp()
+        )
+        # Дописываем только новую запись, без перезаписи истории
+        self._append([record])
+        return record["id"]
+
+    def save_historical_records(
+        self, records: Iterable[Dict], timestamp: Optional[str] = None
+    ) -> List[str]:
+        """
+        Сохраняет пачку записей одной операцией записи.
+
+        Args:
+            records: Словари с ключами from_currency, to_currency, rate,
+                source и необязательным meta
+            timestamp: Общая метка времени для всех записей тика
+
+        Returns:
+            Список ID сохраненных записей
+        """
+        timestamp = timestamp or self._current_timestamp()
+        batch = [
+            self._build_record(
+                item["from_currency"],
+                item["to_currency"],
+                item["rate"],
+                item["source"],
+                item.get("meta"),
+                timestamp,
+            )
+            for item in records
+        ]
+        return [record["id"] for record in self._append(batch)]
+
+    def _append(self, records: List[Dict]) -> List[Dict]:
+        """
+        Пишет записи в бэкенд истории и обновляет индекс.
+
+        Returns:
+            Записанные записи (без отклоненных _reject_compacted)
+        """
+        if self.rate_index is None:
+            records = self._reject_compacted(records)
+            late = self._late_ticks(records)
+            if records:
+                self.history_backend.append(records)
+        else:
+            # Журнал и индекс меняются под одной блокировкой журнала, чтобы
+            # отметка индекса точно указывала на конец проиндексированных записей
+            log = self.history_backend
+            with log.file_lock.exclusive():
+                records = self._reject_compacted(records)
+                late = self._late_ticks(records)
+                if records:
+                    log.append(records)
+                    self.rate_index.add(records, log.end_position())
+        if late:
+            self._note_late_ticks(late)
+        return records
+
+    def _reject_compacted(self, records: List[Dict]) -> List[Dict]:
+        """
+        Отбрасывает тики старше границы raw_from.
+
+        Этот участок уже свернут в свечи и читается только из ярусов, а
+        повторно компакция его не проходит: такой тик никогда не попал бы
+        ни в свечи, ни в выборки.
+        """
+        raw_from, _ = self.tiers.watermarks()
+        if raw_from is None:
+            return records
+        accepted = [r for r in records if to_epoch(r["timestamp"]) >= raw_from]
+        if len(accepted) < len(records):
+            self.logger.warning(
+                f"Rejected {len(records) - len(accepted)} ticks older than "
+                f"compaction watermark {from_epoch(raw_from)}"
+            )
+        return accepted
+
+    # Запоздавшие тики
+
+    @property
+    def late_ticks_path(self) -> str:
+        return os.path.join(self.config.HISTORY_DIR, LATE_TICKS_FILE)
+
+    def _late_ticks(self, records: List[Dict]) -> Dict[str, int]:
+        """Пары, в которые пачка добавляет тики раньше последнего сохраненного"""
+        earliest: Dict[str, int] = {}
+        for record in records:
+            pair = f"{record['from_currency']}_{record['to_currency']}".upper()
+            epoch = to_epoch(record["timestamp"])
+            earliest[pair] = min(epoch, earliest.get(pair, epoch))
+        late = {}
+        for pair, epoch in earliest.items():
+            last = self._series_source.last_epoch(pair)
+            if last is not None and epoch < last:
+                late[pair] = epoch
+        return late
+
+    def _note_late_ticks(self, late: Dict[str, int]) -> None:
+        # Строки короткие и пишутся с O_APPEND: процессы не перемешивают их
+        payload = "".join(
+            json.dumps({"pair": pair, "epoch": epoch}) + "\n"
+            for pair, epoch in late.items()
+        )
+        with open(self.late_ticks_path, "a", encoding="utf-8") as f:
+            f.write(payload)
+
+    def read_late_ticks(self, offset: int = 0) -> Tuple[List[Tuple[str, int]], int]:
+        """
+        Запоздавшие тики, записанные после смещения offset журнала.
+
+        Returns:
+            Пары с меткой самого раннего запоздавшего тика и новое смещение
+        """
         try:
-            with open(self.config.HISTORY_FILE_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
+            with open(self.late_ticks_path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    # Журнал пересоздан (например, make init-data)
+                    offset = 0
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # Недописанную последнюю строку оставляем до следующего чтения
+        complete = data[: data.rfind(b"\n") + 1]
+        entries = []
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+                entries.append((entry["pair"], int(entry["epoch"])))
+            except (ValueError, KeyError, TypeError):
+                continue
+        return entries, offset + len(complete)
+
+    def iter_history(self) -> Iterator[Dict]:
+        """Потоково читает исторические данные по сегментам"""
+        return self.history_backend.iter_records()
+
+    def iter_history_range(
+        self, start: Optional[int] = None, end: Optional[int] = None
+    ) -> Iterator[Dict]:
+        """
+        Потоково читает записи истории с меткой времени в [start, end].
+
+        У журнала сегментов запечатанные сегменты распаковывают только
+        блоки, пересекающиеся с диапазоном.
+        """
+        return self.history_backend.iter_range(start, end)
+
+    def iter_history_filtered(
+        self,
+        pairs: Optional[Iterable[str]] = None,
+        sources: Optional[Iterable[str]] = None,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        Потоково читает историю с фильтрами по парам, источникам и времени.
+
+        Записи не копятся в памяти: диапазон и пары отбирает бэкенд
+        (бинарный поиск в колонках, индекс SQLite, блоки запечатанных
+        сегментов), источник проверяется по ходу чтения без учета регистра.
+
+        Args:
+            pairs: Коды пар вида BTC_USD (None - все пары)
+            sources: Имена источников, например CoinGecko (None - все)
+            start: Начало диапазона, epoch-секунды включительно
+            end: Конец диапазона, epoch-секунды включительно
+        """
+        pairs = None if pairs is None else [pair.upper() for pair in pairs]
+        records = self.history_backend.iter_range(start, end, pairs)
+        if sources is None:
+            return records
+        wanted = {source.lower() for source in sources}
+        return (
+            record
+            for record in records
+            if str(record.get("source", "")).lower() in wanted
+        )
+
+    def seal_history(self) -> int:
+        """Запечатывает закрытые сегменты журнала истории (сжатие + индекс)"""
+        codec = self.config.HISTORY_SEAL_CODEC
+        if not codec or not isinstance(self.history_backend, SegmentedHistoryLog):
+            return 0
+        return self.history_backend.seal(codec, self.config.HISTORY_SEAL_BLOCK_RECORDS)
+
+    def load_history(self) -> List[Dict]:
+        """
+        Загружает всю историю списком.
+
+        Держит в памяти всю историю - для больших объемов нужны
+        iter_history_filtered или iter_history.
+        """
+        return list(self.iter_history())
+
+    @property
+    def _series_source(self):
+        """Источник отсортированных колонок: колоночный бэкенд или индекс"""
+        return self.rate_index or self.history_backend
+
+    def raw_pairs(self) -> List[str]:
+        """Пары, по которым есть сырые тики"""
+        return self._series_source.pairs()
+
+    def raw_series(
+        self,
+        pair: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[Sequence[int], Sequence[float]]:
+        """
+        Возвращает колонки (epoch-секунды, курсы) сырых тиков пары.
+
+        Колоночный бэкенд отдает срезы без копирования, SQLite - выборку по
+        индексу (pair, epoch), для сегментов колонки берутся из индекса.
+        """
+        return self._series_source.get_series(pair, start, end)
+
+    def drop_raw_before(self, epoch: int) -> int:
+        """
+        Удаляет сырые тики старше epoch (после свертки в ярусы).
+
+        Returns:
+            Сколько записей действительно удалено из бэкенда. Журнал
+            сегментов удаляет только целые сегменты, поэтому число может быть
+            меньше, чем тиков старше epoch
+        """
+        dropped = self.history_backend.drop_before(epoch)
+        if self.rate_index is not None:
+            self.rate_index.drop_before(epoch)
+        return dropped
+
+    def get_series(
+        self,
+        pair: str,
+        start: Optional[int] = None,
+        end: Optional[int] = None,
+    ) -> Tuple[Sequence[int], Sequence[float]]:
+        """
+        Возвращает колонки (epoch-секунды, курсы) пары за диапазон.
+
+        Каждый участок диапазона читается из самого подробного яруса, который
+        его покрывает: сырые тики, затем свечи 1m и 1h (начало интервала и
+        курс закрытия). Пока компакция не сдвигала границы, это просто
+        сырые тики.
+        """
+        plan = self.tiers.plan(self._series_source)
+        if len(plan) == 1:
+            return self.raw_series(pair, start, end)
+
+        timestamps, rates = array("q"), array("d")
+        for source, lo, hi in plan:
+            part_start = (
+                lo if start is None else start if lo is None else max(start, lo)
+            )
+            part_end = (
+                end if hi is None else hi - 1 if end is None else min(end, hi - 1)
+            )
+            if part_start is not None and part_end is not None:
+                if part_start > part_end:
+                    continue
+            part_ts, part_rates = source.get_series(pair, part_start, part_end)
+            timestamps.extend(int(epoch) for epoch in part_ts)
+            rates.extend(float(rate) for rate in part_rates)
+        return timestamps, rates
+
+    def _rate_at(self, pair: str, epoch: int) -> Optional[Tuple[int, float]]:
+        """
+        Курс на момент epoch из самого подробного яруса, где он есть.
 
-    def save_current_rates(self, rates: Dict) -> None:
+        Ярус свечей отдает закрытие последней свечи, закончившейся к epoch,
+        чтобы не заглядывать в будущее.
+        """
+        for source, lo, hi in reversed(self.tiers.plan(self._series_source)):
+            if lo is not None and epoch < lo:
+                continue
+            found = source.rate_at(pair, epoch if hi is None else min(epoch, hi - 1))
+            if found is not None:
+                return found
+        return None
+
+    def get_rate_at(self, pair: str, timestamp: Union[str, int]) -> Optional[Dict]:
+        """
+        Возвращает курс пары, действовавший на момент timestamp.
+
+        Args:
+            pair: Валютная пара вида BTC_USD
+            timestamp: Метка времени истории или epoch-секунды
+
+        Returns:
+            Словарь с курсом и временем записи или None, если данных нет
+        """
+        epoch = timestamp if isinstance(timestamp, int) else to_epoch(timestamp)
+        found = self._rate_at(pair, epoch)
+        if found is None:
+            return None
+        found_epoch, rate = found
+        return {
+            "pair": pair.upper(),
+            "rate": rate,
+            "timestamp": from_epoch(found_epoch),
+        }
+
+    def get_range(
+        self, pair: str, start: Union[str, int], end: Union[str, int]
+    ) -> List[Dict]:
+        """Возвращает курсы пары за интервал [start, end] по возрастанию времени"""
+        start_epoch = start if isinstance(start, int) else to_epoch(start)
+        end_epoch = end if isinstance(end, int) else to_epoch(end)
+        timestamps, rates = self.get_series(pair, start_epoch, end_epoch)
+        return [
+            {"timestamp": from_epoch(epoch), "rate": float(rate)}
+            for epoch, rate in zip(timestamps, rates)
+        ]
+
+    def save_current_rates(
+        self,
+        rates: Dict,
+        missing_sources: Optional[List[str]] = None,
+        stale_sources: Optional[List[str]] = None,
+    ) -> None:
         """Сохраняет текущие курсы в rates.json"""
         current_data = {
             "pairs": rates,
             "last_refresh": datetime.now().isoformat(),
             "source": "ParserService",
         }
+        if missing_sources:
+            # Провайдеры без ответа в этом обновлении (ошибка, опоздание,
+            # открытый выключатель)
+            current_data["missing_sources"] = missing_sources
+        if stale_sources:
+            # Провайдеры, чьи пары взяты из кэша их прошлого ответа
+            current_data["stale_sources"] = stale_sources
         with open(self.config.RATES_FILE_PATH, "w", encoding="utf-8") as f:
             json.dump(current_data, f, indent=2, default=str)
 
@@ -0,0 +1,32 @@
+# valutatrade_hub/parser_service/timestamps.py
+"""
+Преобразование меток времени истории в epoch-секунды и обратно
+"""
+
+import calendar
+import time
+from datetime import datetime, timezone
+
+HISTORY_TS_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def to_epoch(timestamp: str) -> int:
+    """Переводит метку времени истории в секунды UTC"""
+    try:
+        return calendar.timegm(time.strptime(timestamp, HISTORY_TS_FORMAT))
+    except (TypeError, ValueError):
+        # Старые записи могли сохраняться через isoformat()
+        parsed = datetime.fromisoformat(str(timestamp))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp())
+
+
+def from_epoch(epoch: int) -> str:
+    """Переводит секунды UTC в метку времени истории"""
+    return time.strftime(HISTORY_TS_FORMAT, time.gmtime(int(epoch)))
+
+
+def now_timestamp() -> str:
+    """Текущее время UTC в формате меток истории"""
+    return from_epoch(time.time())
@@ -4,13 +4,28 @@
 Простой обновлятель курсов
 """
 
+import asyncio
 import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 from .config import ParserConfig
-from .api_clients import CoinGeckoClient, ExchangeRateApiClient
+from .api_clients import (
+    FETCH_FAILED,
+    FETCH_FRESH,
+    CoinGeckoClient,
+    ExchangeRateApiClient,
+    FetchTicket,
+)
+from .async_http import AsyncHttpClient
+from .circuit_breaker import CircuitBreakerRegistry
+from .dedup import RateDeduplicator
+from .response_cache import ProviderResponseCache
 from .storage import RatesStorage
+from .timestamps import now_timestamp
 
 
 class RatesUpdater:
@@ -19,11 +34,40 @@ class RatesUpdater:
     def __init__(self):
         self.config = ParserConfig()
         self.storage = RatesStorage(self.config)
+        # В историю пишутся только изменившиеся курсы и контрольные записи
+        self.dedup = RateDeduplicator(
+            self.storage,
+            abs_epsilon=self.config.DEDUP_ABS_EPSILON,
+            rel_epsilon=self.config.DEDUP_REL_EPSILON,
+            heartbeat_seconds=self.config.DEDUP_HEARTBEAT_SECONDS,
+        )
         self.logger = logging.getLogger(__name__)
 
-        # Инициализируем клиенты
-        self.coingecko_client = CoinGeckoClient(self.config)
-        self.exchangerate_client = ExchangeRateApiClient(self.config)
+        # Инициализируем клиенты с общим кэшем ответов провайдеров
+        self.response_cache = ProviderResponseCache(self.config.PROVIDER_CACHE_PATH)
+        self.coingecko_client = CoinGeckoClient(self.config, self.response_cache)
+        self.exchangerate_client = ExchangeRateApiClient(
+            self.config, self.response_cache
+        )
+        self.providers = {
+            client.name: client
+            for client in (self.coingecko_client, self.exchangerate_client)
+        }
+
+        # Выключатели провайдеров: падающий провайдер пропускается
+        self.breakers = CircuitBreakerRegistry(
+            self.config.BREAKER_STATE_PATH,
+            failure_threshold=self.config.BREAKER_FAILURE_THRESHOLD,
+            base_delay=self.config.BREAKER_BASE_DELAY,
+            max_delay=self.config.BREAKER_MAX_DELAY,
+            jitter=self.config.BREAKER_JITTER,
+        )
+
+        # Итоги последнего обновления: задержки провайдеров и пропущенные
+        self.last_tick: Dict = {}
+        # Планировщик обновляет источники независимо, запись rates.json
+        # и истории из разных потоков идет по очереди
+        self._persist_lock = threading.Lock()
 
     def run_update(self, source: Optional[str] = None) -> Dict:
         """Запускает обновление курсов"""
@@ -36,56 +80,298 @@ class RatesUpdater:
         all_rates = {}
 
         try:
-            # 1. Получаем курсы криптовалют
-            should_fetch_crypto = source in (None, "coingecko")
-            should_fetch_fiat = source in (None, "exchangerate")
-
-            if should_fetch_crypto:
-                self.logger.info("Fetching crypto rates from CoinGecko...")
-                crypto_rates = self.coingecko_client.fetch_rates()
-                if crypto_rates:
-                    all_rates.update(crypto_rates)
-                    self.logger.info(f"Got {len(crypto_rates)} crypto rates")
-                else:
-                    self.logger.warning("No crypto rates received from CoinGecko")
-
-            if should_fetch_fiat:
-                self.logger.info("Fetching fiat rates from ExchangeRate-API...")
-                fiat_rates = self.exchangerate_client.fetch_rates()
-                if fiat_rates:
-                    all_rates.update(fiat_rates)
-                    self.logger.info(f"Got {len(fiat_rates)} fiat rates")
-                else:
-                    self.logger.warning("No fiat rates received from ExchangeRate-API")
-
-            # 2. Если API не вернули данные, используем демо
-            if not all_rates:
-                self.logger.warning("API returned no data, using demo")
-                all_rates = self._get_demo_rates()
-
-            # 3. Сохраняем текущие курсы
-            if all_rates:
-                self.storage.save_current_rates(all_rates)
-
-                # 4. Сохраняем в историю
-                for rate_key, rate_data in all_rates.items():
-                    from_currency, to_currency = rate_key.split("_")
-                    self.storage.save_historical_record(
-                        from_currency=from_currency,
-                        to_currency=to_currency,
-                        rate=rate_data["rate"],
-                        source=rate_data["source"],
-                        meta=rate_data.get("meta", {}),
-                    )
-                self.logger.info(f"Update complete. Total rates: {len(all_rates)}")
-                return all_rates
-            else:
-                self.logger.error("Failed to get any rates")
-                return {}
+            # 1. Опрашиваем провайдеров параллельно с общим сроком
+            names = [name for name in self.providers if source in (None, name)]
+            all_rates, missing, changed_rates = self._fetch_all(names)
+            all_rates, stale = self._with_other_sources(all_rates, names, missing)
+            return self._persist(all_rates, missing, changed_rates, stale)
         except Exception as e:
             self.logger.error(f"Critical update error: {e}")
             return self._get_demo_rates()
 
+    async def run_update_async(
+        self, source: Optional[str] = None, http: Optional[AsyncHttpClient] = None
+    ) -> Dict:
+        """
+        Асинхронный вариант run_update для работы в цикле событий.
+
+        Все провайдеры и их запросы идут в одном цикле, у каждого провайдера
+        свой семафор ASYNC_PROVIDER_CONCURRENCY. Переданный http-клиент
+        переиспользуется между вызовами (его соединения остаются открытыми),
+        иначе создается и закрывается временный.
+        """
+        self.logger.info(f"Starting async rates update (source: {source or 'all'})")
+        own_http = http is None
+        if own_http:
+            http = AsyncHttpClient(pool_size=self.config.HTTP_POOL_SIZE)
+        try:
+            names = [name for name in self.providers if source in (None, name)]
+            all_rates, missing, changed_rates = await self._fetch_all_async(names, http)
+            all_rates, stale = self._with_other_sources(all_rates, names, missing)
+            # Запись на диск не должна останавливать цикл событий
+            return await asyncio.to_thread(
+                self._persist, all_rates, missing, changed_rates, stale
+            )
+        except Exception as e:
+            self.logger.error(f"Critical update error: {e}")
+            return await asyncio.to_thread(self._get_demo_rates)
+        finally:
+            if own_http:
+                await http.close()
+
+    def _persist(
+        self,
+        all_rates: Dict,
+        missing: List[str],
+        changed_rates: Dict,
+        stale: Optional[List[str]] = None,
+    ) -> Dict:
+        """
+        Сохраняет курсы тика в rates.json и историю.
+
+        В историю попадают только changed_rates - курсы провайдеров, данные
+        которых действительно обновились с прошлого запроса. stale -
+        опрошенные провайдеры, чьи пары взяты из кэша их прошлого ответа.
+        """
+        # 2. Если API не вернули данные, используем демо
+        if not all_rates:
+            self.logger.warning("API returned no data, using demo")
+            all_rates = changed_rates = self._get_demo_rates()
+
+        # 3. Сохраняем текущие курсы
+        if all_rates:
+            with self._persist_lock:
+                self.storage.save_current_rates(all_rates, missing, stale)
+
+                # 4. Сохраняем в историю изменившиеся курсы одной записью
+                if changed_rates:
+                    self._save_history(changed_rates)
+                else:
+                    self.logger.info("Provider data unchanged, history not written")
+            self.logger.info(f"Update complete. Total rates: {len(all_rates)}")
+            return all_rates
+        else:
+            self.logger.error("Failed to get any rates")
+            return {}
+
+    def _save_history(self, rates: Dict) -> None:
+        """Пропускает курсы тика через дедупликацию и пишет их в историю"""
+        timestamp = now_timestamp()
+        records = self.dedup.filter(self._to_history_records(rates), timestamp)
+        suppressed = len(rates) - len(records)
+        self.last_tick["suppressed"] = suppressed
+        if not records:
+            self.logger.info(f"All {suppressed} rates unchanged, history not written")
+            return
+        try:
+            self.storage.save_historical_records(records, timestamp)
+        except Exception:
+            # Запись не удалась - последние значения перечитаем из истории
+            self.dedup.reset()
+            raise
+        self.logger.info(
+            f"History: {len(records)} rates written, {suppressed} unchanged suppressed"
+        )
+
+    def _with_other_sources(
+        self, all_rates: Dict, names: List[str], missing: List[str]
+    ) -> Tuple[Dict, List[str]]:
+        """
+        Дополняет курсы тика последними курсами провайдеров без ответа.
+
+        rates.json перезаписывается целиком, поэтому пары неопрошенных
+        провайдеров и провайдеров из missing (ошибка, опоздание, открытый
+        выключатель) берутся из кэша их последних ответов.
+
+        Returns:
+            Курсы и опрошенные провайдеры, чьи пары взяты из кэша (stale)
+        """
+        merged: Dict = {}
+        stale: List[str] = []
+        for name in self.providers:
+            if name in names and name not in missing:
+                continue
+            cached = self.response_cache.rates(name)
+            if not cached:
+                continue
+            merged.update(cached)
+            if name in names:
+                stale.append(name)
+        if stale:
+            self.last_tick["stale"] = stale
+            self.logger.warning(f"Using cached rates for: {', '.join(stale)}")
+        if not merged:
+            return all_rates, stale
+        merged.update(all_rates)
+        return merged, stale
+
+    def close(self) -> None:
+        """Закрывает HTTP-сессии клиентов"""
+        for client in self.providers.values():
+            client.close()
+
+    def _fetch_all(self, names: List[str]) -> Tuple[Dict, List[str], Dict]:
+        """
+        Опрашивает провайдеров параллельно, ожидая не дольше UPDATE_DEADLINE.
+
+        Returns:
+            Объединенные курсы успевших провайдеров, имена опоздавших и
+            курсы провайдеров, вернувших новые данные
+        """
+        started = time.perf_counter()
+        names, blocked = self._admit(names)
+        if not names:
+            return self._collect({}, started, blocked)
+
+        def timed_fetch(name: str, ticket: FetchTicket) -> Tuple[Dict, str, float]:
+            client = self.providers[name]
+            fetch_started = time.perf_counter()
+            rates = client.fetch_rates(ticket)
+            latency = time.perf_counter() - fetch_started
+            self.logger.info(f"Provider {name} answered in {latency:.3f}s")
+            # Итог запроса читается в том же потоке, что и выполнял запрос
+            return rates, client.last_fetch_status, latency
+
+        tickets = {name: FetchTicket() for name in names}
+        executor = ThreadPoolExecutor(
+            max_workers=len(names), thread_name_prefix="rates-fetch"
+        )
+        futures = {
+            name: executor.submit(timed_fetch, name, tickets[name]) for name in names
+        }
+        done, _ = wait(futures.values(), timeout=self.config.UPDATE_DEADLINE)
+        results: Dict[str, Optional[Future]] = {}
+        for name, future in futures.items():
+            # Опоздавший запрос, который уже записал ответ в кэш, дожидаемся:
+            # иначе новые курсы потеряются для истории
+            if future in done or not tickets[name].revoke():
+                results[name] = future
+            else:
+                results[name] = None
+        # Опоздавшие запросы доработают в фоне (таймаут запроса ограничен
+        # сроком обновления), но с отозванным билетом кэш не изменят
+        executor.shutdown(wait=False)
+
+        return self._collect(results, started, blocked)
+
+    async def _fetch_all_async(
+        self, names: List[str], http: AsyncHttpClient
+    ) -> Tuple[Dict, List[str], Dict]:
+        """Асинхронный вариант _fetch_all с тем же сроком UPDATE_DEADLINE"""
+        started = time.perf_counter()
+        names, blocked = self._admit(names)
+        if not names:
+            return self._collect({}, started, blocked)
+
+        async def timed_fetch(name: str) -> Tuple[Dict, str, float]:
+            client = self.providers[name]
+            fetch_started = time.perf_counter()
+            semaphore = asyncio.Semaphore(self.config.ASYNC_PROVIDER_CONCURRENCY)
+            rates = await client.fetch_rates_async(http, semaphore)
+            latency = time.perf_counter() - fetch_started
+            self.logger.info(f"Provider {name} answered in {latency:.3f}s")
+            return rates, client.last_fetch_status, latency
+
+        tasks = {name: asyncio.create_task(timed_fetch(name)) for name in names}
+        done, pending = await asyncio.wait(
+            tasks.values(), timeout=self.config.UPDATE_DEADLINE
+        )
+        for task in pending:
+            task.cancel()
+
+        return self._collect(
+            {name: t if t in done else None for name, t in tasks.items()},
+            started,
+            blocked,
+        )
+
+    def _admit(self, names: List[str]) -> Tuple[List[str], List[str]]:
+        """Делит провайдеров на опрашиваемых и пропускаемых выключателем"""
+        allowed, blocked = [], []
+        for name in names:
+            if self.breakers.get(name).allow_request():
+                allowed.append(name)
+            else:
+                blocked.append(name)
+                self.logger.warning(f"Provider {name} skipped: circuit open")
+        return allowed, blocked
+
+    def _collect(
+        self,
+        results: Dict[str, Optional[Future]],
+        started: float,
+        blocked: List[str],
+    ) -> Tuple[Dict, List[str], Dict]:
+        """
+        Разбирает завершенные запросы провайдеров (None - не успел к сроку),
+        передает исход выключателям и записывает итоги тика в last_tick.
+        """
+        all_rates: Dict = {}
+        changed_rates: Dict = {}
+        latency: Dict[str, float] = {}
+        statuses: Dict[str, str] = {name: "circuit_open" for name in blocked}
+        missing: List[str] = list(blocked)
+        for name, result in results.items():
+            breaker = self.breakers.get(name)
+            if result is None:
+                missing.append(name)
+                statuses[name] = "late"
+                breaker.record_failure("deadline exceeded")
+                self.logger.warning(
+                    f"Provider {name} missed the update deadline "
+                    f"({self.config.UPDATE_DEADLINE}s)"
+                )
+                continue
+            try:
+                rates, statuses[name], latency[name] = result.result()
+            except Exception as e:
+                missing.append(name)
+                statuses[name] = FETCH_FAILED
+                breaker.record_failure(str(e))
+                self.logger.error(f"Provider {name} failed: {e}")
+                continue
+            if statuses[name] == FETCH_FAILED:
+                breaker.record_failure("request failed")
+            else:
+                breaker.record_success()
+            if rates:
+                all_rates.update(rates)
+                if statuses[name] == FETCH_FRESH:
+                    changed_rates.update(rates)
+                self.logger.info(
+                    f"Got {len(rates)} rates from {name} ({statuses[name]})"
+                )
+            else:
+                missing.append(name)
+                self.logger.warning(f"No rates received from {name}")
+
+        self.last_tick = {
+            "elapsed": round(time.perf_counter() - started, 3),
+            "latency": {name: round(value, 3) for name, value in latency.items()},
+            "statuses": statuses,
+            "missing": missing,
+        }
+        if results:
+            self.breakers.save()
+        return all_rates, missing, changed_rates
+
+    @staticmethod
+    def _to_history_records(rates: Dict) -> List[Dict]:
+        """Преобразует словарь курсов в записи для истории"""
+        records = []
+        for rate_key, rate_data in rates.items():
+            from_currency, to_currency = rate_key.split("_")
+            records.append(
+                {
+                    "from_currency": from_currency,
+                    "to_currency": to_currency,
+                    "rate": rate_data["rate"],
+                    "source": rate_data["source"],
+                    "meta": rate_data.get("meta", {}),
+                }
+            )
+        return records
+
     def _get_demo_rates(self) -> Dict:
         """Возвращает демонстрационные курсы"""
         demo_rates = {